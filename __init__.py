@@ -25,17 +25,17 @@ import requests
 
 from aqt import mw
 from aqt.qt import (
-    QAction, QDialog, QWidget, QHBoxLayout, QVBoxLayout, QListWidget, QListWidgetItem,
+    QAction, QDialog, QWidget, QHBoxLayout, QVBoxLayout, QListWidget,
     QTabWidget, QTextEdit, QLineEdit, QPushButton, QLabel, pyqtSignal, QColor,
     QDialogButtonBox, QFormLayout, Qt, QMenu, QInputDialog, QFont, QColorDialog,
-    QTextBrowser, QAbstractItemView, QFrame, QComboBox, QIcon, QSize, QStyle
+    QTextBrowser, QAbstractItemView, QFrame, QComboBox, QSize, QStyle, QListView, QTreeView, QModelIndex
 )
 from aqt.utils import tooltip
 from aqt import gui_hooks
 
 from .quiz import QuizManager
-from .metas import GoalsManager
-from .moderacao import ModerationDialog
+from .metas import GoalsManager, GoalsTableModel, GoalsFilterProxyModel
+from .moderacao import ModerationDialog, run_bulk_moderation
 from .chat import ChatManager
 from .halldafama import HallOfFameTab
 from .meulegado import LegacyTab
@@ -43,6 +43,22 @@ from .mudaridioma import LanguageManager
 from .zoom import ZoomManager
 from .auth import AuthManager, FirebaseAPI, background_updater
 from .traducao import TranslationManager
+from .historico import (
+    HISTORY_PAGE_SIZE, TOMBSTONE_RETENTION_DAYS, MessageHistory, compact_message_buckets, newest_timestamp
+)
+from .cachelocal import TOMBSTONE_BOUNDARY_KEY, TOMBSTONE_CURSOR_KEY, LocalMessageCache
+from .busca import MessageSearchIndex, MessageSearchDialog
+from .canais import ChannelManager
+from .protocolo import is_correct_answer_event
+from .latencia import CLOCK_PROBE_ROOT, LatencyTracker, estimate_clock_offset
+from .diagnostico import LatencyDialog
+from .presenca import PresenceManager
+from .flags import FlagAssets, FlagComboModel
+from .usuarios import OFFLINE_HEADER_KEY, UserFilterProxyModel, UserListModel
+from .liga import (
+    DivisionGoalsSync, GoalFlagsSync, HallOfFameSync, LeaderboardBuilder, LeaderboardSync, get_goal, goal_division, leaderboard_goals,
+    UsersSync, migrate_goals_to_shards, migrate_medal_counts, put_goal, put_user
+)
 
 class ChatWindow(QDialog):
     new_messages_polled = pyqtSignal(dict)
@@ -58,9 +74,14 @@ class ChatWindow(QDialog):
     quiz_ranking_data_fetched = pyqtSignal(dict, dict)
     quiz_score_updated = pyqtSignal(str) 
     history_loaded = pyqtSignal(list)
+    older_history_loaded = pyqtSignal(list)
+    older_private_messages_loaded = pyqtSignal(str, dict)
+    private_message_failed = pyqtSignal(str, object)
+    messages_deleted = pyqtSignal(list)
     
     quiz_start_command_received = pyqtSignal(dict)
     quiz_stop_command_received = pyqtSignal()
+    goals_rows_ready = pyqtSignal(int, str, object)
     main_ranking_update_signal = pyqtSignal() # <<< 1. SINAL DEFINIDO AQUI
 
     def __init__(self, parent=None):
@@ -74,7 +95,9 @@ class ChatWindow(QDialog):
         self.login_history_file = os.path.join(self.addon_path, 'login_history.json')
         self.flags_path = os.path.join(self.addon_path, 'bandeiras')
         os.makedirs(self.flags_path, exist_ok=True)
-        self.user_flags_cache = {}
+        self.flag_assets = FlagAssets(self.flags_path)
+        self.last_user_list_data = None
+        self.offline_expanded_before_search = None
         self.current_flag_filename = None
 
         self.nickname = "Convidado"; self.email = None; self.id_token = None
@@ -104,9 +127,27 @@ class ChatWindow(QDialog):
         self.lang_manager = LanguageManager(self)
         self.zoom_manager = ZoomManager(self)
         self.chat_manager = ChatManager(self)
+        self.channel_manager = ChannelManager(self)
         self.quiz_manager = QuizManager(self.firebase, self, self.addon_path)
         self.goals_manager = GoalsManager(self)
         self.translation_manager = TranslationManager(self)
+        self.message_history = MessageHistory(self.firebase, self)
+        self.loading_older_history = False
+        self.message_cache = None
+        self.tombstone_cursor = None
+        self.tombstone_boundary_ids = set()
+        self.search_index = None
+        self.search_dialog = None
+        self.pending_jump = None
+        self.latency_tracker = LatencyTracker()
+        self.presence_manager = PresenceManager(self.firebase, self)
+        self.goals_sync = DivisionGoalsSync(self.firebase)
+        self.leaderboard_builder = LeaderboardBuilder(self.firebase, self.goals_sync)
+        self.leaderboard_sync = LeaderboardSync(self.firebase)
+        self.hall_of_fame_sync = HallOfFameSync(self.firebase)
+        self.goal_flags_sync = GoalFlagsSync(self.firebase)
+        self.users_sync = UsersSync(self.firebase)
+        self.latency_dialog = None
         
         self._ = self.lang_manager._
 
@@ -122,8 +163,13 @@ class ChatWindow(QDialog):
         self.quiz_ranking_data_fetched.connect(self._render_quiz_ranking_gui)
         self.quiz_score_updated.connect(self._optimistically_update_ranking)
         self.history_loaded.connect(self._on_history_loaded)
+        self.older_history_loaded.connect(self._on_older_history_loaded)
+        self.older_private_messages_loaded.connect(self.chat_manager.on_older_private_messages_loaded)
+        self.private_message_failed.connect(self.chat_manager.on_private_message_failed)
+        self.messages_deleted.connect(self._on_messages_deleted)
 
         self.goals_update_received.connect(self.update_goals_list)
+        self.goals_rows_ready.connect(self.goals_manager.apply_goals_rows)
         self.hall_of_fame_update_received.connect(self.hall_of_fame_widget.populate_users)
         self.legacy_update_received.connect(self.legacy_tab.update_display)
         self.translation_manager.translation_finished.connect(self.update_message_with_translation)
@@ -148,6 +194,7 @@ class ChatWindow(QDialog):
         
         self.flag_combo = QComboBox(); self.flag_combo.setFont(font); self.flag_combo.hide()
         self.flag_combo.setMaxVisibleItems(10)
+        self.flag_combo_model = None
         
         self.populate_flag_combobox()
         self.flag_combo.currentIndexChanged.connect(self.on_flag_selected)
@@ -159,6 +206,10 @@ class ChatWindow(QDialog):
         self.quiz_button.setAutoDefault(False)
         self.quiz_button.hide()
 
+        self.channels_button = QPushButton(); self.channels_button.setFont(font); self.channels_button.clicked.connect(self.channel_manager.show_dialog)
+        self.channels_button.setAutoDefault(False)
+        self.channels_button.hide()
+
         self.admin_buttons_widget = QWidget()
         admin_layout = QVBoxLayout(self.admin_buttons_widget)
         admin_layout.setContentsMargins(0,0,0,0)
@@ -167,8 +218,19 @@ class ChatWindow(QDialog):
         self.admin_buttons_widget.hide()
 
         self.users_label = QLabel(); self.users_label.setFont(font)
-        self.user_list = QListWidget()
-        self.user_list.itemDoubleClicked.connect(self.chat_manager.on_user_double_clicked)
+        self.user_search_input = QLineEdit(); self.user_search_input.setFont(font)
+        self.user_search_input.setClearButtonEnabled(True)
+        self.user_search_input.textChanged.connect(self.filter_user_list)
+        # Modelo + proxy: só as linhas visíveis são desenhadas, e os offline entram aos poucos ao rolar.
+        self.user_list_model = UserListModel(self, self)
+        self.user_list_proxy = UserFilterProxyModel(self)
+        self.user_list_proxy.setSourceModel(self.user_list_model)
+        self.user_list_proxy.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.user_list = QListView()
+        self.user_list.setUniformItemSizes(True)
+        self.user_list.setModel(self.user_list_proxy)
+        self.user_list.clicked.connect(self.on_user_list_clicked)
+        self.user_list.doubleClicked.connect(self.on_user_list_double_clicked)
         self.user_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.user_list.customContextMenuRequested.connect(self.show_user_context_menu)
         
@@ -176,8 +238,9 @@ class ChatWindow(QDialog):
         left_layout.addWidget(self.flag_combo)
         left_layout.addWidget(self.change_color_button); left_layout.addWidget(self.logout_button)
         left_layout.addWidget(self.quiz_button)
+        left_layout.addWidget(self.channels_button)
         left_layout.addWidget(self.admin_buttons_widget)
-        left_layout.addWidget(self.users_label); left_layout.addWidget(self.user_list)
+        left_layout.addWidget(self.users_label); left_layout.addWidget(self.user_search_input); left_layout.addWidget(self.user_list)
         
         right_panel = QWidget(); right_layout = QVBoxLayout(right_panel)
         
@@ -190,6 +253,22 @@ class ChatWindow(QDialog):
         self.refresh_button.clicked.connect(self.force_full_refresh)
         self.refresh_button.hide()
         top_right_layout.addWidget(self.refresh_button)
+
+        self.search_button = QPushButton()
+        self.search_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogContentsView))
+        self.search_button.setToolTip("Buscar no histórico de mensagens")
+        self.search_button.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.search_button.clicked.connect(self.show_search_dialog)
+        self.search_button.hide()
+        top_right_layout.addWidget(self.search_button)
+
+        self.latency_button = QPushButton()
+        self.latency_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ComputerIcon))
+        self.latency_button.setToolTip("Diagnóstico de latência das mensagens")
+        self.latency_button.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.latency_button.clicked.connect(self.show_latency_dialog)
+        self.latency_button.hide()
+        top_right_layout.addWidget(self.latency_button)
         
         self.lang_button = QPushButton("EN/PT"); self.lang_button.setCursor(Qt.CursorShape.PointingHandCursor)
         self.lang_button.clicked.connect(self.lang_manager.toggle_language)
@@ -238,20 +317,37 @@ class ChatWindow(QDialog):
         search_layout.addWidget(self.search_input)
         goals_layout.addLayout(search_layout)
 
-        self.goals_area = QTextBrowser(); self.goals_area.setReadOnly(True)
-        self.goals_area.setOpenExternalLinks(True)
+        self.goals_header_label = QLabel()
+        goals_layout.addWidget(self.goals_header_label)
+        # Uma linha por série, com os usuários dentro; a busca só filtra o proxy, sem recalcular nada.
+        self.goals_model = GoalsTableModel(self, self)
+        self.goals_proxy = GoalsFilterProxyModel(self)
+        self.goals_proxy.setSourceModel(self.goals_model)
+        self.goals_view = QTreeView()
+        self.goals_view.setModel(self.goals_proxy)
+        self.goals_view.setUniformRowHeights(True)
+        self.goals_view.setAlternatingRowColors(False)
+        self.goals_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.goals_view.setSortingEnabled(True)
+        self.goals_view.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+        self.goals_view.verticalScrollBar().valueChanged.connect(self.goals_manager.on_goals_scrolled)
+        self.goals_view.expanded.connect(self.goals_manager.on_division_expanded)
+        self.goals_proxy.rowsInserted.connect(self.span_goals_division_rows)
+        self.goals_proxy.layoutChanged.connect(self.span_goals_division_rows)
+        self.goals_proxy.modelReset.connect(self.span_goals_division_rows)
         bottom_goals_layout = QHBoxLayout()
         self.edit_goal_button = QPushButton(); self.edit_goal_button.setFont(font)
         self.edit_goal_button.clicked.connect(lambda: self.goals_manager.edit_my_goal())
         self.about_game_button = QPushButton(); self.about_game_button.setFont(font); self.about_game_button.clicked.connect(self.show_about_game)
         bottom_goals_layout.addWidget(self.edit_goal_button); bottom_goals_layout.addWidget(self.about_game_button)
-        goals_layout.addWidget(self.goals_area); goals_layout.addLayout(bottom_goals_layout)
+        goals_layout.addWidget(self.goals_view); goals_layout.addLayout(bottom_goals_layout)
         
         self.main_chat_area = QListWidget()
         self.main_chat_area.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
         self.main_chat_area.setFrameShape(QFrame.Shape.NoFrame)
         self.main_chat_area.setWordWrap(True)
         self.main_chat_area.itemSelectionChanged.connect(self.chat_manager.on_message_selection_changed)
+        self.main_chat_area.verticalScrollBar().valueChanged.connect(self.on_main_chat_scrolled)
         
         quiz_tab_widget = QWidget()
         quiz_tab_widget.setObjectName("quiz_tab_widget")
@@ -348,12 +444,21 @@ class ChatWindow(QDialog):
         self.change_color_button.show()
         self.logout_button.show()
         self.quiz_button.show()
+        self.channels_button.show()
         self.refresh_button.show()
+        self.search_button.show()
+        self.latency_button.show()
         if self.email == self.admin_email:
             self.admin_buttons_widget.show()
-            threading.Thread(target=self.goals_manager.check_and_process_season_end, daemon=True).start()
+            threading.Thread(target=self._run_league_maintenance, daemon=True).start()
+            threading.Thread(target=compact_message_buckets, args=(self.firebase, self.id_token), daemon=True).start()
         
         threading.Thread(target=self._ensure_user_data_exists, daemon=True).start()
+        threading.Thread(target=self.chat_manager.migrate_legacy_private_messages, daemon=True).start()
+        threading.Thread(target=self._sync_clock_offset, daemon=True).start()
+        self._open_message_cache()
+        self._open_search_index()
+        self.channel_manager.restore_from_cache()
         self.force_full_refresh()
         
         threading.Thread(target=self.poll_for_updates, daemon=True).start()
@@ -381,7 +486,7 @@ class ChatWindow(QDialog):
 
         self.is_connected = False
         if self.nickname != "Convidado":
-            self.firebase.delete_data(f"online/{self.uid}", self.id_token)
+            self.presence_manager.go_offline()
         
         time.sleep(0.1)
         self.nickname = "Convidado"
@@ -401,19 +506,42 @@ class ChatWindow(QDialog):
         self.change_color_button.hide()
         self.logout_button.hide()
         self.quiz_button.hide()
+        self.channels_button.hide()
         self.admin_buttons_widget.hide()
         self.delete_msg_button.hide()
         self.translate_button.hide()
         self.refresh_button.hide()
+        self.search_button.hide()
+        if self.search_dialog: self.search_dialog.close()
+        self.latency_button.hide()
+        if self.latency_dialog: self.latency_dialog.close()
+        self.latency_tracker.reset()
         self.message_input.setEnabled(False)
         self.send_button.setEnabled(False)
         self.message_input.setPlaceholderText("Faça login para enviar mensagens...")
-        self.user_list.clear()
+        self.user_search_input.clear()
+        self.user_list_model.clear()
+        self.last_user_list_data = None
         self.main_chat_area.clear()
         self.quiz_chat_area.clear()
         self.chat_manager.clear_state()
+        self.channel_manager.clear_state()
+        if self.message_cache:
+            self.message_cache.close()
+            self.message_cache = None
+        self.tombstone_cursor = None
+        self.tombstone_boundary_ids = set()
+        self.search_index = None
+        self.pending_jump = None
         self.current_flag_filename = None
         self.cached_goals_data = None
+        self.goals_manager.reset_render_cache()
+        self.goals_sync.reset()
+        self.leaderboard_builder.reset()
+        self.leaderboard_sync.reset()
+        self.hall_of_fame_sync.reset()
+        self.goal_flags_sync.reset()
+        self.users_sync.reset()
         self.search_input.clear()
         
         for i in range(self.tabs.count() - 1, 4, -1):
@@ -427,26 +555,14 @@ class ChatWindow(QDialog):
         webbrowser.open("https://ankichatapp.web.app")
 
     def populate_flag_combobox(self):
+        # O modelo é criado uma vez; nas trocas de idioma só o texto da linha 0 muda.
+        if self.flag_combo.model() is self.flag_combo_model:
+            self.flag_combo_model.set_placeholder(self._("choose_flag"))
+            return
         self.flag_combo.blockSignals(True)
-        current_data = self.flag_combo.currentData()
-        self.flag_combo.clear()
-        self.flag_combo.addItem(self._("choose_flag"))
-        self.flag_combo.setItemData(0, "", Qt.ItemDataRole.UserRole)
-        
-        try:
-            flag_files = sorted([f for f in os.listdir(self.flags_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))])
-            for filename in flag_files:
-                country_name = os.path.splitext(filename)[0].replace("_", " ").title()
-                icon_path = os.path.join(self.flags_path, filename)
-                self.flag_combo.addItem(QIcon(icon_path), country_name)
-                self.flag_combo.setItemData(self.flag_combo.count() - 1, filename, Qt.ItemDataRole.UserRole)
-        except FileNotFoundError:
-            pass
-        
-        index = self.flag_combo.findData(current_data)
-        if index != -1:
-            self.flag_combo.setCurrentIndex(index)
-
+        self.flag_combo_model = FlagComboModel(self.flag_assets, self._("choose_flag"), self.flag_combo)
+        self.flag_combo.setModel(self.flag_combo_model)
+        self.flag_combo.setCurrentIndex(0)
         self.flag_combo.blockSignals(False)
 
     def on_flag_selected(self, index):
@@ -471,9 +587,9 @@ class ChatWindow(QDialog):
 
     def _async_save_flag(self, flag_filename):
         if not self.is_connected: return
-        goal_data = self.firebase.get_data(f"goals/{self.uid}", self.id_token) or {}
+        goal_data = get_goal(self.firebase, self.uid, self.id_token) or {}
         goal_data['flag'] = flag_filename
-        self.firebase.put_data(f"goals/{self.uid}", goal_data, self.id_token)
+        put_goal(self.firebase, self.uid, goal_data, self.id_token)
         tooltip("Bandeira atualizada!")
         self.current_flag_filename = flag_filename
 
@@ -490,40 +606,54 @@ class ChatWindow(QDialog):
 
     def _ensure_user_data_exists(self):
         if not self.is_connected: return
-        self.firebase.put_data(f"users/{self.uid}", {"nickname": self.nickname}, self.id_token)
+        put_user(self.firebase, self.uid, self.nickname, self.id_token)
         self.firebase.put_data(f"nick_to_uid/{self.nickname}", self.uid, self.id_token)
         
-        goal_data = self.firebase.get_data(f"goals/{self.uid}", self.id_token)
+        goal_data = get_goal(self.firebase, self.uid, self.id_token)
         if goal_data is None:
             print(f"AnkiChat: Criando entrada de 'goals' para o usuário {self.nickname}")
-            self.firebase.put_data(f"goals/{self.uid}", {"division": "D"}, self.id_token)
+            goal_data = {"division": "D"}
+            put_goal(self.firebase, self.uid, goal_data, self.id_token)
+        # A aba de metas começa pela série do próprio usuário; as outras descem quando são abertas.
+        self.open_goals_division(goal_division(goal_data))
 
     def poll_for_updates(self):
         while self.is_connected:
             try:
-                presence_data = {"nickname": self.nickname, "state": "online"}
-                self.firebase.put_data(f"online/{self.uid}", presence_data, self.id_token)
+                self.presence_manager.heartbeat_if_due()
 
-                all_messages = self.firebase.get_data("messages", self.id_token)
+                all_messages = self.message_history.fetch_current()
+                all_messages.update(self.chat_manager.fetch_private_messages())
+                all_messages.update(self.channel_manager.fetch_current())
                 if all_messages:
+                    if self.message_cache: self.message_cache.store_messages(all_messages)
                     self.new_messages_polled.emit(all_messages)
-
-                online_users_data = self.firebase.get_data("online", self.id_token) or {}
-                all_users_data = self.firebase.get_data("users", self.id_token) or {}
-                goals_data = self.firebase.get_data("goals", self.id_token) or {}
-                all_achievements = self.firebase.get_data("achievements", self.id_token) or {}
+                self._sync_tombstones()
+
+                online_users_data = self.presence_manager.fetch_online()
+                # Só os usuários gravados desde o último ciclo descem; o nó inteiro, de tempos em tempos.
+                all_users_data = self.users_sync.fetch(self.id_token)
+                leaderboard, goals_data = self._fetch_league(all_users_data)
+                goal_flags = self.goal_flags_sync.fetch(self.id_token)
+                # Uma leitura de league_status por ciclo: o cabeçalho das metas e o comando do quiz saem dela.
+                league_status = self.firebase.get_data("league_status", self.id_token) or {}
+                # Só hall_of_fame/version por ciclo; os contadores descem quando ela muda.
+                hall_of_fame = self.hall_of_fame_sync.fetch(self.id_token)
                 my_legacy_data = self.firebase.get_data(f"legacy/{self.uid}", self.id_token) or {}
                 
                 self.user_update_received.emit({
                     'online_users': online_users_data,
                     'all_users': all_users_data,
-                    'goals': goals_data
+                    'goals': goals_data,
+                    'flags': goal_flags
                 })
-                self.goals_update_received.emit({'users': all_users_data, 'goals': goals_data})
-                self.hall_of_fame_update_received.emit({"users": all_users_data, "achievements": all_achievements})
+                self.goals_update_received.emit({'users': all_users_data, 'goals': goals_data, 'flags': goal_flags,
+                                                 'leaderboard': leaderboard, 'divisions': sorted(self.goals_sync.wanted),
+                                                 'league_status': league_status})
+                self.hall_of_fame_update_received.emit({"users": all_users_data, "hall_of_fame": hall_of_fame})
                 self.legacy_update_received.emit(my_legacy_data)
 
-                quiz_command = self.firebase.get_data("league_status/current_quiz", self.id_token)
+                quiz_command = league_status.get("current_quiz")
                 self.current_quiz_data = quiz_command
 
                 if quiz_command and not self.quiz_manager.is_active:
@@ -541,6 +671,7 @@ class ChatWindow(QDialog):
             return
             
         sorted_messages = sorted(messages.items(), key=lambda item: item[1].get('timestamp', 0))
+        if self.search_index: self.search_index.add_messages(messages)
 
         for msg_id, msg_data in sorted_messages:
             local_id = msg_data.get('local_id')
@@ -559,6 +690,7 @@ class ChatWindow(QDialog):
                             original_html = label.text()
                             clean_html = re.sub(r'^<font color="grey">(.*)</font>$', r'\1', original_html)
                             label.setText(clean_html)
+                self.chat_manager.confirm_pending_message(local_id, msg_id, msg_data)
                 self.displayed_message_ids.add(msg_id)
 
             elif msg_id not in self.displayed_message_ids:
@@ -570,16 +702,38 @@ class ChatWindow(QDialog):
                     self.uid == self.current_quiz_data.get("host_uid")
                 )
 
-                if is_this_client_host and text.isdigit() and not msg_data.get('quiz_event'):
+                if is_this_client_host and text.isdigit() and not msg_data.get('quiz_event') and not msg_data.get('target') and not msg_data.get('channel'):
                     self.quiz_manager.handle_answer(msg_data.get('nick'), msg_data.get('uid'), text)
                 
                 # <<< 3. LÓGICA DE ATUALIZAÇÃO CORRIGIDA >>>
-                if msg_data.get("quiz_event") and "acertou!" in text:
+                if is_correct_answer_event(msg_data):
                     self.main_ranking_update_signal.emit()
 
                 self.chat_manager.display_message(msg_id, msg_data)
                 self.displayed_message_ids.add(msg_id)
 
+    def _fetch_league(self, users_data):
+        """(classificação pronta ou None, goals) só das séries abertas. Com leaderboard/ publicado e recente, cada ciclo
+        custa só a leitura de leaderboard/version e built_at; sem ele, ou com ele parado (admin offline),
+        as séries são sincronizadas e classificadas aqui."""
+        if self.email == self.admin_email:
+            self.leaderboard_builder.rebuild_if_due(self.id_token, users_data)
+        leaderboard = self.leaderboard_sync.fetch(self.id_token, self.goals_sync.wanted, self.latency_tracker.server_now())
+        if leaderboard is not None:
+            return leaderboard, leaderboard_goals(leaderboard)
+        return None, self.goals_sync.fetch(self.id_token)
+
+    def open_goals_division(self, division):
+        """Passa a baixar uma série (pedida pela aba de metas ao abrir a série, ou a do usuário no login)."""
+        if self.goals_sync.want(division):
+            self.schedule_goals_refresh()
+
+    def _run_league_maintenance(self):
+        # A migração para as séries precisa terminar antes de o fim de temporada ler as séries.
+        migrate_goals_to_shards(self.firebase, self.id_token)
+        migrate_medal_counts(self.firebase, self.id_token)
+        self.goals_manager.check_and_process_season_end()
+
     def schedule_goals_refresh(self):
         """Agenda uma atualização dos dados de metas para daqui a 0.5 segundos.
         Isso dá tempo para o Firebase processar a atualização dos pontos antes de buscá-los.
@@ -588,20 +742,33 @@ class ChatWindow(QDialog):
             return
         
         def task():
-            users_data = self.firebase.get_data("users", self.id_token) or {}
-            goals_data = self.firebase.get_data("goals", self.id_token) or {}
-            self.goals_update_received.emit({'users': users_data, 'goals': goals_data})
+            users_data = self.users_sync.fetch(self.id_token)
+            leaderboard, goals_data = self._fetch_league(users_data)
+            league_status = self.firebase.get_data("league_status", self.id_token) or {}
+            goal_flags = self.goal_flags_sync.fetch(self.id_token)
+            self.goals_update_received.emit({'users': users_data, 'goals': goals_data, 'flags': goal_flags,
+                                             'leaderboard': leaderboard, 'divisions': sorted(self.goals_sync.wanted),
+                                             'league_status': league_status})
 
         threading.Timer(0.5, task).start()
 
     def update_user_list(self, data):
+        if not data.get('all_users') and self.last_user_list_data:
+            # A leitura de users falhou neste ciclo: reaplica a última em vez de esvaziar a lista.
+            data = self.last_user_list_data
+        self.last_user_list_data = data
         online_users_data = data.get('online_users', {})
         all_users_data = data.get('all_users', {})
         goals_data = data.get('goals', {})
+        self.flag_assets.update_from_goals(all_users_data, goals_data, data.get('flags'))
 
-        online_uids = {uid for uid, udata in online_users_data.items() if udata and udata.get('state') == 'online'}
+        # A presença já chega filtrada pelos batimentos recentes (PresenceManager.fetch_online).
+        online_uids = set(online_users_data)
         
-        uid_to_flag = {uid: gdata.get('flag') for uid, gdata in goals_data.items() if gdata.get('flag')}
+        # goal_flags cobre todos os usuários; os registros das séries baixadas são mais recentes.
+        uid_to_flag = dict(data.get('flags') or {})
+        uid_to_flag.update({uid: gdata.get('flag') for uid, gdata in goals_data.items()})
+        uid_to_flag = {uid: flag for uid, flag in uid_to_flag.items() if flag}
         
         online_to_display = []
         offline_to_display = []
@@ -620,45 +787,36 @@ class ChatWindow(QDialog):
         online_to_display.sort(key=lambda x: x['nick'].lower())
         offline_to_display.sort(key=lambda x: x['nick'].lower())
 
-        self.users_label.setText(f"{self._('online_users')} ({len(online_to_display)})")
-        
-        current_selection = self.user_list.currentItem().text() if self.user_list.currentItem() else None
-        self.user_list.clear()
-
-        def create_user_item(user_info, is_online=True):
-            item = QListWidgetItem(user_info['nick'])
-            
-            flag_filename = uid_to_flag.get(user_info['uid'])
-            if flag_filename:
-                flag_path = os.path.join(self.flags_path, flag_filename)
-                if os.path.exists(flag_path):
-                    item.setIcon(QIcon(flag_path))
-
-            if not is_online:
-                item.setForeground(QColor("grey"))
-            elif user_info['nick'] == self.admin_nick:
-                item.setForeground(QColor("blue"))
-            elif user_info['nick'] == self.nickname:
-                item.setForeground(QColor("green"))
-            return item
-
-        for user in online_to_display:
-            self.user_list.addItem(create_user_item(user, is_online=True))
-
-        if offline_to_display:
-            separator = QListWidgetItem("------ Offline ------")
-            separator.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            font = separator.font(); font.setItalic(True); separator.setFont(font)
-            separator.setFlags(Qt.ItemFlag.NoItemFlags); separator.setForeground(QColor("grey"))
-            self.user_list.addItem(separator)
-
-            for user in offline_to_display:
-                self.user_list.addItem(create_user_item(user, is_online=False))
-
-        if current_selection:
-            items = self.user_list.findItems(current_selection, Qt.MatchFlag.MatchExactly)
-            if items:
-                self.user_list.setCurrentItem(items[0])
+        self.user_list_model.set_users(
+            [user['nick'] for user in online_to_display], [user['nick'] for user in offline_to_display],
+            {user['nick']: uid_to_flag[user['uid']] for user in online_to_display + offline_to_display if user['uid'] in uid_to_flag})
+        self.users_label.setText(f"{self._('online_users')} ({self.user_list_model.online_count()})")
+
+    def _user_list_key(self, proxy_index):
+        return proxy_index.data(Qt.ItemDataRole.UserRole) if proxy_index.isValid() else None
+
+    def on_user_list_clicked(self, proxy_index):
+        # A linha "Offline (N)" abre e fecha a seção; durante a busca ela fica sempre aberta.
+        if self._user_list_key(proxy_index) == OFFLINE_HEADER_KEY and not self.user_search_input.text():
+            self.user_list_model.set_offline_expanded(not self.user_list_model.offline_expanded)
+
+    def on_user_list_double_clicked(self, proxy_index):
+        nick = self._user_list_key(proxy_index)
+        if nick and nick != OFFLINE_HEADER_KEY:
+            self.chat_manager.on_user_double_clicked(nick)
+
+    def filter_user_list(self, text):
+        """Busca rápida: enquanto há texto, a seção offline fica aberta e inteira no modelo para o filtro alcançar todos."""
+        model = self.user_list_model
+        if text:
+            if self.offline_expanded_before_search is None:
+                self.offline_expanded_before_search = model.offline_expanded
+                model.set_offline_expanded(True)
+            model.fetch_all()
+        elif self.offline_expanded_before_search is not None:
+            model.set_offline_expanded(self.offline_expanded_before_search)
+            self.offline_expanded_before_search = None
+        self.user_list_proxy.setFilterFixedString(text)
 
     def force_full_refresh(self):
         self.displayed_message_ids.clear()
@@ -667,22 +825,187 @@ class ChatWindow(QDialog):
         self.chat_manager.clear_state()
         for i in range(self.tabs.count() - 1, 4, -1):
             self.tabs.removeTab(i)
-        tooltip("Atualizando o chat e carregando histórico...")
-        threading.Thread(target=self._load_all_history_async, daemon=True).start()
+        self.channel_manager.reset_tabs()
+        self.channel_manager.open_joined_tabs()
+        self.loading_older_history = True
+        # O cache local pinta a janela na hora; a rede só traz o que mudou desde a última sessão.
+        cached_messages = self.message_cache.load_recent(HISTORY_PAGE_SIZE) if self.message_cache else []
+        if cached_messages:
+            self._display_history(cached_messages)
+        else:
+            tooltip("Atualizando o chat e carregando histórico...")
+        threading.Thread(target=self._load_all_history_async, args=(self.chat_manager.oldest_main_timestamp(),), daemon=True).start()
         self._load_persistent_quiz_ranking()
 
-    def _load_all_history_async(self):
+    def _open_message_cache(self):
+        if self.message_cache:
+            self.message_cache.close()
+        try:
+            self.message_cache = LocalMessageCache.for_user(self.addon_path, self.uid, self.nickname)
+        except Exception as e:
+            print(f"AnkiChat: Não foi possível abrir o cache local de mensagens: {e}")
+            self.message_cache = None
+            return
+        tombstone_cursor = self.message_cache.get_meta(TOMBSTONE_CURSOR_KEY)
+        retention_limit = (time.time() - TOMBSTONE_RETENTION_DAYS * 86400) * 1000
+        if tombstone_cursor is not None and tombstone_cursor < retention_limit:
+            # As lápides mais antigas já foram podadas: não há como saber o que foi apagado, recomeça do zero.
+            self.message_cache.clear()
+
+    def _open_search_index(self):
+        self.search_index = MessageSearchIndex(self.nickname, self.message_cache)
+        if self.search_index.needs_rebuild():
+            threading.Thread(target=self._rebuild_search_index, args=(self.search_index,), daemon=True).start()
+
+    def _rebuild_search_index(self, search_index):
+        try:
+            search_index.rebuild()
+        except Exception as e:
+            print(f"AnkiChat [ERRO] Falha ao reconstruir o índice de busca: {e}")
+
+    def show_search_dialog(self):
+        if not self.search_dialog:
+            self.search_dialog = MessageSearchDialog(self)
+        self.search_dialog.show()
+        self.search_dialog.raise_()
+        self.search_dialog.query_input.setFocus()
+
+    def _sync_clock_offset(self):
+        """Estima a diferença para o relógio do servidor, para que os carimbos de latência de todos os clientes sejam comparáveis."""
+        offset = estimate_clock_offset(self.firebase, self.id_token, f"{CLOCK_PROBE_ROOT}/{self.uid}")
+        if offset is not None:
+            self.latency_tracker.clock_offset = offset
+
+    def show_latency_dialog(self):
+        if not self.latency_dialog:
+            self.latency_dialog = LatencyDialog(self)
+        self.latency_dialog.show()
+        self.latency_dialog.raise_()
+
+    def jump_to_message(self, result):
+        """Leva até uma mensagem encontrada na busca; no chat principal carrega páginas antigas até alcançá-la."""
+        conversation = result["conversation"]
+        if conversation == "quiz":
+            found = self.chat_manager.jump_to_quiz_message(result["text"])
+        elif conversation.startswith("pvt:"):
+            found = self.chat_manager.jump_to_private_message(conversation.split(":", 1)[1], result["msg_id"], result["timestamp"])
+        elif conversation.startswith("channel:"):
+            found = self.channel_manager.jump_to_message(conversation.split(":", 1)[1], result["msg_id"])
+        else:
+            found = self.chat_manager.jump_to_main_message(result["msg_id"])
+            oldest_timestamp = self.chat_manager.oldest_main_timestamp()
+            if not found and self.is_connected and oldest_timestamp and result["timestamp"] < oldest_timestamp:
+                self.pending_jump = result
+                tooltip("Carregando mensagens antigas...")
+                self.tabs.setCurrentWidget(self.main_chat_area)
+                self.on_main_chat_scrolled(self.main_chat_area.verticalScrollBar().minimum())
+                return
+        if not found:
+            tooltip("Mensagem não encontrada no histórico carregado.")
+
+    def _sync_tombstones(self):
+        """Aplica as exclusões feitas por outros clientes (lápides) ao cache local e à interface."""
+        cache = self.message_cache
+        cursor = cache.get_meta(TOMBSTONE_CURSOR_KEY) if cache else self.tombstone_cursor
+        boundary_ids = set(cache.get_meta(TOMBSTONE_BOUNDARY_KEY, [])) if cache else self.tombstone_boundary_ids
+        tombstones = self.message_history.fetch_tombstones(cursor)
+        # startAt é inclusivo: as lápides do próprio cursor voltam em todo ciclo e já foram aplicadas.
+        tombstones = {msg_id: t for msg_id, t in tombstones.items()
+                      if not (isinstance(t, dict) and t.get("timestamp") == cursor and msg_id in boundary_ids)}
+        new_cursor = newest_timestamp(tombstones)
+        if new_cursor is None:
+            return
+        at_cursor = {msg_id for msg_id, t in tombstones.items() if t.get("timestamp") == new_cursor}
+        self.tombstone_boundary_ids = (boundary_ids | at_cursor) if new_cursor == cursor else at_cursor
+        if cache:
+            cache.delete_messages(list(tombstones))
+            # A fronteira vai junto com o cursor: depois de reiniciar, as lápides dele não são aplicadas de novo.
+            cache.set_meta(TOMBSTONE_BOUNDARY_KEY, sorted(self.tombstone_boundary_ids))
+            cache.set_meta(TOMBSTONE_CURSOR_KEY, new_cursor)
+        self.tombstone_cursor = new_cursor
+        if cursor is not None:
+            # Sem cursor anterior a consulta só serviu para posicioná-lo na lápide mais recente.
+            self.messages_deleted.emit(list(tombstones))
+
+    def _load_all_history_async(self, oldest_cached_main_timestamp):
         if not self.is_connected: return
-        all_messages = self.firebase.get_data("messages", self.id_token) or {}
+        cache = self.message_cache
+        channels = self.channel_manager.load_memberships()
+        since = cache.newest_timestamp() if cache else None
+        all_messages = self.message_history.fetch_delta(since) if since else None
+        if all_messages is None:
+            all_messages = self.message_history.fetch_initial()
+            all_messages.update(self.chat_manager.fetch_private_messages())
+            all_messages.update(self.channel_manager.fetch_initial(channels))
+            if cache: cache.extend_contiguous(all_messages, reset=True)
+        else:
+            all_messages.update(self.chat_manager.fetch_private_delta(since))
+            all_messages.update(self.channel_manager.fetch_delta(since, channels))
+            if oldest_cached_main_timestamp: self.message_history.seek(oldest_cached_main_timestamp)
+        self._sync_tombstones()
+        if cache:
+            cache.store_messages(all_messages)
         sorted_messages = sorted(all_messages.items(), key=lambda item: item[1].get('timestamp', 0))
         self.history_loaded.emit(sorted_messages)
 
-    def _on_history_loaded(self, messages):
+    def on_main_chat_scrolled(self, value):
+        if value != self.main_chat_area.verticalScrollBar().minimum() or self.loading_older_history:
+            return
+        if not self.is_connected or self.main_chat_area.count() == 0:
+            return
+        self.loading_older_history = True
+        threading.Thread(target=self._load_older_history_async, args=(self.chat_manager.oldest_main_timestamp(),), daemon=True).start()
+
+    def _load_older_history_async(self, oldest_timestamp):
+        cache = self.message_cache
+        if cache and oldest_timestamp:
+            cached_page = cache.load_before("main", oldest_timestamp, HISTORY_PAGE_SIZE)
+            if cached_page:
+                self.message_history.seek(cached_page[0][1]["timestamp"])
+                self.older_history_loaded.emit(cached_page)
+                return
+        older_messages = self.message_history.fetch_older() or {}
+        if cache:
+            cache.store_messages(older_messages)
+            cache.extend_contiguous(older_messages)
+        sorted_messages = sorted(older_messages.items(), key=lambda item: item[1].get('timestamp', 0))
+        self.older_history_loaded.emit(sorted_messages)
+
+    def _on_older_history_loaded(self, messages):
+        new_messages = [(msg_id, msg_data) for msg_id, msg_data in messages if msg_id not in self.displayed_message_ids]
+        prepended_ids = self.chat_manager.prepend_history(new_messages)
+        self.displayed_message_ids.update(prepended_ids)
+        if self.search_index: self.search_index.add_messages(messages)
+        self.loading_older_history = False
+        if self.pending_jump:
+            if self.chat_manager.jump_to_main_message(self.pending_jump["msg_id"]):
+                self.pending_jump = None
+            elif not messages:
+                self.pending_jump = None
+                tooltip("Mensagem não encontrada no histórico carregado.")
+            else:
+                self.on_main_chat_scrolled(self.main_chat_area.verticalScrollBar().minimum())
+        elif messages and not prepended_ids:
+            # A página só tinha mensagens do quiz/PVT: continua buscando até achar algo para o chat principal.
+            self.on_main_chat_scrolled(self.main_chat_area.verticalScrollBar().value())
+
+    def _display_history(self, messages):
         for msg_id, msg_data in messages:
+            if msg_id in self.displayed_message_ids: continue
             self.chat_manager.display_message(msg_id, msg_data, is_history=True)
             self.displayed_message_ids.add(msg_id)
+        if self.search_index: self.search_index.add_messages(messages)
+
+    def _on_history_loaded(self, messages):
+        self._display_history(messages)
+        self.loading_older_history = False
         tooltip("Histórico carregado.")
 
+    def _on_messages_deleted(self, msg_ids):
+        self.displayed_message_ids.difference_update(msg_ids)
+        self.chat_manager.remove_messages(msg_ids)
+        if self.search_index: self.search_index.remove_messages(msg_ids)
+
     def toggle_quiz(self):
         if not self.is_connected: return
 
@@ -796,13 +1119,19 @@ class ChatWindow(QDialog):
             self.timer_label.setStyleSheet(f"background-color: {bg_color}; border: none; color: {text_color};")
 
     def on_search_text_changed(self, text):
-        if self.cached_goals_data: self.goals_manager.render_goals_list(self.cached_goals_data, text)
+        self.goals_manager.filter_goals(text.strip())
     def update_goals_list(self, data):
-        self.cached_goals_data = data; self.goals_manager.render_goals_list(data, self.search_input.text())
+        self.cached_goals_data = data
+        self.flag_assets.update_from_goals(data.get('users'), data.get('goals'), data.get('flags'))
+        self.goals_manager.render_goals_list(data)
+    def span_goals_division_rows(self, *args):
+        # As linhas de série ocupam a largura toda ("--- SÉRIE A --- (n)").
+        for row in range(self.goals_proxy.rowCount()):
+            self.goals_view.setFirstColumnSpanned(row, QModelIndex(), True)
     def show_user_context_menu(self, pos):
-        item = self.user_list.itemAt(pos)
-        if not item or "Offline" in item.text() or "------" in item.text(): return
-        target_nick = item.text(); menu = QMenu()
+        target_nick = self._user_list_key(self.user_list.indexAt(pos))
+        if not target_nick or target_nick == OFFLINE_HEADER_KEY: return
+        menu = QMenu()
         if target_nick == self.nickname:
             menu.addAction("Apagar minha última mensagem").triggered.connect(self.delete_my_last_message)
         elif self.email == self.admin_email:
@@ -814,30 +1143,20 @@ class ChatWindow(QDialog):
         menu.exec(self.user_list.mapToGlobal(pos))
     def show_moderation_dialog(self):
         dialog = ModerationDialog(self.firebase, self); dialog.exec()
-    def kick_user(self, nickname):
-        uid_to_kick = self.firebase.get_data(f"nick_to_uid/{nickname}", self.id_token)
-        if uid_to_kick:
-            threading.Thread(target=self._async_kick_user, args=(uid_to_kick,), daemon=True).start()
-            tooltip(f"Usuário {nickname} kickado.")
-        else: tooltip(f"Não foi possível encontrar o usuário {nickname}.")
-    def _async_kick_user(self, uid): self.firebase.delete_data(f"online/{uid}", self.id_token)
-    def ban_user(self, nickname): threading.Thread(target=self._async_ban_user, args=(nickname,), daemon=True).start()
-    def _async_ban_user(self, nickname):
-        uid_to_kick = self.firebase.get_data(f"nick_to_uid/{nickname}", self.id_token)
-        if uid_to_kick: self.firebase.delete_data(f"online/{uid_to_kick}", self.id_token)
-        self.firebase.put_data(f"banned_users/{nickname}", True, self.id_token)
+    def kick_user(self, nickname): threading.Thread(target=self._async_moderate_user, args=("kick", nickname), daemon=True).start()
+    def ban_user(self, nickname): threading.Thread(target=self._async_moderate_user, args=("ban", nickname), daemon=True).start()
+    def _async_moderate_user(self, action, nickname):
+        result = run_bulk_moderation(self, action, [nickname]).get(nickname)
+        tooltip(f"{nickname}: {result}")
     def delete_last_message(self, nickname): threading.Thread(target=self._async_delete_message, args=(nickname, False), daemon=True).start()
     def delete_all_messages(self, nickname): threading.Thread(target=self._async_delete_message, args=(nickname, True), daemon=True).start()
     def delete_my_last_message(self): threading.Thread(target=self._async_delete_message, args=(self.nickname, False), daemon=True).start()
     def _async_delete_message(self, nickname, delete_all):
-        all_messages = self.firebase.get_data("messages", self.id_token)
-        if not all_messages: return
-        user_messages = [(msg_id, data) for msg_id, data in all_messages.items() if data.get("nick") == nickname]
-        if not user_messages: tooltip(f"Nenhuma mensagem encontrada para {nickname}."); return
-        if delete_all: ids_to_delete = [msg_id for msg_id, data in user_messages]
-        else: user_messages.sort(key=lambda item: item[1].get("timestamp", 0), reverse=True); ids_to_delete = [user_messages[0][0]]
-        for msg_id in ids_to_delete: self.firebase.delete_data(f"messages/{msg_id}", self.id_token)
-        self.force_refresh_signal.emit()
+        deleted_ids = self.chat_manager.delete_author_messages(nickname, delete_all)
+        if not deleted_ids: tooltip(f"Nenhuma mensagem encontrada para {nickname}."); return
+        if self.message_cache: self.message_cache.delete_messages(deleted_ids)
+        # As linhas somem aqui na hora; os outros clientes recebem as lápides no próximo polling.
+        self.messages_deleted.emit(deleted_ids)
     def on_translate_button_clicked(self):
         current_widget = self.tabs.currentWidget()
         if not isinstance(current_widget, QListWidget): return
@@ -868,7 +1187,9 @@ class ChatWindow(QDialog):
         if index in self.chat_manager.unread_tabs:
             self.chat_manager.unread_tabs.discard(index); self.update_tab_colors()
         current_widget = self.tabs.widget(index)
-        is_chat_tab = current_widget in [self.main_chat_area, self.tabs.findChild(QWidget, "quiz_tab_widget")] or current_widget in self.chat_manager.private_chats.values()
+        is_chat_tab = (current_widget in [self.main_chat_area, self.tabs.findChild(QWidget, "quiz_tab_widget")]
+                       or current_widget in self.chat_manager.private_chats.values()
+                       or current_widget in self.channel_manager.widgets.values())
         self.input_widget.setVisible(is_chat_tab)
         self.timer_label.setVisible(current_widget == self.tabs.findChild(QWidget, "quiz_tab_widget"))
         is_list_widget_tab = isinstance(current_widget, QListWidget)
@@ -881,9 +1202,11 @@ class ChatWindow(QDialog):
         for i in range(self.tabs.count()):
             self.tabs.tabBar().setTabTextColor(i, notification_color if i in self.chat_manager.unread_tabs else QColor())
     def go_offline(self):
-        if self.is_connected: self.firebase.delete_data(f"online/{self.uid}", self.id_token)
+        if self.is_connected: self.presence_manager.go_offline()
     def closeEvent(self, event):
-        for i in range(self.tabs.count() - 1, 4, -1): self.chat_manager.close_pvt_tab(i)
+        for i in range(self.tabs.count() - 1, 4, -1):
+            # Abas de canal ficam abertas: fechá-las significaria sair do canal.
+            if self.tabs.widget(i) in self.chat_manager.private_chats.values(): self.chat_manager.close_pvt_tab(i)
         self.hide(); event.ignore()
     def keyPressEvent(self, event):
         if event.modifiers() == Qt.KeyboardModifier.ControlModifier:
@@ -910,7 +1233,7 @@ class ChatWindow(QDialog):
         
         def task():
             scores = self.firebase.get_data(f"quiz_scores/{category_to_fetch}", self.id_token) or {}
-            users = self.firebase.get_data("users", self.id_token) or {}
+            users = self.users_sync.fetch(self.id_token)
             self.quiz_ranking_data_fetched.emit(scores, users)
         threading.Thread(target=task, daemon=True).start()
 
@@ -935,7 +1258,7 @@ def on_card_reviewed(reviewer, card, ease):
 def _update_stats_after_review(ease, is_new):
     if not background_updater.is_connected: return
     uid = background_updater.uid; firebase = background_updater.firebase; id_token = background_updater.id_token
-    goal_data = firebase.get_data(f"goals/{uid}", id_token) or {}
+    goal_data = get_goal(firebase, uid, id_token) or {}
     now = datetime.now(); current_week = now.isocalendar()[1]; today_ordinal = now.toordinal()
     goal_data.setdefault("goal_daily", 100); goal_data.setdefault("goal_weekly", 700); goal_data.setdefault("division", "D")
     goal_data.setdefault("retention_points", 0); goal_data.setdefault("meta_points", 0); goal_data.setdefault("reviews_week", 0)
@@ -951,7 +1274,7 @@ def _update_stats_after_review(ease, is_new):
     goal_data["study_time_today"] += 5; goal_data["study_time_week"] += 5
     if is_new: goal_data["new_cards_week"] += 1
     if goal_data["goal_daily"] > 0 and goal_data["reviews_today"] == goal_data["goal_daily"]: goal_data["meta_points"] += 3
-    firebase.put_data(f"goals/{uid}", goal_data, id_token)
+    put_goal(firebase, uid, goal_data, id_token)
 def clean_up_on_exit():
     if window_instance and window_instance.is_connected: window_instance.go_offline()
     elif background_updater.is_connected:
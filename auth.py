@@ -3,9 +3,12 @@
 
 import os
 import json
+import time
+import random
 import base64
 import threading
 import requests
+from urllib.parse import quote
 from datetime import datetime, timedelta
 
 from aqt import mw
@@ -15,6 +18,8 @@ from aqt.qt import (
 )
 from aqt.utils import tooltip
 
+from .liga import put_goal, put_user
+
 # --- Classe para Interagir com o Firebase ---
 class FirebaseAPI:
     def __init__(self, base_url, api_key):
@@ -39,6 +44,27 @@ class FirebaseAPI:
     def change_password(self, id_token, new_password): return self._send_request(self.auth_url_change, {"idToken": id_token, "password": new_password, "returnSecureToken": False})
     def refresh_token(self, refresh_token): return self._send_request(self.auth_url_refresh, {"grant_type": "refresh_token", "refresh_token": refresh_token})
 
+    PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+    def generate_push_id(self):
+        """Gera uma chave no formato das chaves do POST do Firebase (ordenável pelo tempo de criação).
+        Permite gravar a mesma mensagem em vários caminhos com um único PATCH multi-caminho."""
+        now = int(time.time() * 1000)
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(self.PUSH_CHARS[now % 64])
+            now //= 64
+        random_chars = [random.choice(self.PUSH_CHARS) for _ in range(12)]
+        return "".join(reversed(time_chars)) + "".join(random_chars)
+
+    def build_query(self, order_by, **filters):
+        """Monta os parâmetros de consulta do REST (orderBy, limitToLast, startAt...) com os valores em JSON."""
+        parts = [f"orderBy={quote(json.dumps(order_by))}"]
+        for key, value in filters.items():
+            if value is not None:
+                parts.append(f"{key}={quote(json.dumps(value))}")
+        return "&".join(parts)
+
     def get_data(self, path="", id_token=None, params=""):
         try:
             url = f"{self.base_url}{path}.json?auth={id_token}{'&' if params else ''}{params.lstrip('?')}"
@@ -48,6 +74,19 @@ class FirebaseAPI:
         except:
             return None
 
+    def query_data(self, path="", id_token=None, params=""):
+        """Como get_data, mas separa nó vazio de erro: (dados, None) se a leitura deu certo (dados None = nó vazio)
+        e (None, mensagem) se falhou, como a consulta recusada com 400 "Index not defined" quando falta ".indexOn"."""
+        try:
+            url = f"{self.base_url}{path}.json?auth={id_token}{'&' if params else ''}{params.lstrip('?')}"
+            r = requests.get(url)
+            if r.status_code >= 400:
+                try: return None, r.json().get("error", f"HTTP {r.status_code}")
+                except ValueError: return None, f"HTTP {r.status_code}"
+            return r.json(), None
+        except Exception as e:
+            return None, str(e)
+
     def put_data(self, path, data, id_token=None):
         try:
             url = f"{self.base_url}{path}.json?auth={id_token}"
@@ -57,12 +96,14 @@ class FirebaseAPI:
 
     # <<< MÉTODO ADICIONADO >>>
     def patch_data(self, path, data, id_token=None):
-        """Atualiza dados sem sobrescrever o nó inteiro (Usa PATCH)."""
+        """Atualiza dados sem sobrescrever o nó inteiro (Usa PATCH). Retorna True se a escrita foi aceita."""
         try:
             url = f"{self.base_url}{path}.json?auth={id_token}"
             requests.patch(url, data=json.dumps(data)).raise_for_status()
+            return True
         except Exception as e:
             print(f"AnkiChat: Erro ao atualizar dados (PATCH) para {path}. Erro: {e}")
+            return False
 
     def post_data(self, path, data, id_token=None):
         try:
@@ -77,6 +118,42 @@ class FirebaseAPI:
             requests.delete(url).raise_for_status()
         except: pass
 
+    def get_with_etag(self, path, id_token=None):
+        """(dados, ETag) do nó, para uma escrita condicional depois (put_if_match). (None, None) se a leitura falhou."""
+        try:
+            url = f"{self.base_url}{path}.json?auth={id_token}"
+            r = requests.get(url, headers={"X-Firebase-ETag": "true"})
+            r.raise_for_status()
+            return r.json(), r.headers.get("ETag")
+        except Exception as e:
+            print(f"AnkiChat: Erro ao ler {path} com ETag. Erro: {e}")
+            return None, None
+
+    def put_if_match(self, path, data, etag, id_token=None):
+        """PUT só se o nó ainda tem o ETag lido. Retorna True se gravou; False se o nó mudou desde a leitura (412) ou deu erro."""
+        try:
+            url = f"{self.base_url}{path}.json?auth={id_token}"
+            r = requests.put(url, data=json.dumps(data), headers={"if-match": etag})
+            if r.status_code == 412:
+                return False
+            r.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"AnkiChat: Erro ao enviar dados (PUT condicional) para {path}. Erro: {e}")
+            return False
+
+    def server_time(self, path, id_token=None):
+        """Grava {".sv": "timestamp"} em `path` e devolve o horário do servidor (ms) que volta na resposta, ou None."""
+        try:
+            url = f"{self.base_url}{path}.json?auth={id_token}"
+            r = requests.put(url, data=json.dumps({".sv": "timestamp"}))
+            r.raise_for_status()
+            value = r.json()
+            return value if isinstance(value, (int, float)) else None
+        except Exception as e:
+            print(f"AnkiChat: Erro ao consultar o horário do servidor em {path}. Erro: {e}")
+            return None
+
 # --- Serviço de Fundo para Atualizações em Tempo Real ---
 class BackgroundUpdater:
     def __init__(self):
@@ -222,7 +299,7 @@ class AuthManager:
         response, error = self.firebase.signin_user(email, password)
         if response:
             uid = response.get('localId')
-            threading.Thread(target=self.firebase.put_data, args=(f"users/{uid}", {"nickname": nickname_to_check}, response.get('idToken')), daemon=True).start()
+            threading.Thread(target=put_user, args=(self.firebase, uid, nickname_to_check, response.get('idToken')), daemon=True).start()
             self.cw.connection_succeeded.emit(response.get('email'), uid, response.get('idToken'), password, response.get('refreshToken'), response.get('expiresIn', '3600'))
             return
             
@@ -239,9 +316,9 @@ class AuthManager:
                 uid = signup_response.get('localId')
                 id_token = signup_response.get('idToken')
                 def setup_new_user():
-                    self.firebase.put_data(f"users/{uid}", {"nickname": new_nick}, id_token)
+                    put_user(self.firebase, uid, new_nick, id_token)
                     self.firebase.put_data(f"nick_to_uid/{new_nick}", uid, id_token)
-                    self.firebase.put_data(f"goals/{uid}", {"division": "D"}, id_token)
+                    put_goal(self.firebase, uid, {"division": "D"}, id_token)
                 threading.Thread(target=setup_new_user, daemon=True).start()
                 tooltip("Usuário registrado com sucesso! Conectando...")
                 self.cw.connection_succeeded.emit(signup_response.get('email'), uid, id_token, password, signup_response.get('refreshToken'), signup_response.get('expiresIn', '3600'))
@@ -0,0 +1,327 @@
+# -- coding: utf-8 --
+# bancada.py - Medições do AnkiChat contra o banco local em memória (firebase_local), fora do Anki.
+# Nem este módulo nem o firebase_local vão no pacote do addon (manifest.json). Uso, da pasta do addon:
+#     python bancada.py latencia --clients 8
+#     python bancada.py temporada --users 1000 50000
+#     python bancada.py ranking --users 100000
+
+import os
+import sys
+import time
+import random
+import types
+import argparse
+import threading
+from datetime import datetime
+
+if __name__ == "__main__" and not __package__:
+    # Executado como script: os módulos do addon entram num pacote montado aqui, sem rodar o __init__.py,
+    # que precisa do Anki (aqt) e do requests.
+    _package = types.ModuleType("ankichat_bancada")
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[_package.__name__] = _package
+    __package__ = _package.__name__
+
+from .firebase_local import LocalFirebaseAPI
+from .historico import MESSAGES_BY_DAY_ROOT, bucket_path, day_key, fetch_new_page, post_public_message
+from .latencia import POLL_INTERVAL_SECONDS, LatencyTracker, format_report
+from .liga import (
+    ACHIEVEMENTS_ROOT, GOAL_DIVISION_ROOT, GOALS_BY_DIVISION_ROOT, HALL_OF_FAME_ROOT, UPDATED_AT_KEY,
+    count_medals, goal_division, read_all_goals
+)
+from .protocolo import encode_message
+from . import ranking
+from .ranking import DIVISIONS, rank_divisions
+from .temporada import (
+    LEAGUE_STATUS_PATH, MEDAL_BY_POSITION, PROMOTION_COUNT, SEASON_RESET_FIELDS, SeasonEnd, relegation_count
+)
+
+# --- Latência: clientes simulados mandando e recebendo mensagens ---
+
+def run_headless(clients=4, messages=30, interval=0.5, network_ms=40, jitter_ms=15, poll_interval=POLL_INTERVAL_SECONDS):
+    """Mede a latência com clientes simulados contra o banco local (firebase_local), pelos mesmos caminhos
+    de gravação e polling do addon: balde do dia para o chat e as respostas do quiz, caixas de entrada para os PVTs."""
+    backend = LocalFirebaseAPI(latency_ms=network_ms, jitter_ms=jitter_ms)
+    tracker = LatencyTracker()
+    nicks = [f"cliente{i}" for i in range(clients)]
+    stop = threading.Event()
+
+    def sender(index):
+        me = nicks[index]
+        for n in range(messages):
+            kind = ("main", "pvt", "quiz")[n % 3]
+            message_data = {"uid": f"uid{index}", "nick": me, "timestamp": {".sv": "timestamp"},
+                            "text": str(random.randint(1, 4)) if kind == "quiz" else f"mensagem {n} de {me}"}
+            tracker.stamp(message_data)
+            if kind == "pvt":
+                target = random.choice([nick for nick in nicks if nick != me] or [me])
+                target_uid = f"uid{nicks.index(target)}"
+                msg_id = backend.generate_push_id()
+                record = encode_message(dict(message_data, target=target, target_uid=target_uid))
+                backend.patch_data("", {f"pm_inbox/{target_uid}/{msg_id}": record, f"pm_outbox/uid{index}/{msg_id}": record})
+            else:
+                message_data["day"] = day_key()
+                post_public_message(backend, None, message_data)
+            time.sleep(random.uniform(0, 2 * interval))
+
+    def receiver(index):
+        me, uid = nicks[index], f"uid{index}"
+        cursors, newest, seen = {}, {}, set()
+        while not stop.is_set():
+            page = fetch_new_page(backend, None, bucket_path(day_key()), (MESSAGES_BY_DAY_ROOT, day_key()), cursors, newest)
+            page.update(fetch_new_page(backend, None, f"pm_inbox/{uid}", "pm_inbox", cursors, newest))
+            for msg_id, msg in sorted(page.items(), key=lambda item: item[1].get("timestamp", 0)):
+                if msg_id in seen or msg.get("nick") == me:
+                    continue
+                seen.add(msg_id)
+                text = (msg.get("text") or "").strip()
+                tracker.record("pvt" if msg.get("target") else "quiz" if text.isdigit() else "main", msg)
+            stop.wait(poll_interval)
+
+    receivers = [threading.Thread(target=receiver, args=(i,), daemon=True) for i in range(clients)]
+    senders = [threading.Thread(target=sender, args=(i,), daemon=True) for i in range(clients)]
+    for thread in receivers + senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+    # Mais dois ciclos de polling para as últimas mensagens chegarem a todos.
+    time.sleep(2 * poll_interval + network_ms / 1000)
+    stop.set()
+    for thread in receivers:
+        thread.join()
+    return tracker, backend
+
+# --- Classificação das séries: Python e NumPy com os mesmos dados ---
+
+def synthetic_goals(users, seed=7):
+    rng = random.Random(seed)
+    goals = {}
+    for i in range(users):
+        goals[f"uid{i:07d}"] = {
+            "division": rng.choice(DIVISIONS),
+            # Faixas pequenas de propósito, para haver muitos empates.
+            "retention_points": rng.randint(0, 50), "meta_points": rng.randint(0, 5),
+            "study_time_week": rng.choice((0, 600, 1200)),
+            # null no banco chega como None: a conferência de run_ranking cobre a conversão dos dois caminhos.
+            "new_cards_week": rng.choice((None, 0, 1, 2, 3)),
+        }
+    return goals
+
+def run_ranking(args):
+    goals = synthetic_goals(args.users)
+    engines = [("python", False)] + ([("numpy", True)] if ranking.numpy is not None else [])
+    results = {}
+    for label, use_numpy in engines:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[label] = rank_divisions(goals, use_numpy=use_numpy)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{label:<8}{args.users:>9} usuários  {best * 1000:9.1f} ms (melhor de {args.repeat})")
+    if ranking.numpy is None:
+        print("NumPy não encontrado: só a classificação em Python foi medida.")
+    elif results["python"] != results["numpy"]:
+        print("AnkiChat [ERRO] as duas classificações divergem.")
+        return 1
+    return 0
+
+# --- Virada de temporada: liga sintética num banco local, sem tocar na produção ---
+
+SYNTHETIC_SUBJECTS = ("Medicina", "Direito", "Idiomas", "Concursos", "Vestibular", "Programação")
+# Proporção de usuários em cada série (A-D) e, na D, dos que estudaram na semana.
+SYNTHETIC_DIVISION_WEIGHTS = (0.05, 0.15, 0.30, 0.50)
+SYNTHETIC_ACTIVE_SHARE = 0.65
+
+def _synthetic_goal(rng, division, active):
+    reviews_week = max(1, int(rng.lognormvariate(5, 1))) if active else 0
+    reviews_today = min(reviews_week, int(reviews_week / 7 * rng.uniform(0, 2)))
+    seconds_per_review = max(2.0, rng.gauss(9, 3))
+    return {
+        "division": division, "materia": rng.choice(SYNTHETIC_SUBJECTS), "goal_daily": 100, "goal_weekly": 700,
+        "reviews_week": reviews_week, "reviews_today": reviews_today,
+        "retention_points": int(reviews_week * rng.uniform(2, 5)),
+        "meta_points": rng.randint(0, 7) if reviews_week else 0,
+        "study_time_week": int(reviews_week * seconds_per_review),
+        "study_time_today": int(reviews_today * seconds_per_review),
+        "new_cards_week": rng.randint(0, reviews_week // 5), "last_update_day": 0, UPDATED_AT_KEY: 0,
+    }
+
+def synthetic_league(users, seed=7, past_seasons=10):
+    """Banco completo ({"users", goals_by_division, goal_division, achievements, hall_of_fame, league_status})
+    com `users` usuários: séries em pirâmide e revisões em distribuição log-normal (muitos com pouco, poucos
+    com muito), além de `past_seasons` temporadas de medalhas. Quem ficou sem revisões já caiu para a D
+    nas viradas anteriores, então os inativos estão quase todos na D: nas séries de cima há um só, e o fim
+    da fila dessas séries é de gente ativa, que tem que ser rebaixada."""
+    rng = random.Random(seed)
+    users_data = {}
+    shards = {division: {} for division in DIVISIONS}
+    index = {}
+    for i in range(users):
+        uid = f"uid{i:07d}"
+        users_data[uid] = {"nickname": f"usuario{i}"}
+        division = rng.choices(DIVISIONS, SYNTHETIC_DIVISION_WEIGHTS)[0]
+        active = division != "D" or rng.random() < SYNTHETIC_ACTIVE_SHARE
+        shards[division][uid] = _synthetic_goal(rng, division, active)
+        index[uid] = division
+    for division in DIVISIONS[:-1]:
+        if shards[division]:
+            shards[division][rng.choice(sorted(shards[division]))] = _synthetic_goal(rng, division, active=False)
+
+    achievements = {}
+    nicks = [user["nickname"] for user in users_data.values()]
+    for season in range(1, past_seasons + 1):
+        season_key = f"{season}_2026"
+        for division in DIVISIONS:
+            for position, nick in enumerate(rng.sample(nicks, min(3, len(nicks))), start=1):
+                achievements.setdefault(nick, {})[season_key] = {
+                    "season_key": season_key, "division": division, "position": position,
+                    "retention_points": rng.randint(100, 3000), "meta_points": rng.randint(0, 7),
+                    "medal": MEDAL_BY_POSITION[position]}
+    return {
+        "users": users_data, GOALS_BY_DIVISION_ROOT: shards, GOAL_DIVISION_ROOT: index, ACHIEVEMENTS_ROOT: achievements,
+        HALL_OF_FAME_ROOT: {"medals": {nick: count_medals(entries) for nick, entries in achievements.items()}, "version": past_seasons},
+        LEAGUE_STATUS_PATH: {"season_counter": past_seasons + 1, "last_processed_week": "0_0"},
+    }
+
+def check_season_end(before_goals, after_goals, after_index):
+    """Problemas encontrados na liga depois da virada (lista vazia = tudo certo). As regras são conferidas
+    de fora, pelos números, e não refazendo o cálculo de season_end_updates."""
+    problems = []
+    # Esperado por série, só com as regras: inativos ficam abaixo de qualquer ativo (todos os critérios zerados),
+    # então dos rebaixamentos de relegation_count(tamanho) os primeiros caem sobre eles, e os promovidos
+    # são os primeiros PROMOTION_COUNT ativos.
+    sizes = {division: 0 for division in DIVISIONS}
+    inactive = {division: 0 for division in DIVISIONS}
+    for before in before_goals.values():
+        sizes[goal_division(before)] += 1
+        inactive[goal_division(before)] += 0 if before.get("reviews_week") else 1
+    expected = {division: {"up": 0 if division == "A" else min(PROMOTION_COUNT, sizes[division] - inactive[division]),
+                           "down": 0 if division == "D" else max(0, relegation_count(sizes[division]) - inactive[division])}
+                for division in DIVISIONS}
+    if set(before_goals) != set(after_goals):
+        problems.append(f"{len(set(before_goals) ^ set(after_goals))} registros sumiram ou apareceram")
+    moves = {division: {"up": 0, "down": 0} for division in DIVISIONS}
+    for uid, before in before_goals.items():
+        after = after_goals.get(uid)
+        if after is None:
+            continue
+        old, new = goal_division(before), goal_division(after)
+        if after_index.get(uid) != new:
+            problems.append(f"{uid}: goal_division diz {after_index.get(uid)}, o registro está na {new}")
+        if any(after.get(field) != value for field, value in SEASON_RESET_FIELDS.items()):
+            problems.append(f"{uid}: pontos da semana não foram zerados")
+        if after.get("materia") != before.get("materia"):
+            problems.append(f"{uid}: matéria alterada")
+        step = DIVISIONS.index(new) - DIVISIONS.index(old)
+        if not before.get("reviews_week"):
+            if new != "D":
+                problems.append(f"{uid}: sem revisões na semana e fora da série D")
+        elif abs(step) > 1:
+            problems.append(f"{uid}: pulou de {old} para {new}")
+        elif step:
+            moves[old]["up" if step < 0 else "down"] += 1
+    for division, counts in moves.items():
+        if counts != expected[division]:
+            problems.append(f"série {division}: {counts['up']} promovidos e {counts['down']} rebaixados, "
+                            f"esperados {expected[division]['up']} e {expected[division]['down']}")
+    return problems
+
+def run_simulation(users, seed=7, network_ms=0, now=None):
+    """Roda a virada de temporada (SeasonEnd, a mesma do login do admin) contra um LocalFirebaseAPI com uma liga
+    sintética, e de novo logo depois (tem que ser um no-op). Devolve um dict com tempos, custo e movimentações."""
+    now = now or datetime.now()
+    dataset = synthetic_league(users, seed)
+    before_goals = {uid: goal_data for shard in dataset[GOALS_BY_DIVISION_ROOT].values() for uid, goal_data in shard.items()}
+    backend = LocalFirebaseAPI(dataset, latency_ms=network_ms)
+
+    start = time.perf_counter()
+    processed = SeasonEnd(backend, "admin", None).run(now)
+    elapsed = time.perf_counter() - start
+    stats = backend.stats()
+    backend.reset_stats()
+    start = time.perf_counter()
+    repeated = SeasonEnd(backend, "admin", None).run(now)
+    repeat_elapsed = time.perf_counter() - start
+    repeat_stats = backend.stats()
+
+    after_goals = read_all_goals(backend, None)
+    after_index = backend.get_data(GOAL_DIVISION_ROOT) or {}
+    problems = check_season_end(before_goals, after_goals, after_index)
+    if not processed:
+        problems.append("a temporada não foi processada")
+    if repeated or repeat_stats["requests"]["PATCH"] or repeat_stats["requests"]["PUT"]:
+        problems.append("a segunda execução gravou dados")
+    promoted = relegated = inactive = 0
+    for uid, before in before_goals.items():
+        step = DIVISIONS.index(goal_division(after_goals.get(uid, before))) - DIVISIONS.index(goal_division(before))
+        if not before.get("reviews_week") and step:
+            inactive += 1
+        elif step < 0:
+            promoted += 1
+        elif step > 0:
+            relegated += 1
+    return {
+        "users": users, "seconds": elapsed, "repeat_seconds": repeat_elapsed, "stats": stats,
+        "promoted": promoted, "relegated": relegated, "inactive_to_d": inactive,
+        "division_sizes": {division: sum(1 for goal_data in after_goals.values() if goal_division(goal_data) == division) for division in DIVISIONS},
+        "problems": problems,
+    }
+
+def format_simulation(result):
+    stats = result["stats"]
+    lines = [
+        f"{result['users']:>7} usuários  {result['seconds'] * 1000:9.1f} ms  (repetição: {result['repeat_seconds'] * 1000:.1f} ms)",
+        f"         {stats['total_requests']} requisições {stats['requests']}, {stats['bytes_sent']} bytes enviados, "
+        f"{stats['bytes_received']} bytes recebidos",
+        f"         {result['promoted']} promovidos, {result['relegated']} rebaixados, {result['inactive_to_d']} inativos para a D; "
+        f"séries depois: {result['division_sizes']}",
+    ]
+    if result["problems"]:
+        lines += [f"         AnkiChat [ERRO] {problem}" for problem in result["problems"][:10]]
+    else:
+        lines.append("         conferência: ok")
+    return "\n".join(lines)
+
+def run_latency(args):
+    tracker, backend = run_headless(args.clients, args.messages, args.interval, args.network_ms, args.jitter_ms, args.poll)
+    print(format_report(tracker))
+    stats = backend.stats()
+    print(f"\n{stats['total_requests']} requisições {stats['requests']}, "
+          f"{stats['bytes_sent']} bytes enviados, {stats['bytes_received']} bytes recebidos.")
+    return 0
+
+def run_season(args):
+    failed = False
+    for users in args.users:
+        result = run_simulation(users, args.seed, args.network_ms)
+        print(format_simulation(result))
+        failed = failed or bool(result["problems"])
+    return 1 if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Medições do AnkiChat contra um banco local em memória.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    latency = commands.add_parser("latencia", help="latência de entrega das mensagens")
+    latency.add_argument("--clients", type=int, default=4)
+    latency.add_argument("--messages", type=int, default=30, help="mensagens enviadas por cliente")
+    latency.add_argument("--interval", type=float, default=0.5, help="intervalo médio entre envios (s)")
+    latency.add_argument("--network-ms", type=float, default=40, help="ida e volta simulada de cada requisição")
+    latency.add_argument("--jitter-ms", type=float, default=15)
+    latency.add_argument("--poll", type=float, default=POLL_INTERVAL_SECONDS, help="intervalo do polling (s)")
+    latency.set_defaults(run=run_latency)
+    season = commands.add_parser("temporada", help="virada de temporada com ligas sintéticas")
+    season.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000, 50000],
+                        help="tamanhos de liga simulados (até uns 200000)")
+    season.add_argument("--seed", type=int, default=7)
+    season.add_argument("--network-ms", type=float, default=0, help="ida e volta simulada de cada requisição")
+    season.set_defaults(run=run_season)
+    ranking_command = commands.add_parser("ranking", help="tempo da classificação das séries")
+    ranking_command.add_argument("--users", type=int, default=100000)
+    ranking_command.add_argument("--repeat", type=int, default=5)
+    ranking_command.set_defaults(run=run_ranking)
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# -- coding: utf-8 --
+# busca.py - Módulo para a busca local (texto completo) no histórico de mensagens do AnkiChat
+
+import re
+import html
+import heapq
+import bisect
+import sqlite3
+import unicodedata
+from datetime import datetime
+
+from aqt.qt import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QComboBox, QListWidget, QListWidgetItem,
+    QLabel, QTimer, Qt
+)
+
+from .cachelocal import conversation_key
+from .protocolo import message_html_text
+
+SEARCH_RESULT_LIMIT = 200
+# Espera depois da última tecla antes de buscar (ms).
+SEARCH_DEBOUNCE_MS = 150
+# Mensagens por lote ao reconstruir o índice; os locks do cache são soltos entre um lote e outro.
+SEARCH_REBUILD_BATCH = 500
+
+# Termos mais curtos que isso só casam com a palavra inteira (um prefixo de uma letra casaria com quase tudo).
+MIN_PREFIX_LENGTH = 2
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_TOKEN_RE = re.compile(r'\w+')
+
+def plain_text(msg):
+    """Texto da mensagem sem HTML (as mensagens do QuizBot são HTML ou registros do quiz, montados em português)."""
+    return " ".join(html.unescape(_TAG_RE.sub(" ", message_html_text(msg))).split())
+
+def _fold(text):
+    """Minúsculas e sem acentos."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+def tokenize(text):
+    """Palavras em minúsculas e sem acentos, do mesmo jeito que o tokenizador unicode61 do FTS5."""
+    return _TOKEN_RE.findall(_fold(text))
+
+def _result(msg_id, conversation, timestamp, nick, text):
+    return {"msg_id": msg_id, "conversation": conversation, "timestamp": timestamp, "nick": nick, "text": text}
+
+def _fts_term(token):
+    return f'"{token}"*' if len(token) >= MIN_PREFIX_LENGTH else f'"{token}"'
+
+class _FtsBackend:
+    """Índice FTS5 dentro do banco do cache local; a tabela message_search_ids faz o papel de chave primária.
+    O rowid de cada linha deriva do timestamp, então "mais recentes primeiro" é só percorrer o índice ao contrário."""
+    def __init__(self, cache):
+        self.cache = cache
+        self.conn, self.lock = cache.conn, cache.lock
+        with self.lock:
+            self.conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                    nick, text, msg_id UNINDEXED, conversation UNINDEXED, timestamp UNINDEXED, tokenize='unicode61'
+                );
+                CREATE TABLE IF NOT EXISTS message_search_ids (msg_id TEXT PRIMARY KEY, search_rowid INTEGER NOT NULL);
+            """)
+            self.conn.commit()
+
+    def needs_rebuild(self):
+        # O cache pode ter sido apagado (ou criado antes do índice existir): compara as contagens.
+        with self.lock:
+            indexed = self.conn.execute("SELECT COUNT(*) FROM message_search_ids").fetchone()[0]
+            cached = self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return indexed != cached
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM message_search")
+            self.conn.execute("DELETE FROM message_search_ids")
+            self.conn.commit()
+
+    def add(self, entries):
+        with self.lock:
+            for msg_id, conversation, timestamp, nick, text in entries:
+                if self.conn.execute("SELECT 1 FROM message_search_ids WHERE msg_id = ?", (msg_id,)).fetchone():
+                    continue
+                search_rowid = int(timestamp) * 1000
+                while self.conn.execute("SELECT 1 FROM message_search WHERE rowid = ?", (search_rowid,)).fetchone():
+                    search_rowid += 1
+                self.conn.execute(
+                    "INSERT INTO message_search (rowid, nick, text, msg_id, conversation, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    (search_rowid, nick, text, msg_id, conversation, timestamp))
+                self.conn.execute("INSERT INTO message_search_ids (msg_id, search_rowid) VALUES (?, ?)", (msg_id, search_rowid))
+            self.conn.commit()
+
+    def remove(self, msg_ids):
+        with self.lock:
+            for msg_id in msg_ids:
+                row = self.conn.execute("SELECT search_rowid FROM message_search_ids WHERE msg_id = ?", (msg_id,)).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM message_search WHERE rowid = ?", row)
+                    self.conn.execute("DELETE FROM message_search_ids WHERE msg_id = ?", (msg_id,))
+            self.conn.commit()
+
+    def search(self, tokens, conversation, limit):
+        # Cada palavra vira um prefixo entre aspas ("pal"*), então a busca funciona enquanto se digita.
+        match = " ".join(_fts_term(token) for token in tokens)
+        sql = "SELECT msg_id, conversation, timestamp, nick, text FROM message_search WHERE message_search MATCH ?"
+        params = [match]
+        if conversation:
+            sql += " AND conversation LIKE ?"
+            params.append(conversation.replace("%", "") + "%")
+        sql += " ORDER BY rowid DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [_result(*row) for row in rows]
+
+class _MemoryBackend:
+    """Índice invertido em memória, usado quando não há cache local ou o SQLite foi compilado sem FTS5."""
+    def __init__(self):
+        self.clear()
+
+    def needs_rebuild(self):
+        return False
+
+    def clear(self):
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+
+    def add(self, entries):
+        for msg_id, conversation, timestamp, nick, text in entries:
+            if msg_id in self.documents:
+                continue
+            self.documents[msg_id] = (conversation, timestamp, nick, text)
+            for token in set(tokenize(f"{nick} {text}")):
+                if token not in self.postings:
+                    self.postings[token] = set()
+                    bisect.insort(self.vocabulary, token)
+                self.postings[token].add(msg_id)
+
+    def remove(self, msg_ids):
+        for msg_id in msg_ids:
+            document = self.documents.pop(msg_id, None)
+            if document is None:
+                continue
+            for token in set(tokenize(f"{document[2]} {document[3]}")):
+                self.postings.get(token, set()).discard(msg_id)
+
+    def _matching_ids(self, prefix):
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return set(self.postings.get(prefix, ()))
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        ids = set()
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            ids |= self.postings[token]
+        return ids
+
+    def search(self, tokens, conversation, limit):
+        candidates = sorted((self._matching_ids(token) for token in tokens), key=len)
+        matched = set.intersection(*candidates) if candidates else set()
+        if conversation:
+            matched = {msg_id for msg_id in matched if self.documents[msg_id][0].startswith(conversation)}
+        newest = heapq.nlargest(limit, matched, key=lambda msg_id: self.documents[msg_id][1])
+        return [_result(msg_id, *self.documents[msg_id]) for msg_id in newest]
+
+class MessageSearchIndex:
+    """Índice de texto completo do chat principal, do quiz e dos PVTs. Fica no banco do cache local
+    (FTS5) quando possível, senão em memória; nenhuma busca passa pela rede."""
+    def __init__(self, my_nick, cache=None):
+        self.my_nick = my_nick
+        self.cache = cache
+        self.backend = None
+        if cache is not None:
+            try:
+                self.backend = _FtsBackend(cache)
+            except sqlite3.OperationalError as e:
+                print(f"AnkiChat: FTS5 indisponível, usando índice de busca em memória: {e}")
+        if self.backend is None:
+            self.backend = _MemoryBackend()
+
+    def needs_rebuild(self):
+        return self.backend.needs_rebuild()
+
+    def rebuild(self):
+        """Reindexa todo o cache local (primeira execução ou cache recriado). Pode rodar em segundo plano."""
+        self.backend.clear()
+        for batch in self.cache.message_batches(SEARCH_REBUILD_BATCH):
+            self.add_messages(batch)
+
+    def add_messages(self, messages):
+        """Indexa mensagens confirmadas; aceita um dict {msg_id: msg} ou uma lista de pares."""
+        items = messages.items() if isinstance(messages, dict) else messages
+        entries = [(msg_id, conversation_key(msg, self.my_nick), msg.get("timestamp"), msg.get("nick") or "", plain_text(msg))
+                   for msg_id, msg in items
+                   if msg_id and isinstance(msg.get("timestamp"), (int, float))]
+        if entries:
+            self.backend.add(entries)
+
+    def remove_messages(self, msg_ids):
+        self.backend.remove(list(msg_ids))
+
+    def search(self, query, conversation=None, limit=SEARCH_RESULT_LIMIT):
+        """Mensagens que contêm todas as palavras da busca (por prefixo), das mais novas para as mais antigas.
+        `conversation` filtra por "main", "quiz", "pvt:<nick>" ou "pvt:" (todos os PVTs)."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        return self.backend.search(tokens, conversation, limit)
+
+def _matched_length(word, terms):
+    """Quantos caracteres do início de `word` (já sem acentos) casam com o termo mais longo da busca."""
+    best = 0
+    for term in terms:
+        if len(term) > best and (word == term or (len(term) >= MIN_PREFIX_LENGTH and word.startswith(term))):
+            best = len(term)
+    return best
+
+def highlight_terms(text, query):
+    """Escapa o texto e destaca as palavras que começam com algum termo da busca. A comparação é feita
+    sem acentos, como no índice ("acao" destaca "ação"), e o destaque cai sobre o texto original."""
+    terms = tokenize(query)
+    if not terms:
+        return html.escape(text)
+    parts = []
+    pos = 0
+    for match in _TOKEN_RE.finditer(text):
+        length = _matched_length(_fold(match.group()), terms)
+        if not length:
+            continue
+        # Avança no texto original até a versão sem acentos cobrir o termo (um "ç" vira um "c" só).
+        end = match.start()
+        while end < match.end() and len(_fold(text[match.start():end])) < length:
+            end += 1
+        parts.append(html.escape(text[pos:match.start()]))
+        parts.append(f'<span style="background-color: #FFFF00;">{html.escape(text[match.start():end])}</span>')
+        pos = end
+    parts.append(html.escape(text[pos:]))
+    return "".join(parts)
+
+class MessageSearchDialog(QDialog):
+    """Janela de busca no histórico; um duplo clique leva até a mensagem na aba correspondente."""
+    def __init__(self, chat_window):
+        super().__init__(chat_window)
+        self.cw = chat_window
+        self.setWindowTitle("Buscar mensagens")
+        self.setMinimumSize(500, 450)
+
+        layout = QVBoxLayout(self)
+        top_layout = QHBoxLayout()
+        self.query_input = QLineEdit()
+        self.query_input.setPlaceholderText("Digite as palavras a buscar...")
+        self.scope_combo = QComboBox()
+        for label, scope in (("Todas as conversas", None), ("Chat principal", "main"), ("Quiz", "quiz"), ("Privadas", "pvt:"), ("Canais", "channel:")):
+            self.scope_combo.addItem(label, scope)
+        top_layout.addWidget(self.query_input)
+        top_layout.addWidget(self.scope_combo)
+        layout.addLayout(top_layout)
+
+        self.results_list = QListWidget()
+        self.results_list.setWordWrap(True)
+        self.results_list.itemActivated.connect(self.on_result_activated)
+        layout.addWidget(self.results_list)
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.run_search)
+        self.query_input.textChanged.connect(self.search_timer.start)
+        self.scope_combo.currentIndexChanged.connect(self.search_timer.start)
+
+    def _conversation_label(self, conversation):
+        if conversation == "main": return "Chat"
+        if conversation == "quiz": return "Quiz"
+        kind, name = conversation.split(":", 1)
+        if kind == "channel": return f"# {self.cw.channel_manager.channel_name(name)}"
+        return f"PVT: {name}"
+
+    def run_search(self):
+        query = self.query_input.text()
+        self.results_list.clear()
+        if not self.cw.search_index or not query.strip():
+            self.status_label.setText("")
+            return
+        results = self.cw.search_index.search(query, self.scope_combo.currentData())
+        for result in results:
+            when = datetime.fromtimestamp(result["timestamp"] / 1000).strftime("%d/%m/%Y %H:%M")
+            item = QListWidgetItem()
+            item.setData(Qt.ItemDataRole.UserRole, result)
+            label = QLabel(f'<font color="grey">{when} · {self._conversation_label(result["conversation"])}</font><br>'
+                           f'<b>{html.escape(result["nick"])}:</b> {highlight_terms(result["text"], query)}')
+            label.setWordWrap(True)
+            item.setSizeHint(label.sizeHint())
+            self.results_list.addItem(item)
+            self.results_list.setItemWidget(item, label)
+        self.status_label.setText(f"{len(results)} resultado(s)" + (" (mostrando os mais recentes)" if len(results) >= SEARCH_RESULT_LIMIT else ""))
+
+    def on_result_activated(self, item):
+        self.cw.jump_to_message(item.data(Qt.ItemDataRole.UserRole))
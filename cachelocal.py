@@ -0,0 +1,157 @@
+# -- coding: utf-8 --
+# cachelocal.py - Módulo para o cache local (SQLite) das mensagens do AnkiChat
+
+import os
+import json
+import sqlite3
+import threading
+
+from .protocolo import decode_message, encode_message
+
+# Chaves da tabela meta.
+TOMBSTONE_CURSOR_KEY = "tombstone_cursor"
+# Ids das lápides com o timestamp do cursor, já aplicadas (startAt as devolve de novo a cada consulta).
+TOMBSTONE_BOUNDARY_KEY = "tombstone_boundary"
+# Timestamp a partir do qual o cache é contínuo (sem buracos); antes dele a rolagem vai ao servidor.
+CONTIGUOUS_FROM_KEY = "contiguous_from"
+
+def conversation_key(msg, my_nick):
+    """Conversa à qual a mensagem pertence: "main", "quiz", "pvt:<nick do outro usuário>" ou "channel:<id do canal>"."""
+    target = msg.get("target")
+    if target:
+        other_user = target if msg.get("nick") == my_nick else msg.get("nick")
+        return f"pvt:{other_user}"
+    if msg.get("channel"):
+        return f"channel:{msg['channel']}"
+    if msg.get("quiz_event") or msg.get("quiz_chat"):
+        return "quiz"
+    return "main"
+
+class LocalMessageCache:
+    """Cache das mensagens em SQLite (modo WAL) para abrir a janela instantaneamente e sincronizar só o delta.
+    Um arquivo por usuário, na pasta user_files do addon (preservada nas atualizações)."""
+    def __init__(self, db_path, my_nick):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.my_nick = my_nick
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    msg_id TEXT PRIMARY KEY,
+                    conversation TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation, timestamp);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+            self.conn.commit()
+
+    @classmethod
+    def for_user(cls, addon_path, uid, my_nick):
+        return cls(os.path.join(addon_path, "user_files", f"mensagens_{uid}.sqlite3"), my_nick)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def store_messages(self, messages):
+        """Grava mensagens confirmadas pelo servidor (as que ainda têm o placeholder de timestamp são ignoradas)."""
+        # Guarda no formato compacto do banco (v2); a leitura devolve as chaves longas.
+        rows = [(msg_id, conversation_key(msg, self.my_nick), msg["timestamp"], json.dumps(encode_message(msg)))
+                for msg_id, msg in messages.items() if isinstance(msg.get("timestamp"), (int, float))]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO messages (msg_id, conversation, timestamp, data) VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def delete_messages(self, msg_ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM messages WHERE msg_id = ?", [(msg_id,) for msg_id in msg_ids])
+            self.conn.commit()
+
+    def _rows_to_list(self, rows):
+        return [(msg_id, decode_message(json.loads(data))) for msg_id, data in rows]
+
+    def load_recent(self, limit):
+        """As `limit` mensagens mais recentes de cada conversa, em ordem cronológica."""
+        with self.lock:
+            conversations = [row[0] for row in self.conn.execute("SELECT DISTINCT conversation FROM messages")]
+            rows = []
+            for conversation in conversations:
+                rows.extend(self.conn.execute(
+                    "SELECT msg_id, data, timestamp FROM messages WHERE conversation = ? ORDER BY timestamp DESC LIMIT ?",
+                    (conversation, limit)).fetchall())
+        rows.sort(key=lambda row: row[2])
+        return self._rows_to_list((msg_id, data) for msg_id, data, _ts in rows)
+
+    def message_batches(self, batch_size):
+        """Todas as mensagens do cache, em lotes de até `batch_size`; o lock só é mantido durante cada consulta."""
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, msg_id, data FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield self._rows_to_list((msg_id, data) for _rowid, msg_id, data in rows)
+
+    def load_before(self, conversation, timestamp, limit):
+        """Página de mensagens da conversa anteriores a `timestamp`, em ordem cronológica,
+        sem descer abaixo do trecho contínuo do cache."""
+        not_before = self.get_meta(CONTIGUOUS_FROM_KEY, 0)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT msg_id, data FROM messages WHERE conversation = ? AND timestamp < ? AND timestamp >= ? "
+                "ORDER BY timestamp DESC LIMIT ?",
+                (conversation, timestamp, not_before, limit)).fetchall()
+        return self._rows_to_list(reversed(rows))
+
+    def load_between(self, conversation, start_timestamp, end_timestamp=None):
+        """Mensagens da conversa com start_timestamp <= timestamp < end_timestamp (sem limite superior se None)."""
+        sql = "SELECT msg_id, data FROM messages WHERE conversation = ? AND timestamp >= ?"
+        params = [conversation, start_timestamp]
+        if end_timestamp is not None:
+            sql += " AND timestamp < ?"
+            params.append(end_timestamp)
+        with self.lock:
+            rows = self.conn.execute(sql + " ORDER BY timestamp", params).fetchall()
+        return self._rows_to_list(rows)
+
+    def extend_contiguous(self, messages, reset=False):
+        """Registra que o cache é contínuo desde a mensagem mais antiga de `messages`.
+        Com reset=True (carga completa, sem delta), o trecho anterior deixa de ser considerado contínuo."""
+        timestamps = [m["timestamp"] for m in messages.values() if isinstance(m.get("timestamp"), (int, float))]
+        if not timestamps:
+            return
+        current = self.get_meta(CONTIGUOUS_FROM_KEY)
+        if reset or current is None or min(timestamps) < current:
+            self.set_meta(CONTIGUOUS_FROM_KEY, min(timestamps))
+
+    def newest_timestamp(self):
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()
+        return row[0] if row else None
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM messages")
+            self.conn.execute("DELETE FROM meta")
+            self.conn.commit()
@@ -0,0 +1,333 @@
+# -- coding: utf-8 --
+# canais.py - Módulo para os canais de chat (por matéria, etc.) do AnkiChat
+
+import re
+import threading
+import unicodedata
+
+from aqt.qt import (
+    QObject, pyqtSignal, QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem,
+    QPushButton, QLabel, QInputDialog, QAbstractItemView, QFrame, Qt
+)
+from aqt.utils import tooltip
+
+from .historico import MessageHistory, channel_root
+
+# channels/{id}: {"name", "created_by", "created_at"}  -> catálogo de canais
+CHANNELS_ROOT = "channels"
+# user_channels/{uid}/{id}: true  -> canais em que cada usuário entrou (só esses são sincronizados)
+CHANNEL_MEMBERSHIP_ROOT = "user_channels"
+MAX_CHANNEL_NAME_LENGTH = 40
+# Chave do cache local com os canais do usuário ({id: nome}), para abrir as abas antes da rede responder.
+JOINED_CHANNELS_KEY = "joined_channels"
+
+def channel_id_for(name):
+    """Id do canal a partir do nome ("Clínica Médica" -> "clinica-medica"); vale como chave do Firebase."""
+    decomposed = unicodedata.normalize("NFKD", name.lower())
+    ascii_name = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9]+', '-', ascii_name).strip('-')[:MAX_CHANNEL_NAME_LENGTH]
+
+class ChannelManager(QObject):
+    """Canais de chat além do principal. Cada canal tem seus próprios baldes diários
+    e só os canais em que o usuário entrou são sincronizados e ganham uma aba."""
+    # (catálogo, {id: MessageHistory}, ids dos canais quando a leitura começou) -> trocados na thread da GUI
+    channels_loaded = pyqtSignal(object, object, object)
+    channel_history_loaded = pyqtSignal(str, list)
+    older_channel_messages_loaded = pyqtSignal(str, list)
+
+    def __init__(self, chat_window):
+        super().__init__(chat_window)
+        self.cw = chat_window
+        self.firebase = chat_window.firebase
+        self.catalog = {}
+        self.histories = {}
+        self.widgets = {}
+        self.loading_older = set()
+        self.channels_loaded.connect(self._apply_memberships)
+        self.channel_history_loaded.connect(self._on_channel_history_loaded)
+        self.older_channel_messages_loaded.connect(self._on_older_messages_loaded)
+
+    def clear_state(self):
+        self.reset_tabs()
+        self.histories.clear()
+        self.catalog.clear()
+
+    def reset_tabs(self):
+        """Descarta as abas (o chamador já as removeu do QTabWidget) e recomeça o histórico de cada canal."""
+        for widget in self.widgets.values():
+            widget.deleteLater()
+        self.widgets.clear()
+        self.loading_older.clear()
+        for history in self.histories.values():
+            history.reset()
+
+    def channel_name(self, channel_id):
+        return (self.catalog.get(channel_id) or {}).get("name") or channel_id
+
+    def channel_for_widget(self, widget):
+        return next((channel_id for channel_id, w in self.widgets.items() if w is widget), None)
+
+    def _new_history(self, channel_id):
+        return MessageHistory(self.firebase, self.cw, hot_root=channel_root(channel_id), archive_root=None, legacy_root=None)
+
+    def _tag(self, channel_id, messages):
+        # O canal vem do caminho, não do conteúdo: uma mensagem sem "channel" não pode vazar para o chat principal.
+        return {msg_id: dict(msg, channel=channel_id) for msg_id, msg in messages.items()}
+
+    def _save_joined(self):
+        if self.cw.message_cache:
+            self.cw.message_cache.set_meta(JOINED_CHANNELS_KEY, {c: self.channel_name(c) for c in self.histories})
+
+    def restore_from_cache(self):
+        """Recria os canais da última sessão a partir do cache local, para exibir as mensagens em cache nas abas certas."""
+        joined = self.cw.message_cache.get_meta(JOINED_CHANNELS_KEY, {}) if self.cw.message_cache else {}
+        for channel_id, name in joined.items():
+            self.catalog.setdefault(channel_id, {"name": name})
+            if channel_id not in self.histories:
+                self.histories[channel_id] = self._new_history(channel_id)
+
+    def load_memberships(self):
+        """Roda em segundo plano: lê o catálogo e os canais do usuário (que podem ter mudado em outro aparelho).
+        Monta um dicionário novo de históricos, que a thread da GUI troca pelo atual, e o devolve para a
+        carga inicial; `self.histories` nunca é alterado fora da thread da GUI."""
+        current = dict(self.histories)
+        catalog = self.firebase.get_data(CHANNELS_ROOT, self.cw.id_token) or {}
+        if not catalog:
+            # Falha de rede (ou nenhum canal criado): mantém os canais da sessão anterior.
+            return current
+        joined = self.firebase.get_data(f"{CHANNEL_MEMBERSHIP_ROOT}/{self.cw.uid}", self.cw.id_token) or {}
+        histories = {channel_id: current.get(channel_id) or self._new_history(channel_id)
+                     for channel_id in joined if channel_id in catalog}
+        self.channels_loaded.emit(catalog, histories, set(current))
+        return histories
+
+    def _apply_memberships(self, catalog, histories, previous):
+        histories = dict(histories)
+        # Entradas e saídas feitas na GUI enquanto a leitura rodava valem mais que a resposta do servidor.
+        for channel_id, history in self.histories.items():
+            if channel_id not in previous:
+                histories.setdefault(channel_id, history)
+                catalog.setdefault(channel_id, self.catalog.get(channel_id) or {"name": channel_id})
+        for channel_id in previous:
+            if channel_id not in self.histories:
+                histories.pop(channel_id, None)
+        self.catalog = catalog
+        self.histories = histories
+        self._save_joined()
+        self.open_joined_tabs()
+
+    def open_joined_tabs(self):
+        for channel_id in list(self.widgets):
+            if channel_id not in self.histories:
+                self._close_tab(channel_id)
+        for channel_id in list(self.histories):
+            self.get_or_create_tab(channel_id, focus=False)
+
+    def fetch_initial(self, histories=None):
+        messages = {}
+        for channel_id, history in list((self.histories if histories is None else histories).items()):
+            messages.update(self._tag(channel_id, history.fetch_initial()))
+        return messages
+
+    def fetch_delta(self, since, histories=None):
+        messages = {}
+        for channel_id, history in list((self.histories if histories is None else histories).items()):
+            page = history.fetch_delta(since)
+            if page is None:
+                page = history.fetch_initial()
+            messages.update(self._tag(channel_id, page))
+        return messages
+
+    def fetch_current(self):
+        """Polling: só o delta do balde do dia de cada canal em que o usuário entrou."""
+        messages = {}
+        for channel_id, history in list(self.histories.items()):
+            messages.update(self._tag(channel_id, history.fetch_current()))
+        return messages
+
+    def get_or_create_tab(self, channel_id, focus=True):
+        if channel_id not in self.widgets:
+            chat_box = QListWidget()
+            chat_box.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+            chat_box.setFrameShape(QFrame.Shape.NoFrame)
+            chat_box.setWordWrap(True)
+            chat_box.itemSelectionChanged.connect(self.cw.chat_manager.on_message_selection_changed)
+            chat_box.verticalScrollBar().valueChanged.connect(lambda value, c=channel_id: self._on_scrolled(c, value))
+            self.widgets[channel_id] = chat_box
+            self.cw.tabs.setTabsClosable(True)
+            self.cw.tabs.addTab(chat_box, f"# {self.channel_name(channel_id)}")
+        if focus:
+            self.cw.tabs.setCurrentWidget(self.widgets[channel_id])
+        return self.widgets[channel_id]
+
+    def _close_tab(self, channel_id):
+        widget = self.widgets.pop(channel_id, None)
+        if widget is None:
+            return
+        index = self.cw.tabs.indexOf(widget)
+        if index != -1:
+            self.cw.tabs.removeTab(index)
+        self.cw.chat_manager.last_message_dates.pop(f"channel:{channel_id}", None)
+        widget.deleteLater()
+
+    def join(self, channel_id, name=None):
+        """Entra num canal (criando-o no catálogo se ainda não existir) e carrega a última página dele."""
+        if not channel_id or channel_id in self.histories:
+            if channel_id in self.widgets: self.get_or_create_tab(channel_id)
+            return
+        updates = {f"{CHANNEL_MEMBERSHIP_ROOT}/{self.cw.uid}/{channel_id}": True}
+        if channel_id not in self.catalog:
+            info = {"name": name or channel_id, "created_by": self.cw.nickname, "created_at": {".sv": "timestamp"}}
+            updates[f"{CHANNELS_ROOT}/{channel_id}"] = info
+            self.catalog[channel_id] = dict(info)
+        history = self._new_history(channel_id)
+        self.histories[channel_id] = history
+        self._save_joined()
+        self.get_or_create_tab(channel_id)
+        threading.Thread(target=self._join_async, args=(channel_id, history, updates), daemon=True).start()
+
+    def _join_async(self, channel_id, history, updates):
+        self.firebase.patch_data("", updates, self.cw.id_token)
+        messages = self._tag(channel_id, history.fetch_initial())
+        if self.cw.message_cache: self.cw.message_cache.store_messages(messages)
+        self.channel_history_loaded.emit(channel_id, sorted(messages.items(), key=lambda item: item[1].get('timestamp', 0)))
+
+    def leave(self, channel_id):
+        self.histories.pop(channel_id, None)
+        self._close_tab(channel_id)
+        self._save_joined()
+        threading.Thread(target=self.firebase.delete_data,
+                         args=(f"{CHANNEL_MEMBERSHIP_ROOT}/{self.cw.uid}/{channel_id}", self.cw.id_token), daemon=True).start()
+        tooltip(f"Você saiu do canal {self.channel_name(channel_id)}.")
+
+    def _on_channel_history_loaded(self, channel_id, messages):
+        if channel_id not in self.widgets:
+            return
+        for msg_id, msg in messages:
+            if msg_id in self.cw.displayed_message_ids: continue
+            self.cw.chat_manager.display_message(msg_id, msg, is_history=True)
+            self.cw.displayed_message_ids.add(msg_id)
+        if self.cw.search_index: self.cw.search_index.add_messages(messages)
+
+    def _on_scrolled(self, channel_id, value):
+        widget, history = self.widgets.get(channel_id), self.histories.get(channel_id)
+        if widget is None or history is None or channel_id in self.loading_older:
+            return
+        if value != widget.verticalScrollBar().minimum() or widget.count() == 0:
+            return
+        self.loading_older.add(channel_id)
+        oldest_timestamp = self.cw.chat_manager.oldest_timestamp(widget)
+        threading.Thread(target=self._load_older_async, args=(channel_id, history, oldest_timestamp), daemon=True).start()
+
+    def _load_older_async(self, channel_id, history, oldest_timestamp):
+        # O que já está na aba (inclusive o que veio do cache local) não precisa ser buscado de novo.
+        if oldest_timestamp: history.seek(oldest_timestamp)
+        messages = self._tag(channel_id, history.fetch_older() or {})
+        if self.cw.message_cache: self.cw.message_cache.store_messages(messages)
+        self.older_channel_messages_loaded.emit(channel_id, sorted(messages.items(), key=lambda item: item[1].get('timestamp', 0)))
+
+    def _on_older_messages_loaded(self, channel_id, messages):
+        self.loading_older.discard(channel_id)
+        widget = self.widgets.get(channel_id)
+        new_messages = [(msg_id, msg) for msg_id, msg in messages if msg_id not in self.cw.displayed_message_ids]
+        if widget is None or not new_messages:
+            return
+        self.cw.chat_manager._prepend_messages_to_widget(widget, new_messages)
+        self.cw.displayed_message_ids.update(msg_id for msg_id, _msg in new_messages)
+        if self.cw.search_index: self.cw.search_index.add_messages(new_messages)
+
+    def jump_to_message(self, channel_id, msg_id):
+        widget = self.widgets.get(channel_id)
+        item = self.cw.chat_manager.find_message_item(widget, msg_id) if widget is not None else None
+        if item is None:
+            return False
+        self.cw.chat_manager.highlight_item(widget, item)
+        return True
+
+    def show_dialog(self):
+        ChannelsDialog(self, self.cw).exec()
+
+class ChannelsDialog(QDialog):
+    def __init__(self, channel_manager, parent=None):
+        super().__init__(parent)
+        self.manager = channel_manager
+        self.cw = parent
+        self.setWindowTitle("Canais")
+        self.setMinimumSize(320, 400)
+        self.setup_ui()
+        self.populate_list()
+
+    def _my_subject(self):
+        goals = (self.cw.cached_goals_data or {}).get('goals', {})
+        return (goals.get(self.cw.uid) or {}).get("materia", "").strip()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("O chat principal continua para todos. Os canais são sincronizados só para quem entra neles."))
+        self.list_widget = QListWidget()
+        self.list_widget.itemSelectionChanged.connect(self.on_selection_changed)
+        self.list_widget.itemDoubleClicked.connect(lambda _item: self.join_selected())
+        layout.addWidget(self.list_widget)
+
+        subject = self._my_subject()
+        if subject and channel_id_for(subject):
+            subject_button = QPushButton(f"Entrar no canal da minha matéria ({subject})")
+            subject_button.clicked.connect(lambda: self._join_and_close(channel_id_for(subject), subject))
+            layout.addWidget(subject_button)
+
+        buttons_layout = QHBoxLayout()
+        self.join_button = QPushButton("Entrar")
+        self.join_button.clicked.connect(self.join_selected)
+        self.leave_button = QPushButton("Sair")
+        self.leave_button.clicked.connect(self.leave_selected)
+        create_button = QPushButton("Criar canal...")
+        create_button.clicked.connect(self.create_channel)
+        buttons_layout.addWidget(self.join_button)
+        buttons_layout.addWidget(self.leave_button)
+        buttons_layout.addWidget(create_button)
+        layout.addLayout(buttons_layout)
+        self.on_selection_changed()
+
+    def populate_list(self):
+        self.list_widget.clear()
+        for channel_id in sorted(self.manager.catalog, key=lambda c: self.manager.channel_name(c).lower()):
+            joined = channel_id in self.manager.histories
+            item = QListWidgetItem(f"# {self.manager.channel_name(channel_id)}" + ("  ✓" if joined else ""))
+            item.setData(Qt.ItemDataRole.UserRole, channel_id)
+            self.list_widget.addItem(item)
+        if not self.manager.catalog:
+            self.list_widget.addItem("Nenhum canal criado ainda.")
+
+    def _selected_channel(self):
+        item = self.list_widget.currentItem()
+        return item.data(Qt.ItemDataRole.UserRole) if item else None
+
+    def on_selection_changed(self):
+        channel_id = self._selected_channel()
+        self.join_button.setEnabled(bool(channel_id) and channel_id not in self.manager.histories)
+        self.leave_button.setEnabled(bool(channel_id) and channel_id in self.manager.histories)
+
+    def _join_and_close(self, channel_id, name=None):
+        self.manager.join(channel_id, name)
+        self.accept()
+
+    def join_selected(self):
+        channel_id = self._selected_channel()
+        if channel_id: self._join_and_close(channel_id)
+
+    def leave_selected(self):
+        channel_id = self._selected_channel()
+        if channel_id in self.manager.histories:
+            self.manager.leave(channel_id)
+            self.populate_list()
+
+    def create_channel(self):
+        name, ok = QInputDialog.getText(self, "Criar canal", "Nome do canal (ex.: a sua matéria):", text=self._my_subject())
+        name = name.strip()[:MAX_CHANNEL_NAME_LENGTH]
+        if not ok or not name:
+            return
+        channel_id = channel_id_for(name)
+        if not channel_id:
+            tooltip("Nome de canal inválido. Use letras ou números.")
+            return
+        self._join_and_close(channel_id, name)
@@ -6,34 +6,148 @@
 import re
 import time
 import random
+import threading
+import bisect
+from collections import OrderedDict
 from datetime import datetime
 
 from aqt.qt import (
-    QListWidget, QListWidgetItem, QLabel, Qt, QColor, QMenu, QTextBrowser, QAbstractItemView, QFrame
+    QListWidget, QListWidgetItem, QLabel, Qt, QColor, QMenu, QTextBrowser, QAbstractItemView, QFrame,
+    QTextCursor, QTextDocument, QWidget
 )
 from aqt.utils import tooltip
 from aqt import mw
 
+from .historico import (
+    EXHAUSTED, LEGACY_MESSAGES_ROOT, MESSAGES_BY_DAY_ROOT, TOMBSTONES_ROOT, author_index_path, channel_root,
+    day_key, fetch_new_page, fetch_page_before, message_path, post_public_message, query_by_timestamp
+)
+from .protocolo import encode_message, message_html_text
+
+# Caminhos das mensagens privadas: cada usuário só lê a própria caixa de entrada e de saída.
+PM_INBOX_ROOT = "pm_inbox"
+PM_OUTBOX_ROOT = "pm_outbox"
+# PVTs antigos recebidos de quem ainda não migrou: saem do nó público "messages" na migração de quem recebeu
+# e ficam aqui (gravável por todos como uma caixa de entrada, legível só pelo remetente) até o remetente
+# levá-los para a própria caixa de saída.
+PM_OUTBOX_PENDING_ROOT = "pm_outbox_pending"
+
+# Quantas mensagens são reproduzidas ao abrir uma aba PVT e quantas são carregadas por vez ao rolar para o topo.
+PVT_REPLAY_WINDOW = 50
+PVT_PAGE_SIZE = 50
+# Quantos widgets de conversas fechadas ficam vivos para reabrir sem reconstruir.
+MAX_CLOSED_PVT_WIDGETS = 3
+
+class ConversationStore:
+    """Histórico de uma conversa privada: busca por id em O(1) e mensagens ordenadas por timestamp."""
+    def __init__(self):
+        self._messages = {}
+        self._sort_keys = {}
+        self._order = []
+
+    def __contains__(self, key):
+        return key in self._messages
+
+    def __len__(self):
+        return len(self._order)
+
+    def _sort_key(self, key, msg):
+        timestamp = msg.get("timestamp")
+        if not isinstance(timestamp, (int, float)):
+            # Mensagens pendentes ainda carregam o placeholder {".sv": "timestamp"}.
+            timestamp = time.time() * 1000
+        return (timestamp, key)
+
+    def add(self, key, msg):
+        """Adiciona a mensagem se ela ainda não existir. Retorna False para duplicatas."""
+        if key is None or key in self._messages:
+            return False
+        sort_key = self._sort_key(key, msg)
+        self._messages[key] = msg
+        self._sort_keys[key] = sort_key
+        bisect.insort(self._order, sort_key)
+        return True
+
+    def remove(self, key):
+        if key not in self._messages:
+            return None
+        sort_key = self._sort_keys.pop(key)
+        index = bisect.bisect_left(self._order, sort_key)
+        if index < len(self._order) and self._order[index] == sort_key:
+            del self._order[index]
+        return self._messages.pop(key)
+
+    def confirm(self, local_id, msg_id, msg):
+        """Troca a entrada pendente (chaveada pelo local_id) pela versão confirmada pelo servidor."""
+        self.remove(local_id)
+        self.add(msg_id, msg)
+
+    def oldest_timestamp(self):
+        return self._order[0][0] if self._order else None
+
+    def recent(self, count):
+        return [(key, self._messages[key]) for _ts, key in self._order[-count:]]
+
+    def before(self, key, count):
+        """Retorna até `count` mensagens imediatamente anteriores a `key`, em ordem cronológica."""
+        sort_key = self._sort_keys.get(key)
+        if sort_key is None:
+            return []
+        end = bisect.bisect_left(self._order, sort_key)
+        return [(k, self._messages[k]) for _ts, k in self._order[max(0, end - count):end]]
+
 class ChatManager:
     def __init__(self, chat_window):
         self.cw = chat_window
         self.firebase = chat_window.firebase
 
         self.private_chats = {}
-        self.private_chat_history = {}
+        self.conversations = {}
+        self.closed_pvt_widgets = OrderedDict()
+        self.pvt_oldest_keys = {}
         self.pending_messages = {}
         self.last_message_dates = {}
         self.unread_pms = set()
         self.unread_tabs = set()
+        self.nick_uid_cache = {}
+        self.pm_cursors = {}
+        self.pm_newest = {}
+        self.pm_boundaries = {}
+        self.loading_older_pms = False
 
     def clear_state(self):
+        for widget in self.private_chats.values():
+            widget.deleteLater()
         self.private_chats.clear()
-        self.private_chat_history.clear()
+        self.conversations.clear()
+        self.closed_pvt_widgets.clear()
+        self.pvt_oldest_keys.clear()
+        self.pm_cursors.clear()
+        self.pm_newest = {}
+        self.pm_boundaries = {}
+        self.loading_older_pms = False
         self.pending_messages.clear()
         self.last_message_dates.clear()
         self.unread_pms.clear()
         self.unread_tabs.clear()
 
+    def get_conversation(self, other_user):
+        if other_user not in self.conversations:
+            self.conversations[other_user] = ConversationStore()
+        return self.conversations[other_user]
+
+    def confirm_pending_message(self, local_id, msg_id, msg):
+        """Atualiza o histórico privado quando o servidor confirma uma mensagem enviada por nós."""
+        target = msg.get("target")
+        if not target:
+            return
+        other_user = target if msg.get("nick") == self.cw.nickname else msg.get("nick")
+        conversation = self.conversations.get(other_user)
+        if conversation is not None:
+            conversation.confirm(local_id, msg_id, msg)
+            if self.pvt_oldest_keys.get(other_user) == local_id:
+                self.pvt_oldest_keys[other_user] = msg_id
+
     def _linkify_text(self, text):
         url_pattern = re.compile(r'((?:https?://|www\.)[^\s<]+)')
         def repl(match):
@@ -54,19 +168,36 @@ class ChatManager:
                 is_for_me = (target == self.cw.nickname or nick == self.cw.nickname)
                 if not is_for_me: return
                 other_user = target if nick == self.cw.nickname else nick
-                if other_user not in self.private_chat_history: self.private_chat_history[other_user] = []
-                if not any(m[0] == msg_id for m in self.private_chat_history[other_user] if m[0] is not None):
-                    self.private_chat_history[other_user].append((msg_id, msg))
+                if not self.get_conversation(other_user).add(msg_id or local_id, msg):
+                    return
+                if not is_history and msg_id:
+                    self.cw.latency_tracker.record("pvt", msg)
                 if other_user in self.private_chats:
                     chat_widget = self.private_chats[other_user]
                     self._display_message_in_widget(chat_widget, msg_id, msg)
+                    if other_user not in self.pvt_oldest_keys:
+                        self.pvt_oldest_keys[other_user] = msg_id or local_id
                     message_tab_index = self.cw.tabs.indexOf(chat_widget)
                     if not is_history and message_tab_index != -1 and self.cw.tabs.currentIndex() != message_tab_index:
                         self.unread_tabs.add(message_tab_index)
                         self.cw.update_tab_colors()
                 elif not is_history:
                     self.unread_pms.add(other_user)
-                    self.cw.user_update_received.emit({'online_users': {}, 'all_users': {}})
+                    self.cw.user_list_model.refresh_nick(other_user)
+                return
+
+            channel_id = msg.get("channel")
+            if channel_id:
+                # Canais dos quais o usuário saiu não têm aba: a mensagem é ignorada.
+                chat_widget = self.cw.channel_manager.widgets.get(channel_id)
+                if chat_widget is None: return
+                self._display_message_in_widget(chat_widget, msg_id, msg)
+                if not is_history and msg_id:
+                    self.cw.latency_tracker.record("channel", msg)
+                message_tab_index = self.cw.tabs.indexOf(chat_widget)
+                if not is_history and message_tab_index != -1 and self.cw.tabs.currentIndex() != message_tab_index:
+                    self.unread_tabs.add(message_tab_index)
+                    self.cw.update_tab_colors()
                 return
 
             # --- INÍCIO DA CORREÇÃO ---
@@ -84,6 +215,8 @@ class ChatManager:
             # --- FIM DA CORREÇÃO ---
 
             self._display_message_in_widget(chat_widget, msg_id, msg)
+            if not is_history and msg_id:
+                self.cw.latency_tracker.record("quiz" if is_quiz_msg else "main", msg)
 
             if not is_history and message_tab_index != -1 and self.cw.tabs.currentIndex() != message_tab_index:
                 self.unread_tabs.add(message_tab_index)
@@ -110,18 +243,21 @@ class ChatManager:
             # Se o quiz está ativo, qualquer texto digitado é enviado para o Firebase.
             # O host (seja o addon ou a web) irá processar a mensagem.
             # Se for um número, será uma resposta. Se não, será um chat.
+            day = day_key()
             message_data = {
                 "uid": self.cw.uid,
                 "nick": self.cw.nickname,
                 "text": text,
                 "timestamp": {".sv": "timestamp"},
-                "color": self.cw.message_color
+                "color": self.cw.message_color,
+                "day": day
             }
             # Adiciona a flag 'quiz_chat' se não for um número, para ajudar na exibição
             if not text.isdigit():
                 message_data["quiz_chat"] = True
+            self.cw.latency_tracker.stamp(message_data)
 
-            self.firebase.post_data("messages", message_data, self.cw.id_token)
+            post_public_message(self.firebase, self.cw.id_token, message_data)
             self.cw.message_input.clear()
             self.cw.message_input.setFocus()
             return # Finaliza a função aqui
@@ -137,8 +273,10 @@ class ChatManager:
         
         if is_pvt:
             target_nick = tab_title.replace("PVT: ", "")
+        channel_id = self.cw.channel_manager.channel_for_widget(self.cw.tabs.widget(current_tab_index))
         
-        local_id = f"local_{time.time()}_{random.random()}"
+        # Só precisa ser único entre as mensagens pendentes deste cliente: ms em hexa + 20 bits aleatórios.
+        local_id = f"local_{int(time.time() * 1000):x}{random.getrandbits(20):05x}"
         
         message_data = {
             "uid": self.cw.uid, "nick": self.cw.nickname, "text": text, 
@@ -147,91 +285,451 @@ class ChatManager:
         }
         if target_nick:
             message_data["target"] = target_nick
+        elif channel_id:
+            message_data["channel"] = channel_id
+        self.cw.latency_tracker.stamp(message_data)
         
         self.display_message(None, message_data)
         
-        self.firebase.post_data("messages", message_data, self.cw.id_token)
+        if target_nick:
+            threading.Thread(target=self._async_send_private_message, args=(target_nick, message_data), daemon=True).start()
+        else:
+            message_data["day"] = day_key()
+            root = channel_root(channel_id) if channel_id else MESSAGES_BY_DAY_ROOT
+            post_public_message(self.firebase, self.cw.id_token, message_data, root)
         self.cw.message_input.clear()
         self.cw.message_input.setFocus()
 
+    def resolve_uids(self, nicks):
+        """Converte vários nicks de uma vez. Cada nick fora do cache é uma leitura de nick_to_uid/{nick}:
+        o custo acompanha a seleção, nunca o tamanho da liga."""
+        return {nick: self.resolve_uid(nick) for nick in nicks}
+
+    def resolve_uid(self, nick):
+        """Converte nick em uid usando o cache local antes de consultar nick_to_uid."""
+        if nick not in self.nick_uid_cache:
+            uid = self.firebase.get_data(f"nick_to_uid/{nick}", self.cw.id_token)
+            if not uid:
+                return None
+            self.nick_uid_cache[nick] = uid
+        return self.nick_uid_cache[nick]
+
+    def _private_message_paths(self, msg_id, sender_uid, target_uid):
+        return [f"{PM_INBOX_ROOT}/{target_uid}/{msg_id}", f"{PM_OUTBOX_ROOT}/{sender_uid}/{msg_id}"]
+
+    def _async_send_private_message(self, target_nick, message_data):
+        # PVTs vão para a caixa de entrada do destinatário e para a caixa de saída do remetente,
+        # em vez de passarem pelo nó compartilhado "messages" que todos os clientes baixam.
+        # Roda numa thread: falhas voltam para a GUI pelo sinal private_message_failed.
+        target_uid = self.resolve_uid(target_nick)
+        if not target_uid:
+            self.cw.private_message_failed.emit(f"Não foi possível encontrar o usuário {target_nick}.", message_data)
+            return
+        record = encode_message(dict(message_data, target_uid=target_uid))
+        msg_id = self.firebase.generate_push_id()
+        updates = {path: record for path in self._private_message_paths(msg_id, self.cw.uid, target_uid)}
+        if not self.firebase.patch_data("", updates, self.cw.id_token):
+            self.cw.private_message_failed.emit(f"A mensagem para {target_nick} não foi enviada.", message_data)
+
+    def on_private_message_failed(self, reason, message_data):
+        """A mensagem pendente (cinza) fica vermelha e marcada como não enviada."""
+        tooltip(reason)
+        item = self.pending_messages.pop(message_data.get("local_id"), None)
+        chat_widget = item.listWidget() if item is not None else None
+        label = chat_widget.itemWidget(item) if chat_widget is not None else None
+        if label is not None:
+            label.setText(f'<font color="red">{self._format_message_html(message_data)} (não enviada)</font>')
+
+    def _deletion_updates(self, msg_id, paths, author=None):
+        # Apaga a mensagem de todos os caminhos e do índice por autor, e deixa uma lápide para os caches locais.
+        updates = {path: None for path in paths}
+        if author:
+            updates[author_index_path(author, msg_id)] = None
+        updates[f"{TOMBSTONES_ROOT}/{msg_id}"] = {"timestamp": {".sv": "timestamp"}}
+        return updates
+
+    def delete_messages_remote(self, messages):
+        """Apaga uma lista de (msg_id, msg) num único PATCH multi-caminho."""
+        updates = {}
+        for msg_id, msg in messages:
+            # PVTs ficam nas caixas de entrada/saída e não entram no índice por autor.
+            author = None if msg.get("target") or msg.get("target_uid") else msg.get("nick")
+            updates.update(self._deletion_updates(msg_id, self.storage_paths(msg_id, msg), author))
+        if updates:
+            self.firebase.patch_data("", updates, self.cw.id_token)
+
+    def author_deletion_updates(self, nick, delete_all):
+        """Atualizações que apagam a última mensagem (ou todas) de um usuário, consultando o índice dele
+        e as mensagens que clientes antigos ainda gravam no nó "messages" (só indexadas na próxima compactação).
+        Retorna (atualizações, ids apagados)."""
+        if delete_all:
+            entries = self.firebase.get_data(author_index_path(nick), self.cw.id_token) or {}
+        else:
+            entries = query_by_timestamp(self.firebase, self.cw.id_token, author_index_path(nick), limit_to_last=1)
+        # msg_id -> (timestamp, caminhos)
+        candidates = {msg_id: (entry.get("timestamp") or 0, [entry["path"]] if entry.get("path") else [])
+                      for msg_id, entry in entries.items()}
+        for msg_id, msg in self._legacy_author_messages(nick).items():
+            candidates[msg_id] = (msg.get("timestamp") or 0, [f"{LEGACY_MESSAGES_ROOT}/{msg_id}"])
+        if not delete_all and candidates:
+            newest_id = max(candidates, key=lambda msg_id: candidates[msg_id][0])
+            candidates = {newest_id: candidates[newest_id]}
+        updates = {}
+        for msg_id, (_, paths) in candidates.items():
+            updates.update(self._deletion_updates(msg_id, paths, nick))
+        return updates, list(candidates)
 
+    def _legacy_author_messages(self, nick):
+        """Mensagens públicas de `nick` no nó antigo "messages" (PVTs ficam de fora)."""
+        legacy = self.firebase.get_data(LEGACY_MESSAGES_ROOT, self.cw.id_token, self.firebase.build_query("nick", equalTo=nick))
+        if legacy is None:
+            # Sem índice em "nick" nas regras do banco: faz uma única leitura completa.
+            legacy = {k: m for k, m in (self.firebase.get_data(LEGACY_MESSAGES_ROOT, self.cw.id_token) or {}).items()
+                      if isinstance(m, dict) and m.get("nick") == nick}
+        return {k: m for k, m in legacy.items() if isinstance(m, dict) and not m.get("target")}
 
+    def delete_author_messages(self, nick, delete_all):
+        """Moderação: apaga a última mensagem (ou todas) de um usuário num único PATCH. Retorna os ids apagados."""
+        updates, deleted_ids = self.author_deletion_updates(nick, delete_all)
+        if updates:
+            self.firebase.patch_data("", updates, self.cw.id_token)
+        return deleted_ids
+
+    def remove_messages(self, msg_ids):
+        """Remove da interface e do histórico em memória as mensagens apagadas por outro cliente."""
+        msg_ids = set(msg_ids)
+        for conversation in self.conversations.values():
+            for msg_id in msg_ids:
+                conversation.remove(msg_id)
+        for chat_widget in [self.cw.main_chat_area] + list(self.private_chats.values()) + list(self.cw.channel_manager.widgets.values()):
+            for row in range(chat_widget.count() - 1, -1, -1):
+                data = chat_widget.item(row).data(Qt.ItemDataRole.UserRole) or {}
+                if data.get('msg_id') in msg_ids:
+                    chat_widget.takeItem(row)
+
+    def storage_paths(self, msg_id, msg):
+        """Todos os caminhos onde uma mensagem está gravada no banco."""
+        if msg.get("target_uid") and msg.get("uid"):
+            return self._private_message_paths(msg_id, msg["uid"], msg["target_uid"])
+        return [message_path(msg_id, msg)]
+
+    def fetch_private_messages(self):
+        """Novidades das conversas deste usuário (caixa de entrada + caixa de saída): a última página
+        na primeira chamada, depois só o que chegou desde a última mensagem vista."""
+        messages = {}
+        for root in (PM_INBOX_ROOT, PM_OUTBOX_ROOT):
+            messages.update(fetch_new_page(self.firebase, self.cw.id_token, f"{root}/{self.cw.uid}", root,
+                                           self.pm_cursors, self.pm_newest, self.pm_boundaries))
+        return messages
+
+    def fetch_private_delta(self, since):
+        """Reconexão a partir do cache local: só os PVTs posteriores a `since`."""
+        self.pm_cursors.clear()
+        self.pm_boundaries = {}
+        self.pm_newest = {PM_INBOX_ROOT: since, PM_OUTBOX_ROOT: since}
+        messages = {}
+        while True:
+            page = self.fetch_private_messages()
+            if set(page) <= set(messages):
+                return messages
+            messages.update(page)
+
+    def fetch_older_private_messages(self):
+        """Página anterior das caixas de entrada/saída, a partir do cursor de cada uma."""
+        messages = {}
+        for root in (PM_INBOX_ROOT, PM_OUTBOX_ROOT):
+            if self.pm_cursors.get(root) is EXHAUSTED:
+                continue
+            messages.update(fetch_page_before(self.firebase, self.cw.id_token, f"{root}/{self.cw.uid}", root,
+                                              self.pm_cursors, self.pm_boundaries))
+        return messages
+
+    def _load_older_private_async(self, nick):
+        self.cw.older_private_messages_loaded.emit(nick, self.fetch_older_private_messages())
+
+    def on_older_private_messages_loaded(self, nick, messages):
+        self.loading_older_pms = False
+        for msg_id, msg in messages.items():
+            target, sender = msg.get("target"), msg.get("nick")
+            if not target: continue
+            self.get_conversation(target if sender == self.cw.nickname else sender).add(msg_id, msg)
+        if self.cw.search_index: self.cw.search_index.add_messages(messages)
+        chat_widget = self.private_chats.get(nick)
+        if messages and chat_widget is not None:
+            self._on_pvt_scrolled(nick, chat_widget.verticalScrollBar().minimum())
+
+    def migrate_legacy_private_messages(self):
+        """Move os PVTs antigos do nó "messages" para as caixas de entrada/saída. Roda uma vez por usuário;
+        o que outros usuários deixaram em pm_outbox_pending é recolhido a cada login."""
+        cw = self.cw
+        if not cw.is_connected: return
+        self._collect_pending_outbox()
+        if self.firebase.get_data(f"pm_migrated/{cw.uid}", cw.id_token):
+            return
+        received = self.firebase.get_data("messages", cw.id_token, self.firebase.build_query("target", equalTo=cw.nickname))
+        sent = self.firebase.get_data("messages", cw.id_token, self.firebase.build_query("nick", equalTo=cw.nickname))
+        if received is None or sent is None:
+            # Sem índice em "target"/"nick" nas regras do banco: faz uma única leitura completa.
+            all_messages = self.firebase.get_data("messages", cw.id_token) or {}
+            received = {k: m for k, m in all_messages.items() if m.get("target") == cw.nickname}
+            sent = {k: m for k, m in all_messages.items() if m.get("nick") == cw.nickname}
+        sent = {k: m for k, m in sent.items() if m.get("target")}
+
+        # Só caminhos que este usuário pode gravar: a própria caixa de entrada, a própria caixa de saída, a caixa
+        # de entrada do destinatário e a fila pm_outbox_pending do remetente (como num envio), além do nó antigo.
+        # Todo PVT sai do nó público agora, migrado ou não o outro lado.
+        updates = {}
+        migrated_senders = {}
+        for msg_id, msg in received.items():
+            sender_uid = msg.get("uid") or self.resolve_uid(msg.get("nick"))
+            msg = dict(msg, target_uid=cw.uid)
+            updates[f"{PM_INBOX_ROOT}/{cw.uid}/{msg_id}"] = msg
+            updates[f"messages/{msg_id}"] = None
+            if not sender_uid:
+                continue
+            if sender_uid not in migrated_senders:
+                migrated_senders[sender_uid] = bool(self.firebase.get_data(f"pm_migrated/{sender_uid}", cw.id_token))
+            # Quem já migrou levou a cópia dele para a caixa de saída; os outros a encontram na fila.
+            if not migrated_senders[sender_uid]:
+                updates[f"{PM_OUTBOX_PENDING_ROOT}/{sender_uid}/{msg_id}"] = dict(msg, uid=sender_uid)
+        for msg_id, msg in sent.items():
+            target_uid = self.resolve_uid(msg.get("target"))
+            if not target_uid:
+                continue
+            msg = dict(msg, target_uid=target_uid)
+            for path in self._private_message_paths(msg_id, cw.uid, target_uid):
+                updates[path] = msg
+            updates[f"messages/{msg_id}"] = None
+        if updates:
+            if not self.firebase.patch_data("", updates, cw.id_token):
+                return  # Tenta de novo no próximo login.
+            print(f"AnkiChat: {len(received) + len(sent)} mensagens privadas migradas para as caixas de entrada.")
+        self.firebase.put_data(f"pm_migrated/{cw.uid}", True, cw.id_token)
+
+    def _collect_pending_outbox(self):
+        """Leva para a caixa de saída os PVTs antigos deste usuário que o destinatário tirou do nó público
+        antes desta migração (ou logo depois dela, numa corrida entre os dois clientes)."""
+        cw = self.cw
+        pending = self.firebase.get_data(f"{PM_OUTBOX_PENDING_ROOT}/{cw.uid}", cw.id_token)
+        if not isinstance(pending, dict) or not pending:
+            return
+        updates = {}
+        for msg_id, msg in pending.items():
+            if isinstance(msg, dict):
+                updates[f"{PM_OUTBOX_ROOT}/{cw.uid}/{msg_id}"] = msg
+            updates[f"{PM_OUTBOX_PENDING_ROOT}/{cw.uid}/{msg_id}"] = None
+        if self.firebase.patch_data("", updates, cw.id_token):
+            print(f"AnkiChat: {len(pending)} mensagens privadas antigas recolhidas para a caixa de saída.")
+
+
+
+
+    def _message_date(self, msg):
+        timestamp = msg.get("timestamp")
+        if not isinstance(timestamp, (int, float)):
+            return None
+        return datetime.fromtimestamp(timestamp / 1000).date()
+
+    def _create_separator_item(self, current_date):
+        date_str = current_date.strftime("--- %A, %d de %B de %Y ---").title()
+        separator_item = QListWidgetItem()
+        separator_item.setData(Qt.ItemDataRole.UserRole, {'msg_id': None, 'local_id': None, 'separator_date': current_date.toordinal()})
+        separator_label = QLabel(date_str)
+        separator_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        font = separator_label.font()
+        font.setPointSize(self.cw.base_font_sizes["chat"] - 2 + self.cw.zoom_manager.ctrl_zoom_level)
+        font.setItalic(True)
+        separator_label.setFont(font)
+        separator_label.setStyleSheet("color: grey;")
+        separator_item.setSizeHint(separator_label.sizeHint())
+        return separator_item, separator_label
+
+    def _format_message_html(self, msg):
+        nick, text, target = msg.get("nick"), msg.get("text"), msg.get("target")
+        is_quiz_bot_msg = (nick == "QuizBot" and msg.get("quiz_event"))
+        
+        if is_quiz_bot_msg:
+            # Eventos v2 chegam como registro e são montados no idioma da interface; os antigos já são HTML.
+            return message_html_text(msg, self.cw.lang_manager.lang)
+        text = self._linkify_text(text)
+        nick_color = "blue"
+        if nick == self.cw.admin_nick: nick_color = "#0000FF"
+        flag_html = self.cw.flag_assets.img_html(self.cw.flag_assets.flag_for_nick(nick))
+        display_nick = f'{flag_html}<font color="{nick_color}">{nick}</font>'
+        if target: display_nick = "Você" if nick == self.cw.nickname else display_nick
+        color = msg.get("color")
+        if color: return f'<b>{display_nick}:</b> <font color="{color}">{text}</font>'
+        return f'<b>{display_nick}:</b> {text}'
+
+    def _create_message_item(self, msg_id, msg):
+        formatted_html = self._format_message_html(msg)
+        item = QListWidgetItem()
+        local_id = msg.get('local_id')
+        item.setData(Qt.ItemDataRole.UserRole, {
+            'msg_id': msg_id, 'local_id': local_id, 'day': msg.get('day'), 'timestamp': msg.get('timestamp'),
+            'nick': msg.get('nick'), 'channel': msg.get('channel')
+        })
+        
+        if local_id and not msg_id:
+            self.pending_messages[local_id] = item
+            formatted_html = f'<font color="grey">{formatted_html}</font>'
+
+        label = QLabel(formatted_html)
+        font = label.font()
+        font.setPointSize(self.cw.base_font_sizes["chat"] + self.cw.zoom_manager.ctrl_zoom_level)
+        label.setFont(font)
+        label.setWordWrap(True)
+        label.setTextInteractionFlags(Qt.TextInteractionFlag.TextBrowserInteraction)
+        label.setOpenExternalLinks(True)
+        item.setSizeHint(label.sizeHint())
+        return item, label
 
     def _display_message_in_widget(self, chat_widget, msg_id, msg):
-        nick, text, target, timestamp = msg.get("nick"), msg.get("text"), msg.get("target"), msg.get("timestamp")
+        nick, target = msg.get("nick"), msg.get("target")
         
         if isinstance(chat_widget, QTextBrowser): chat_id = "quiz"
         elif target: chat_id = target if nick == self.cw.nickname else nick
+        elif msg.get("channel"): chat_id = f"channel:{msg['channel']}"
         else: chat_id = "main"
-        if timestamp:
-            current_date = datetime.fromtimestamp(timestamp / 1000).date()
+        current_date = self._message_date(msg)
+        if current_date:
             last_date = self.last_message_dates.get(chat_id)
             if last_date is None or current_date > last_date:
-                date_str = current_date.strftime("--- %A, %d de %B de %Y ---").title()
                 if isinstance(chat_widget, QTextBrowser):
+                    date_str = current_date.strftime("--- %A, %d de %B de %Y ---").title()
                     chat_widget.append(f'<div style="text-align: center; color: grey; font-style: italic; font-size: {self.cw.base_font_sizes["chat"] - 2 + self.cw.zoom_manager.ctrl_zoom_level}pt;">{date_str}</div>')
                     chat_widget.setAlignment(Qt.AlignmentFlag.AlignLeft)
                 else:
-                    separator_item = QListWidgetItem(chat_widget)
-                    separator_label = QLabel(date_str)
-                    separator_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-                    font = separator_label.font()
-                    font.setPointSize(self.cw.base_font_sizes["chat"] - 2 + self.cw.zoom_manager.ctrl_zoom_level)
-                    font.setItalic(True)
-                    separator_label.setFont(font)
-                    separator_label.setStyleSheet("color: grey;")
-                    separator_item.setSizeHint(separator_label.sizeHint())
+                    separator_item, separator_label = self._create_separator_item(current_date)
                     chat_widget.addItem(separator_item)
                     chat_widget.setItemWidget(separator_item, separator_label)
                 self.last_message_dates[chat_id] = current_date
         
-        is_quiz_bot_msg = (nick == "QuizBot" and msg.get("quiz_event"))
-        
-        if is_quiz_bot_msg:
-            formatted_html = text
-        else:
-            text = self._linkify_text(text)
-            nick_color = "blue"
-            if nick == self.cw.admin_nick: nick_color = "#0000FF"
-            flag_html = ""
-            flag_filename = self.cw.user_flags_cache.get(nick)
-            if flag_filename:
-                flag_path = f"{self.cw.flags_path}/{flag_filename}"
-                flag_html = f'<img src="{flag_path}" width="16" height="11"> '
-            display_nick = f'{flag_html}<font color="{nick_color}">{nick}</font>'
-            if target: display_nick = "Você" if nick == self.cw.nickname else display_nick
-            color = msg.get("color")
-            if color: formatted_html = f'<b>{display_nick}:</b> <font color="{color}">{text}</font>'
-            else: formatted_html = f'<b>{display_nick}:</b> {text}'
-        
         if isinstance(chat_widget, QTextBrowser):
-            chat_widget.append(formatted_html)
+            chat_widget.append(self._format_message_html(msg))
         else:
-            item = QListWidgetItem(chat_widget)
-            local_id = msg.get('local_id')
-            item.setData(Qt.ItemDataRole.UserRole, {'msg_id': msg_id, 'local_id': local_id})
-            
-            if local_id and not msg_id:
-                self.pending_messages[local_id] = item
-                formatted_html = f'<font color="grey">{formatted_html}</font>'
-
-            label = QLabel(formatted_html)
-            font = label.font()
-            font.setPointSize(self.cw.base_font_sizes["chat"] + self.cw.zoom_manager.ctrl_zoom_level)
-            label.setFont(font)
-            label.setWordWrap(True)
-            label.setTextInteractionFlags(Qt.TextInteractionFlag.TextBrowserInteraction)
-            label.setOpenExternalLinks(True)
-            item.setSizeHint(label.sizeHint())
+            item, label = self._create_message_item(msg_id, msg)
             chat_widget.addItem(item)
             chat_widget.setItemWidget(item, label)
             chat_widget.scrollToBottom()
 
+    def _message_id_for_key(self, key, msg):
+        # Mensagens ainda não confirmadas ficam guardadas pelo local_id e não têm msg_id.
+        return None if key == msg.get("local_id") else key
+
+    def _prepend_messages_to_widget(self, chat_widget, messages):
+        """Insere uma página de mensagens antigas no topo do widget mantendo a posição de rolagem."""
+        scrollbar = chat_widget.verticalScrollBar()
+        old_maximum, old_value = scrollbar.maximum(), scrollbar.value()
+        row, page_last_date = 0, None
+        for key, msg in messages:
+            current_date = self._message_date(msg)
+            if current_date and current_date != page_last_date:
+                separator_item, separator_label = self._create_separator_item(current_date)
+                chat_widget.insertItem(row, separator_item)
+                chat_widget.setItemWidget(separator_item, separator_label)
+                row += 1
+                page_last_date = current_date
+            item, label = self._create_message_item(self._message_id_for_key(key, msg), msg)
+            chat_widget.insertItem(row, item)
+            chat_widget.setItemWidget(item, label)
+            row += 1
+        # Evita dois separadores seguidos para o mesmo dia na emenda entre a página nova e a antiga.
+        next_item = chat_widget.item(row)
+        next_data = next_item.data(Qt.ItemDataRole.UserRole) if next_item else None
+        if page_last_date and next_data and next_data.get('separator_date') == page_last_date.toordinal():
+            chat_widget.takeItem(row)
+        scrollbar.setValue(old_value + scrollbar.maximum() - old_maximum)
+
+    def oldest_timestamp(self, chat_widget):
+        for row in range(chat_widget.count()):
+            timestamp = (chat_widget.item(row).data(Qt.ItemDataRole.UserRole) or {}).get('timestamp')
+            if isinstance(timestamp, (int, float)):
+                return timestamp
+        return None
+
+    def oldest_main_timestamp(self):
+        return self.oldest_timestamp(self.cw.main_chat_area)
+
+    def prepend_history(self, messages):
+        """Insere no topo do chat principal uma página de mensagens públicas antigas (já ordenadas)."""
+        public_messages = [(msg_id, msg) for msg_id, msg in messages
+                           if not msg.get("target") and not msg.get("quiz_event") and not msg.get("quiz_chat")]
+        if public_messages:
+            self._prepend_messages_to_widget(self.cw.main_chat_area, public_messages)
+        return [msg_id for msg_id, _msg in public_messages]
+
+    def _on_pvt_scrolled(self, nick, value):
+        chat_widget = self.private_chats.get(nick)
+        if chat_widget is None or value != chat_widget.verticalScrollBar().minimum():
+            return
+        conversation = self.conversations.get(nick)
+        oldest_key = self.pvt_oldest_keys.get(nick)
+        if conversation is None or oldest_key is None:
+            return
+        older_page = conversation.before(oldest_key, PVT_PAGE_SIZE)
+        if not older_page:
+            # A memória acabou: busca em segundo plano a página anterior das caixas de entrada/saída.
+            all_exhausted = all(self.pm_cursors.get(root) is EXHAUSTED for root in (PM_INBOX_ROOT, PM_OUTBOX_ROOT))
+            if not self.loading_older_pms and not all_exhausted:
+                self.loading_older_pms = True
+                threading.Thread(target=self._load_older_private_async, args=(nick,), daemon=True).start()
+            return
+        self.pvt_oldest_keys[nick] = older_page[0][0]
+        self._prepend_messages_to_widget(chat_widget, older_page)
+
+    def find_message_item(self, chat_widget, msg_id):
+        for row in range(chat_widget.count() - 1, -1, -1):
+            item = chat_widget.item(row)
+            if (item.data(Qt.ItemDataRole.UserRole) or {}).get('msg_id') == msg_id:
+                return item
+        return None
+
+    def highlight_item(self, chat_widget, item):
+        self.cw.tabs.setCurrentWidget(chat_widget)
+        chat_widget.setCurrentItem(item)
+        chat_widget.scrollToItem(item, QAbstractItemView.ScrollHint.PositionAtCenter)
+
+    def jump_to_main_message(self, msg_id):
+        item = self.find_message_item(self.cw.main_chat_area, msg_id)
+        if item is None:
+            return False
+        self.highlight_item(self.cw.main_chat_area, item)
+        return True
+
+    def jump_to_private_message(self, nick, msg_id, timestamp):
+        """Abre o PVT e rola até a mensagem, trazendo do cache local o trecho da conversa que não está em memória."""
+        conversation = self.get_conversation(nick)
+        cache = self.cw.message_cache
+        if msg_id not in conversation and cache:
+            for key, msg in cache.load_between(f"pvt:{nick}", timestamp, conversation.oldest_timestamp()):
+                conversation.add(key, msg)
+        chat_widget = self.get_or_create_pvt_tab(nick)
+        item = self.find_message_item(chat_widget, msg_id)
+        while item is None:
+            oldest_key = self.pvt_oldest_keys.get(nick)
+            self._on_pvt_scrolled(nick, chat_widget.verticalScrollBar().minimum())
+            if self.pvt_oldest_keys.get(nick) == oldest_key:
+                return False
+            item = self.find_message_item(chat_widget, msg_id)
+        self.highlight_item(chat_widget, item)
+        return True
+
+    def jump_to_quiz_message(self, text):
+        quiz_area = self.cw.quiz_chat_area
+        self.cw.tabs.setCurrentWidget(self.cw.tabs.findChild(QWidget, "quiz_tab_widget"))
+        # A busca volta do fim do documento: a ocorrência mais recente é a mais provável.
+        quiz_area.moveCursor(QTextCursor.MoveOperation.End)
+        return quiz_area.find(text[:80], QTextDocument.FindFlag.FindBackward)
+
     def get_or_create_pvt_tab(self, nick):
         if nick in self.private_chats:
             tab_widget = self.private_chats[nick]
+            self.closed_pvt_widgets.pop(nick, None)
             index = self.cw.tabs.indexOf(tab_widget)
-            if index == -1: index = self.cw.tabs.addTab(tab_widget, f"PVT: {nick}")
+            if index == -1:
+                self.cw.tabs.setTabsClosable(True)
+                index = self.cw.tabs.addTab(tab_widget, f"PVT: {nick}")
             self.cw.tabs.setCurrentIndex(index)
             return tab_widget
         pvt_chat_box = QListWidget()
@@ -239,9 +737,16 @@ class ChatManager:
         pvt_chat_box.setFrameShape(QFrame.Shape.NoFrame)
         pvt_chat_box.setWordWrap(True)
         pvt_chat_box.itemSelectionChanged.connect(self.on_message_selection_changed)
-        if nick in self.private_chat_history:
-            for msg_id, msg_data in self.private_chat_history[nick]:
-                self._display_message_in_widget(pvt_chat_box, msg_id, msg_data)
+        # Só a janela mais recente da conversa é reproduzida; o restante vem sob demanda ao rolar para o topo.
+        self.last_message_dates.pop(nick, None)
+        self.pvt_oldest_keys.pop(nick, None)
+        if nick in self.conversations:
+            recent_messages = self.conversations[nick].recent(PVT_REPLAY_WINDOW)
+            for key, msg_data in recent_messages:
+                self._display_message_in_widget(pvt_chat_box, self._message_id_for_key(key, msg_data), msg_data)
+            if recent_messages:
+                self.pvt_oldest_keys[nick] = recent_messages[0][0]
+        pvt_chat_box.verticalScrollBar().valueChanged.connect(lambda value, n=nick: self._on_pvt_scrolled(n, value))
         self.private_chats[nick] = pvt_chat_box
         self.cw.tabs.setTabsClosable(True)
         index = self.cw.tabs.addTab(pvt_chat_box, f"PVT: {nick}")
@@ -249,14 +754,34 @@ class ChatManager:
         return pvt_chat_box
     def close_pvt_tab(self, index):
         if index < 5: return
+        widget = self.cw.tabs.widget(index)
+        channel_id = self.cw.channel_manager.channel_for_widget(widget)
+        if channel_id:
+            # Fechar a aba de um canal é sair dele: o cliente para de sincronizá-lo.
+            self.cw.channel_manager.leave(channel_id)
+            return
         self.cw.tabs.removeTab(index)
-    def on_user_double_clicked(self, item: QListWidgetItem):
-        nick = item.text()
-        if nick == "QuizBot" or "Offline" in nick: return
+        nick = next((n for n, w in self.private_chats.items() if w is widget), None)
+        if nick is None: return
+        self.closed_pvt_widgets[nick] = widget
+        self.closed_pvt_widgets.move_to_end(nick)
+        while len(self.closed_pvt_widgets) > MAX_CLOSED_PVT_WIDGETS:
+            self._release_pvt_widget(*self.closed_pvt_widgets.popitem(last=False))
+    def _release_pvt_widget(self, nick, widget):
+        """Libera o widget de uma conversa fechada; o histórico continua em self.conversations."""
+        self.private_chats.pop(nick, None)
+        self.pvt_oldest_keys.pop(nick, None)
+        self.last_message_dates.pop(nick, None)
+        for local_id, item in list(self.pending_messages.items()):
+            if item.listWidget() is widget:
+                self.pending_messages.pop(local_id)
+        widget.deleteLater()
+    def on_user_double_clicked(self, nick):
+        if nick == "QuizBot": return
         self.get_or_create_pvt_tab(nick)
         if nick in self.unread_pms:
-            self.unread_pms.remove(nick)
-            font = item.font(); font.setBold(False); item.setFont(font)
+            self.unread_pms.discard(nick)
+            self.cw.user_list_model.refresh_nick(nick)
     def on_message_selection_changed(self):
         is_admin = self.cw.email == self.cw.admin_email
         current_widget = self.cw.tabs.currentWidget()
@@ -277,7 +802,9 @@ class ChatManager:
         msg_id = data.get('msg_id')
         if msg_id:
             current_widget.takeItem(current_widget.row(item))
-            self.firebase.delete_data(f"messages/{msg_id}", self.cw.id_token)
+            pvt_nick = next((n for n, w in self.private_chats.items() if w is current_widget), None)
+            msg = self.conversations[pvt_nick].remove(msg_id) if pvt_nick in self.conversations else None
+            self.delete_messages_remote([(msg_id, msg or {key: data.get(key) for key in ('day', 'nick', 'channel')})])
             tooltip("Mensagem apagada.")
         else:
             tooltip("Não é possível apagar a mensagem antes de ser confirmada pelo servidor.")
\ No newline at end of file
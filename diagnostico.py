@@ -0,0 +1,77 @@
+# -- coding: utf-8 --
+# diagnostico.py - Módulo para a janela de diagnóstico (latência das mensagens) do AnkiChat
+
+from aqt.qt import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget, QTableWidgetItem,
+    QAbstractItemView, QHeaderView, QTimer, Qt
+)
+
+from .latencia import LATENCY_PATHS, PATH_LABELS
+
+# Atualização da tabela enquanto a janela está aberta (ms).
+DIAGNOSTICS_REFRESH_MS = 1000
+
+class LatencyDialog(QDialog):
+    """Percentis da latência de entrega por caminho (chat principal, PVT, quiz, canais), atualizados ao vivo."""
+    COLUMNS = ["Caminho", "Amostras", "p50", "p95", "p99", "Envio p50", "Entrega p50"]
+
+    def __init__(self, chat_window):
+        super().__init__(chat_window)
+        self.cw = chat_window
+        self.tracker = chat_window.latency_tracker
+        self.setWindowTitle("Diagnóstico de latência")
+        self.setMinimumSize(620, 260)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Tempo (ms) entre o envio de uma mensagem e a exibição dela aqui, nas últimas mensagens recebidas."))
+        self.table = QTableWidget(len(LATENCY_PATHS), len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+        self.offset_label = QLabel("")
+        layout.addWidget(self.offset_label)
+
+        bottom_layout = QHBoxLayout()
+        reset_button = QPushButton("Zerar")
+        reset_button.clicked.connect(self.reset)
+        bottom_layout.addWidget(reset_button)
+        bottom_layout.addStretch()
+        close_button = QPushButton("Fechar")
+        close_button.clicked.connect(self.close)
+        bottom_layout.addWidget(close_button)
+        layout.addLayout(bottom_layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(DIAGNOSTICS_REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def reset(self):
+        self.tracker.reset()
+        self.refresh()
+
+    def refresh(self):
+        summary = self.tracker.summary()
+        for row, path in enumerate(LATENCY_PATHS):
+            data = summary.get(path)
+            if data:
+                values = [PATH_LABELS[path], str(data["count"])] + [str(int(value)) for value in data["total"]]
+                values += [str(int(data["upload"][0])), str(int(data["delivery"][0]))]
+            else:
+                values = [PATH_LABELS[path], "0"] + ["-"] * 5
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                self.table.setItem(row, column, item)
+        self.offset_label.setText(f"Diferença do relógio local para o do servidor: {int(self.tracker.clock_offset)} ms")
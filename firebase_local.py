@@ -0,0 +1,242 @@
+# -- coding: utf-8 --
+# firebase_local.py - Módulo com um Realtime Database em memória para testes e medições do AnkiChat
+
+import copy
+import json
+import hashlib
+import time
+import random
+import threading
+from urllib.parse import parse_qsl, quote
+
+class LocalFirebaseAPI:
+    """Substituto local do FirebaseAPI (mesmos métodos de dados), com o banco inteiro num dict.
+    Entende as consultas do REST que o addon usa (orderBy, startAt, endAt, equalTo, limitToFirst,
+    limitToLast, shallow), os valores de servidor {".sv": "timestamp"} e {".sv": {"increment": n}}
+    e as escritas condicionais por ETag (get_with_etag/put_if_match),
+    e conta requisições e bytes por método para comparar o custo de cada estratégia.
+    `latency_ms` simula o tempo de ida e volta da rede em cada requisição."""
+    PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+    def __init__(self, data=None, latency_ms=0, jitter_ms=0, clock=None, indexed=True):
+        self.root = copy.deepcopy(data) if data else {}
+        # indexed=False simula regras sem ".indexOn": toda consulta com orderBy num campo é recusada.
+        self.indexed = indexed
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # Relógio do "servidor" em ms; a simulação pode trocar por um relógio virtual.
+        self.clock = clock or (lambda: int(time.time() * 1000))
+        self.lock = threading.Lock()
+        self.last_push_time = None
+        self.last_push_random = None
+        self.reset_stats()
+
+    # --- Estatísticas ---
+
+    def reset_stats(self):
+        self.requests = {"GET": 0, "PUT": 0, "PATCH": 0, "POST": 0, "DELETE": 0}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def stats(self):
+        return {"requests": dict(self.requests), "total_requests": sum(self.requests.values()),
+                "bytes_sent": self.bytes_sent, "bytes_received": self.bytes_received}
+
+    def _count(self, method, sent=None, received=None):
+        # Conta como o cliente veria: corpo enviado e JSON recebido.
+        with self.lock:
+            self.requests[method] += 1
+            if sent is not None: self.bytes_sent += len(json.dumps(sent))
+            if received is not None: self.bytes_received += len(json.dumps(received))
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    # --- Mesma interface do FirebaseAPI ---
+
+    def generate_push_id(self):
+        """Chaves no formato do POST do Firebase; dentro do mesmo ms o sufixo aleatório é incrementado, então continuam ordenadas."""
+        now = self.clock()
+        with self.lock:
+            if now == self.last_push_time:
+                suffix = self.last_push_random + 1
+            else:
+                suffix = random.getrandbits(60)
+            self.last_push_time, self.last_push_random = now, suffix
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(self.PUSH_CHARS[now % 64])
+            now //= 64
+        random_chars = []
+        for _ in range(12):
+            random_chars.append(self.PUSH_CHARS[suffix % 64])
+            suffix //= 64
+        return "".join(reversed(time_chars)) + "".join(reversed(random_chars))
+
+    def build_query(self, order_by, **filters):
+        parts = [f"orderBy={quote(json.dumps(order_by))}"]
+        for key, value in filters.items():
+            if value is not None:
+                parts.append(f"{key}={quote(json.dumps(value))}")
+        return "&".join(parts)
+
+    def get_data(self, path="", id_token=None, params=""):
+        return self.query_data(path, id_token, params)[0]
+
+    def query_data(self, path="", id_token=None, params=""):
+        query = dict(parse_qsl(params.lstrip("?"))) if params else {}
+        if not self.indexed and query.get("orderBy", '"$key"') not in ('"$key"', '"$value"'):
+            self._count("GET")
+            return None, f"Index not defined, add \".indexOn\": {query['orderBy']}, for path \"/{path.strip('/')}\", to the rules"
+        with self.lock:
+            node = copy.deepcopy(self._node(path))
+        result = self._query(node, query) if query else node
+        self._count("GET", received=result)
+        return result, None
+
+    def put_data(self, path, data, id_token=None):
+        self._count("PUT", sent=data)
+        with self.lock:
+            self._set(path, self._resolve(data, self._node(path)))
+
+    def patch_data(self, path, data, id_token=None):
+        self._count("PATCH", sent=data)
+        with self.lock:
+            for key, value in data.items():
+                child_path = f"{path.strip('/')}/{key}".strip("/")
+                self._set(child_path, self._resolve(value, self._node(child_path)))
+        return True
+
+    def post_data(self, path, data, id_token=None):
+        self._count("POST", sent=data)
+        msg_id = self.generate_push_id()
+        with self.lock:
+            self._set(f"{path.strip('/')}/{msg_id}", self._resolve(data, None))
+        return msg_id
+
+    def delete_data(self, path, id_token=None):
+        self._count("DELETE")
+        with self.lock:
+            self._set(path, None)
+
+    def get_with_etag(self, path, id_token=None):
+        with self.lock:
+            node = copy.deepcopy(self._node(path))
+        self._count("GET", received=node)
+        return node, self._etag(node)
+
+    def put_if_match(self, path, data, etag, id_token=None):
+        self._count("PUT", sent=data)
+        with self.lock:
+            if self._etag(self._node(path)) != etag:
+                return False
+            self._set(path, self._resolve(data, self._node(path)))
+        return True
+
+    def _etag(self, node):
+        # Como no Firebase, o ETag só depende do conteúdo do nó.
+        if node is None:
+            return "null_etag"
+        return hashlib.sha1(json.dumps(node, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def server_time(self, path, id_token=None):
+        self.put_data(path, {".sv": "timestamp"}, id_token)
+        return self.get_data(path, id_token)
+
+    # --- Árvore ---
+
+    def _parts(self, path):
+        return [part for part in path.strip("/").split("/") if part]
+
+    def _node(self, path):
+        node = self.root
+        for part in self._parts(path):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node if node != {} else None
+
+    def _set(self, path, value):
+        parts = self._parts(path)
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        node = self.root
+        trail = []
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                if value is None:
+                    return
+                node[part] = {}
+            trail.append((node, part))
+            node = node[part]
+        if value is None or value == {}:
+            node.pop(parts[-1], None)
+            # Como no Firebase, nós que ficam vazios deixam de existir.
+            for parent, part in reversed(trail):
+                if parent[part]:
+                    break
+                parent.pop(part)
+        else:
+            node[parts[-1]] = value
+
+    def _resolve(self, value, current):
+        """Troca os valores de servidor ({".sv": ...}) pelo valor final, como o Firebase faz na escrita."""
+        if isinstance(value, dict):
+            server_value = value.get(".sv")
+            if server_value == "timestamp":
+                return self.clock()
+            if isinstance(server_value, dict) and "increment" in server_value:
+                base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+                return base + server_value["increment"]
+            resolved = {}
+            for key, child in value.items():
+                child_value = self._resolve(child, current.get(key) if isinstance(current, dict) else None)
+                if child_value is not None:
+                    resolved[key] = child_value
+            return resolved or None
+        return copy.deepcopy(value)
+
+    # --- Consultas ---
+
+    def _sort_value(self, key, child, order_by):
+        if order_by == "$key":
+            value = key
+        elif order_by == "$value":
+            value = child
+        else:
+            value = child
+            for part in order_by.split("/"):
+                value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def _rank(self, value):
+        # Ordem do Firebase: null < false < true < números < textos < objetos.
+        if value is None: return (0, 0)
+        if value is False: return (1, 0)
+        if value is True: return (2, 0)
+        if isinstance(value, (int, float)): return (3, value)
+        if isinstance(value, str): return (4, value)
+        return (5, 0)
+
+    def _query(self, node, params):
+        if params.get("shallow") == "true":
+            return {key: True for key in node} if isinstance(node, dict) else node
+        if not isinstance(node, dict) or "orderBy" not in params:
+            return node
+        order_by = json.loads(params["orderBy"])
+        entries = sorted(((self._rank(self._sort_value(key, child, order_by)), key, child) for key, child in node.items()),
+                         key=lambda entry: (entry[0], entry[1]))
+        if "equalTo" in params:
+            target = self._rank(json.loads(params["equalTo"]))
+            entries = [entry for entry in entries if entry[0] == target]
+        if "startAt" in params:
+            start = self._rank(json.loads(params["startAt"]))
+            entries = [entry for entry in entries if entry[0] >= start]
+        if "endAt" in params:
+            end = self._rank(json.loads(params["endAt"]))
+            entries = [entry for entry in entries if entry[0] <= end]
+        if "limitToFirst" in params:
+            entries = entries[:int(params["limitToFirst"])]
+        if "limitToLast" in params:
+            entries = entries[-int(params["limitToLast"]):]
+        return {key: child for _rank, key, child in entries}
@@ -0,0 +1,122 @@
+# -- coding: utf-8 --
+# flags.py - Módulo para as bandeiras (imagens, ícones e nick -> bandeira) do AnkiChat
+
+import os
+import base64
+
+from aqt.qt import (
+    QAbstractListModel, QModelIndex, QPixmap, QIcon, QByteArray, QBuffer, QIODevice, Qt
+)
+
+FLAG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+# Tamanho em que as bandeiras aparecem em todas as telas (lista de usuários, metas, chat).
+FLAG_WIDTH, FLAG_HEIGHT = 16, 11
+
+def flag_display_name(filename):
+    return os.path.splitext(filename)[0].replace("_", " ").title()
+
+def flag_img_tag(url):
+    return f'<img src="{url}" width="{FLAG_WIDTH}" height="{FLAG_HEIGHT}"> '
+
+class FlagAssets:
+    """Cache único das bandeiras de bandeiras/: cada arquivo é lido e reduzido para 16x11 uma vez só,
+    na primeira vez em que alguém precisa dele, e o mesmo QPixmap serve ao combo, à lista de usuários,
+    às metas e ao chat. Também guarda o mapa nick -> bandeira, atualizado a partir de "goals"."""
+    def __init__(self, flags_path):
+        self.flags_path = flags_path
+        self.pixmaps = {}
+        self.icons = {}
+        self.data_urls = {}
+        self.nick_flags = {}
+        self._filenames = None
+
+    def filenames(self):
+        """Arquivos de bandeira disponíveis, ordenados; a pasta é listada uma vez só."""
+        if self._filenames is None:
+            try:
+                self._filenames = sorted(f for f in os.listdir(self.flags_path) if f.lower().endswith(FLAG_EXTENSIONS))
+            except FileNotFoundError:
+                self._filenames = []
+        return self._filenames
+
+    def pixmap(self, filename):
+        """QPixmap já no tamanho de exibição, ou None se o arquivo não existe."""
+        if not filename:
+            return None
+        if filename not in self.pixmaps:
+            pixmap = QPixmap(os.path.join(self.flags_path, filename))
+            self.pixmaps[filename] = None if pixmap.isNull() else pixmap.scaled(
+                FLAG_WIDTH, FLAG_HEIGHT, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        return self.pixmaps[filename]
+
+    def icon(self, filename):
+        if filename not in self.icons:
+            pixmap = self.pixmap(filename)
+            self.icons[filename] = QIcon(pixmap) if pixmap else None
+        return self.icons[filename]
+
+    def img_html(self, filename):
+        """<img> da bandeira para HTML ("" se não houver bandeira), embutida como data URL do PNG já reduzido."""
+        pixmap = self.pixmap(filename)
+        if not pixmap:
+            return ""
+        return flag_img_tag(self._data_url(filename, pixmap))
+
+    def _data_url(self, filename, pixmap):
+        if filename not in self.data_urls:
+            data = QByteArray()
+            buffer = QBuffer(data)
+            buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+            pixmap.save(buffer, "PNG")
+            self.data_urls[filename] = "data:image/png;base64," + base64.b64encode(bytes(data)).decode("ascii")
+        return self.data_urls[filename]
+
+    # --- nick -> bandeira ---
+
+    def update_from_goals(self, users_data, goals_data, goal_flags=None):
+        """Refaz o mapa nick -> bandeira a partir de "users", de goal_flags ({uid: bandeira}, todos os usuários)
+        e de "goals" (só as séries baixadas, mas mais recentes). Retorna True se algo mudou."""
+        uid_flags = dict(goal_flags or {})
+        for uid, goal_data in (goals_data or {}).items():
+            if isinstance(goal_data, dict):
+                uid_flags[uid] = goal_data.get("flag")
+        nick_flags = {}
+        for uid, flag_filename in uid_flags.items():
+            nick = (users_data or {}).get(uid, {}).get("nickname")
+            if flag_filename and nick:
+                nick_flags[nick] = flag_filename
+        changed = nick_flags != self.nick_flags
+        self.nick_flags = nick_flags
+        return changed
+
+    def flag_for_nick(self, nick):
+        return self.nick_flags.get(nick)
+
+class FlagComboModel(QAbstractListModel):
+    """Itens do combo de bandeiras: a linha 0 é o texto "Escolha uma bandeira...", as demais os arquivos.
+    O ícone só é decodificado quando a linha é desenhada, e trocar o idioma muda só o texto da linha 0."""
+    def __init__(self, flag_assets, placeholder, parent=None):
+        super().__init__(parent)
+        self.assets = flag_assets
+        self.placeholder = placeholder
+        self.filenames = flag_assets.filenames()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.filenames) + 1
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.ItemDataRole.UserRole:
+            return self.filenames[row - 1] if row else ""
+        if role == Qt.ItemDataRole.DisplayRole:
+            return flag_display_name(self.filenames[row - 1]) if row else self.placeholder
+        if role == Qt.ItemDataRole.DecorationRole and row:
+            return self.assets.icon(self.filenames[row - 1])
+        return None
+
+    def set_placeholder(self, text):
+        self.placeholder = text
+        index = self.index(0)
+        self.dataChanged.emit(index, index)
@@ -1,42 +1,132 @@
 # -- coding: utf-8 --
-# halldafama.py - Módulo para a aba Hall da Fama do AnkiChat (v1.4 - Layout em Tabela)
+# halldafama.py - Módulo para a aba Hall da Fama do AnkiChat (v1.5 - Contadores e Modelo)
 
+import bisect
+import threading
 from datetime import datetime
 from aqt.qt import (
-    QWidget, QHBoxLayout, QVBoxLayout, QTextBrowser, Qt, QLabel, QFont,
-    QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView
+    QWidget, QHBoxLayout, QVBoxLayout, QTextBrowser, Qt, QLabel, QFont, QTableView, QAbstractTableModel,
+    QSortFilterProxyModel, QModelIndex, QAbstractItemView, QHeaderView, pyqtSignal
 )
 
+from .liga import ACHIEVEMENTS_ROOT, MEDALS, count_medals
+
+class MedalTableModel(QAbstractTableModel):
+    """Uma linha por usuário, em ordem de nick; a posição no ranking de medalhas é só mais uma coluna
+    e a ordem na tela vem do proxy. Cada atualização insere ou remove só os nicks que entraram ou saíram
+    e avisa (dataChanged) só as linhas cujas medalhas ou posição mudaram: seleção e rolagem ficam onde estão."""
+    COLUMNS = ["#", "Nome", "🥇", "🥈", "🥉"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.nicks = []
+        self.medals = {}
+        self.ranks = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.nicks)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        nick = self.nicks[index.row()]
+        column = index.column()
+        if column == 0:
+            value = self.ranks.get(nick, 0)
+        elif column == 1:
+            value = nick
+        else:
+            value = self.medals.get(nick, (0, 0, 0))[column - 2]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return value if column == 1 else str(value)
+        if role == Qt.ItemDataRole.UserRole:
+            # Valor de ordenação do proxy: números como números, nick sem diferenciar maiúsculas.
+            return nick.lower() if column == 1 else value
+        if role == Qt.ItemDataRole.TextAlignmentRole and column != 1:
+            return Qt.AlignmentFlag.AlignCenter
+        return None
+
+    def nick_at(self, row):
+        return self.nicks[row]
+
+    def set_medals(self, nicks, medals):
+        """Aplica {nick: {"gold", "silver", "bronze"}} aos `nicks` atuais (quem não tem medalha fica com zero)."""
+        new_medals = {nick: tuple((medals.get(nick) or {}).get(medal, 0) for medal in MEDALS) for nick in nicks}
+        order = sorted(new_medals, key=lambda nick: (-new_medals[nick][0], -new_medals[nick][1], -new_medals[nick][2], nick))
+        old_medals, old_ranks = self.medals, self.ranks
+        self.medals, self.ranks = new_medals, {nick: position + 1 for position, nick in enumerate(order)}
+
+        for row in range(len(self.nicks) - 1, -1, -1):
+            if self.nicks[row] not in new_medals:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.nicks[row]
+                self.endRemoveRows()
+        present = set(self.nicks)
+        for nick in sorted(new_medals):
+            if nick in present:
+                continue
+            row = bisect.bisect_left(self.nicks, nick)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.nicks.insert(row, nick)
+            self.endInsertRows()
+        # Linhas que já existiam: só as que mudaram de medalhas ou de posição são redesenhadas.
+        last_column = len(self.COLUMNS) - 1
+        for row, nick in enumerate(self.nicks):
+            if nick in old_medals and (old_medals[nick] != self.medals[nick] or old_ranks.get(nick) != self.ranks[nick]):
+                self.dataChanged.emit(self.index(row, 0), self.index(row, last_column))
+
 class HallOfFameTab(QWidget):
+    # (nick, versão do hall da fama em que foi lido, achievements/{nick})
+    achievements_loaded = pyqtSignal(str, object, object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.all_achievements = {}
+        self.cw = parent
+        self.version = None
+        self.nicks = None
+        self.selected_nick = None
+        # HTML do painel de conquistas por nick, válido enquanto hall_of_fame/version não mudar.
+        self.details_cache = {}
+        self.achievements_loaded.connect(self.on_achievements_loaded)
         self.setup_ui()
 
     def setup_ui(self):
         main_layout = QHBoxLayout(self)
-        
+
         ranking_layout = QVBoxLayout()
-        
+
         title_label = QLabel("🏆 Ranking de Medalhas 🏆")
         font = title_label.font()
         font.setBold(True)
         font.setPointSize(font.pointSize() + 1)
         title_label.setFont(font)
         title_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        
-        # --- INÍCIO DA CORREÇÃO: Troca QListWidget por QTableWidget ---
-        self.user_list = QTableWidget()
-        self.user_list.setColumnCount(5)
-        self.user_list.setHorizontalHeaderLabels(["#", "Nome", "🥇", "🥈", "🥉"])
-        self.user_list.itemSelectionChanged.connect(self.on_user_selected)
-        
+
+        # Tabela sobre um modelo: o polling só mexe nas linhas que mudaram, e o proxy ordena por qualquer coluna.
+        self.medal_model = MedalTableModel(self)
+        self.medal_proxy = QSortFilterProxyModel(self)
+        self.medal_proxy.setSourceModel(self.medal_model)
+        self.medal_proxy.setSortRole(Qt.ItemDataRole.UserRole)
+        self.user_list = QTableView()
+        self.user_list.setModel(self.medal_proxy)
+        self.user_list.setSortingEnabled(True)
+        self.user_list.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+        self.user_list.selectionModel().selectionChanged.connect(self.on_user_selected)
+
         # Configurações de aparência da tabela
         self.user_list.verticalHeader().setVisible(False)
         self.user_list.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.user_list.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.user_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
-        
+
         # Ajusta o tamanho das colunas
         header = self.user_list.horizontalHeader()
         header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents) # Rank #
@@ -44,128 +134,107 @@ class HallOfFameTab(QWidget):
         header.setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents) # Ouro
         header.setSectionResizeMode(3, QHeaderView.ResizeMode.ResizeToContents) # Prata
         header.setSectionResizeMode(4, QHeaderView.ResizeMode.ResizeToContents) # Bronze
-        # --- FIM DA CORREÇÃO ---
-        
+
         ranking_layout.addWidget(title_label)
         ranking_layout.addWidget(self.user_list)
-        
+
         ranking_widget = QWidget()
         ranking_widget.setLayout(ranking_layout)
 
         self.achievements_area = QTextBrowser()
         self.achievements_area.setReadOnly(True)
         self.achievements_area.setOpenExternalLinks(True)
-        
+
         main_layout.addWidget(ranking_widget, 1)
         main_layout.addWidget(self.achievements_area, 2)
 
     def populate_users(self, data):
-        self.all_achievements = data.get("achievements", {})
+        """Recebe {"users", "hall_of_fame": {"version", "medals"}} do polling. Sem versão nova
+        e sem mudança na lista de nicks, não há nada a fazer."""
+        hall_of_fame = data.get("hall_of_fame") or {}
         users_data = data.get("users", {})
-        
-        ranked_users = []
+        version = hall_of_fame.get("version")
         all_nicks = {ud.get("nickname") for ud in users_data.values() if ud.get("nickname")}
-
-        for nick in all_nicks:
-            achievements = self.all_achievements.get(nick, {})
-            counts = {"gold": 0, "silver": 0, "bronze": 0}
-            for ach_data in achievements.values():
-                medal = ach_data.get("medal")
-                if medal in counts:
-                    counts[medal] += 1
-            
-            ranked_users.append({
-                "nick": nick,
-                "gold": counts["gold"],
-                "silver": counts["silver"],
-                "bronze": counts["bronze"]
-            })
-
-        ranked_users.sort(key=lambda u: (-u['gold'], -u['silver'], -u['bronze'], u['nick']))
-
-        # --- INÍCIO DA CORREÇÃO: Popula a tabela em vez da lista ---
-        self.user_list.setRowCount(len(ranked_users))
-        for i, user_data in enumerate(ranked_users):
-            rank_item = QTableWidgetItem(str(i + 1))
-            name_item = QTableWidgetItem(user_data['nick'])
-            gold_item = QTableWidgetItem(str(user_data['gold']))
-            silver_item = QTableWidgetItem(str(user_data['silver']))
-            bronze_item = QTableWidgetItem(str(user_data['bronze']))
-
-            # Centraliza o texto nas colunas numéricas
-            rank_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            gold_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            silver_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            bronze_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            
-            # Armazena o nick puro no item do nome para referência
-            name_item.setData(Qt.ItemDataRole.UserRole, user_data['nick'])
-
-            self.user_list.setItem(i, 0, rank_item)
-            self.user_list.setItem(i, 1, name_item)
-            self.user_list.setItem(i, 2, gold_item)
-            self.user_list.setItem(i, 3, silver_item)
-            self.user_list.setItem(i, 4, bronze_item)
-        # --- FIM DA CORREÇÃO ---
+        if version == self.version and all_nicks == self.nicks:
+            return
+        version_changed = version != self.version
+        self.version, self.nicks = version, all_nicks
+        self.medal_model.set_medals(all_nicks, hall_of_fame.get("medals") or {})
+        if version_changed:
+            self.details_cache = {}
+            if self.selected_nick:
+                self.show_achievements(self.selected_nick)
 
     def on_user_selected(self):
-        selected_items = self.user_list.selectedItems()
-        if not selected_items:
-            return
-        
-        # --- CORREÇÃO: Pega o nick a partir da linha selecionada ---
-        current_row = self.user_list.currentRow()
-        if current_row < 0:
+        selected_rows = self.user_list.selectionModel().selectedRows()
+        if not selected_rows:
             return
-        
-        name_item = self.user_list.item(current_row, 1) # Coluna 1 é a do nome
-        if not name_item:
+        nick = self.medal_model.nick_at(self.medal_proxy.mapToSource(selected_rows[0]).row())
+        self.show_achievements(nick)
+
+    def show_achievements(self, nick):
+        """Mostra as conquistas do nick: do cache, se já foram montadas nesta versão; senão lê
+        achievements/{nick} numa thread (on_achievements_loaded)."""
+        self.selected_nick = nick
+        html = self.details_cache.get(nick)
+        if html is not None:
+            self.achievements_area.setHtml(html)
             return
-            
-        nick = name_item.data(Qt.ItemDataRole.UserRole)
-        # --- FIM DA CORREÇÃO ---
-        
-        self.achievements_area.clear()
-        user_achievements_dict = self.all_achievements.get(nick, {})
-        user_achievements = list(user_achievements_dict.values())
-
-        if not user_achievements:
-            self.achievements_area.setText(f"Nenhuma conquista para {nick}.")
+        if not self.cw or not self.cw.is_connected:
             return
-            
-        medals = {"gold": 0, "silver": 0, "bronze": 0}
-        for ach in user_achievements:
-            if ach.get("medal") in medals:
-                medals[ach["medal"]] += 1
-        summary = (f'<b>Conquistas de {nick}:</b><br>'
-                   f'🥇({medals["gold"]}) 🥈({medals["silver"]}) 🥉({medals["bronze"]})<hr>')
-        self.achievements_area.append(summary)
-        
-        sorted_achievements = sorted(user_achievements, key=lambda x: int(str(x.get('season_key', '0_0')).split('_')[0]), reverse=True)
-
-        for ach in sorted_achievements:
-            season_str = "Temporada Desconhecida"
-            try:
-                key_parts = str(ach.get('season_key', '0_0')).split('_')
-                season_number = key_parts[0]
-                
-                if len(key_parts) > 1:
-                    year_or_ts = key_parts[1]
-                    if len(year_or_ts) > 4:
-                        year = datetime.fromtimestamp(int(year_or_ts)).year
-                    else:
-                        year = year_or_ts
-                    season_str = f"Temporada {season_number} ({year})"
+        threading.Thread(target=self._load_achievements, args=(nick, self.version), daemon=True).start()
+
+    def _load_achievements(self, nick, version):
+        try:
+            achievements = self.cw.firebase.get_data(f"{ACHIEVEMENTS_ROOT}/{nick}", self.cw.id_token) or {}
+            self.achievements_loaded.emit(nick, version, achievements)
+        except Exception as e:
+            print(f"AnkiChat [ERRO] ao carregar as conquistas de {nick}: {e}")
+
+    def on_achievements_loaded(self, nick, version, achievements):
+        if version != self.version:
+            return  # Lido antes de uma temporada nova; populate_users já pediu de novo.
+        html = achievements_html(nick, achievements)
+        self.details_cache[nick] = html
+        if nick == self.selected_nick:
+            self.achievements_area.setHtml(html)
+
+def achievements_html(nick, achievements_dict):
+    user_achievements = [ach for ach in achievements_dict.values() if isinstance(ach, dict)]
+
+    if not user_achievements:
+        return f"Nenhuma conquista para {nick}."
+
+    medals = count_medals(achievements_dict)
+    parts = [f'<b>Conquistas de {nick}:</b><br>'
+             f'🥇({medals["gold"]}) 🥈({medals["silver"]}) 🥉({medals["bronze"]})<hr>']
+
+    sorted_achievements = sorted(user_achievements, key=lambda x: int(str(x.get('season_key', '0_0')).split('_')[0]), reverse=True)
+
+    for ach in sorted_achievements:
+        season_str = "Temporada Desconhecida"
+        try:
+            key_parts = str(ach.get('season_key', '0_0')).split('_')
+            season_number = key_parts[0]
+
+            if len(key_parts) > 1:
+                year_or_ts = key_parts[1]
+                if len(year_or_ts) > 4:
+                    year = datetime.fromtimestamp(int(year_or_ts)).year
                 else:
-                    season_str = f"Temporada {season_number}"
-
-            except (ValueError, IndexError, TypeError):
-                season_str = f"Temporada {ach.get('season_key', 'N/A')}"
-
-            position_text = ach.get('position', 'N/A')
-            position_str = f"{position_text}º" if isinstance(position_text, int) else position_text
-
-            line = (f"<b>{season_str}:</b><br>"
-                    f"  Divisão: {ach.get('division', 'N/A')} | Posição na Divisão: {position_str}<br>"
-                    f"  Pontos de Retenção: {ach.get('retention_points', 0)} | Pontos de Meta: {ach.get('meta_points', 0)}")
-            self.achievements_area.append(line)
\ No newline at end of file
+                    year = year_or_ts
+                season_str = f"Temporada {season_number} ({year})"
+            else:
+                season_str = f"Temporada {season_number}"
+
+        except (ValueError, IndexError, TypeError):
+            season_str = f"Temporada {ach.get('season_key', 'N/A')}"
+
+        position_text = ach.get('position', 'N/A')
+        position_str = f"{position_text}º" if isinstance(position_text, int) else position_text
+
+        parts.append(f"<b>{season_str}:</b><br>"
+                     f"  Divisão: {ach.get('division', 'N/A')} | Posição na Divisão: {position_str}<br>"
+                     f"  Pontos de Retenção: {ach.get('retention_points', 0)} | Pontos de Meta: {ach.get('meta_points', 0)}")
+    # O resumo já termina em <hr>; cada temporada começa numa linha nova.
+    return parts[0] + "<br>".join(parts[1:])
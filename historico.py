@@ -0,0 +1,375 @@
+# -- coding: utf-8 --
+# historico.py - Módulo para o armazenamento das mensagens do AnkiChat em baldes diários
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from .protocolo import decode_message, decode_messages, encode_message
+
+LEGACY_MESSAGES_ROOT = "messages"
+MESSAGES_BY_DAY_ROOT = "messages_by_day"
+MESSAGES_ARCHIVE_ROOT = "messages_archive"
+# Canais: channel_messages/{id do canal}/{AAAAMMDD}/{msg_id}, com os mesmos baldes diários do chat principal.
+CHANNEL_MESSAGES_ROOT = "channel_messages"
+# Índice por autor: messages_by_author/{nick}/{msg_id} = {"path": caminho da mensagem, "timestamp": ...}.
+# A moderação apaga as mensagens de um usuário sem baixar o histórico inteiro.
+MESSAGES_BY_AUTHOR_ROOT = "messages_by_author"
+AUTHOR_INDEX_VERSION = 1
+# Lápides das mensagens apagadas ({msg_id: {"timestamp": ...}}), para os caches locais reconciliarem exclusões.
+TOMBSTONES_ROOT = "message_tombstones"
+TOMBSTONE_RETENTION_DAYS = 30
+
+# Baldes mais antigos que HOT_DAYS saem do nó "quente" e vão para o arquivo;
+# o arquivo guarda no máximo ARCHIVE_RETENTION_DAYS dias.
+HOT_DAYS = 7
+ARCHIVE_RETENTION_DAYS = 180
+# Tamanho das páginas de histórico (limitToLast) na carga inicial, no polling e na rolagem para o topo.
+HISTORY_PAGE_SIZE = 50
+EXHAUSTED = "exhausted"
+
+def day_key(timestamp_ms=None):
+    """Chave do balde (AAAAMMDD, em UTC) para um timestamp em milissegundos ou para agora."""
+    if timestamp_ms is None:
+        moment = datetime.now(timezone.utc)
+    else:
+        moment = datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc)
+    return moment.strftime("%Y%m%d")
+
+def shift_day_key(day, days):
+    moment = datetime.strptime(day, "%Y%m%d") + timedelta(days=days)
+    return moment.strftime("%Y%m%d")
+
+def newest_timestamp(page):
+    timestamps = [m.get("timestamp") for m in page.values() if isinstance(m.get("timestamp"), (int, float))]
+    return max(timestamps) if timestamps else None
+
+def advance_cursor(cursors, source, page, boundaries=None):
+    """Guarda em cursors[source] o menor timestamp já carregado daquela fonte (para paginar com endAt)
+    e, em boundaries[source], os ids que têm exatamente esse timestamp."""
+    timestamps = {msg_id: m.get("timestamp") for msg_id, m in page.items() if isinstance(m.get("timestamp"), (int, float))}
+    cursor = cursors.get(source)
+    if not timestamps or cursor is EXHAUSTED:
+        return
+    oldest = min(timestamps.values())
+    at_oldest = {msg_id for msg_id, timestamp in timestamps.items() if timestamp == oldest}
+    if cursor is None or oldest < cursor:
+        cursors[source] = oldest
+        if boundaries is not None:
+            boundaries[source] = at_oldest
+    elif oldest == cursor and boundaries is not None:
+        boundaries[source] = boundaries.get(source, set()) | at_oldest
+
+def query_by_timestamp(firebase_api, id_token, path, start_at=None, end_at=None, limit_to_first=None, limit_to_last=None):
+    """Consulta ordenada por timestamp. Sem ".indexOn": "timestamp" nas regras o Firebase recusa a consulta (erro):
+    aí o nó é lido inteiro uma vez e recortado aqui, com o mesmo resultado. Nó vazio não é erro e não relê nada."""
+    params = firebase_api.build_query("timestamp", startAt=start_at, endAt=end_at, limitToFirst=limit_to_first, limitToLast=limit_to_last)
+    result, error = firebase_api.query_data(path, id_token, params)
+    if error is None:
+        return result or {}
+    node = firebase_api.get_data(path, id_token)
+    if not isinstance(node, dict):
+        return {}
+    entries = sorted((m.get("timestamp"), msg_id, m) for msg_id, m in node.items()
+                     if isinstance(m, dict) and isinstance(m.get("timestamp"), (int, float)))
+    if start_at is not None:
+        entries = [entry for entry in entries if entry[0] >= start_at]
+    if end_at is not None:
+        entries = [entry for entry in entries if entry[0] <= end_at]
+    if limit_to_first is not None:
+        entries = entries[:limit_to_first]
+    if limit_to_last is not None:
+        entries = entries[-limit_to_last:]
+    return {msg_id: m for _, msg_id, m in entries}
+
+def fetch_new_page(firebase_api, id_token, path, source, cursors, newest, boundaries=None):
+    """Delta de uma fonte: a última página na primeira vez, depois só o que chegou desde o último timestamp visto.
+    Atualiza `cursors` (mais antigo carregado) e `newest` (mais novo visto) para a chave `source`."""
+    last_seen = newest.get(source)
+    if last_seen is None:
+        page = query_by_timestamp(firebase_api, id_token, path, limit_to_last=HISTORY_PAGE_SIZE)
+    else:
+        # startAt é inclusivo: a mensagem da fronteira volta repetida e é descartada pelo id na interface.
+        page = query_by_timestamp(firebase_api, id_token, path, start_at=last_seen, limit_to_first=HISTORY_PAGE_SIZE)
+    page = decode_messages(page)
+    advance_cursor(cursors, source, page, boundaries)
+    page_newest = newest_timestamp(page)
+    if page_newest is not None and (last_seen is None or page_newest > last_seen):
+        newest[source] = page_newest
+    return page
+
+def fetch_page_before(firebase_api, id_token, path, source, cursors, boundaries, limit=HISTORY_PAGE_SIZE):
+    """Página anterior à mais antiga já carregada de uma fonte. endAt é inclusivo e várias mensagens podem ter
+    o mesmo ms: a consulta vai até o cursor e os ids da fronteira, já carregados, são descartados aqui.
+    Marca a fonte como EXHAUSTED quando a página vem incompleta."""
+    cursor = cursors.get(source)
+    seen = boundaries.get(source, set()) if cursor is not None else set()
+    page = decode_messages(query_by_timestamp(firebase_api, id_token, path, end_at=cursor, limit_to_last=limit + len(seen)))
+    page = {msg_id: msg for msg_id, msg in page.items() if msg_id not in seen}
+    advance_cursor(cursors, source, page, boundaries)
+    if len(page) < limit:
+        cursors[source] = EXHAUSTED
+    return page
+
+def bucket_path(day, root=MESSAGES_BY_DAY_ROOT):
+    return f"{root}/{day}"
+
+def channel_root(channel_id):
+    return f"{CHANNEL_MESSAGES_ROOT}/{channel_id}"
+
+def author_index_path(nick, msg_id=None):
+    return f"{MESSAGES_BY_AUTHOR_ROOT}/{nick}/{msg_id}" if msg_id else f"{MESSAGES_BY_AUTHOR_ROOT}/{nick}"
+
+def author_index_entry(path, msg):
+    return {"path": path, "timestamp": msg.get("timestamp")}
+
+def post_public_message(firebase_api, id_token, message_data, root=MESSAGES_BY_DAY_ROOT):
+    """Grava uma mensagem pública (no formato compacto v2) no balde do dia e a registra no índice por autor, num único PATCH.
+    Os dois {".sv": "timestamp"} são resolvidos na mesma escrita e ficam iguais. Retorna o msg_id."""
+    msg_id = firebase_api.generate_push_id()
+    path = f"{bucket_path(message_data['day'], root)}/{msg_id}"
+    firebase_api.patch_data("", {
+        path: encode_message(message_data),
+        author_index_path(message_data["nick"], msg_id): author_index_entry(path, message_data),
+    }, id_token)
+    return msg_id
+
+def message_path(msg_id, msg):
+    """Caminho de uma mensagem pública: no balde do dia (do chat principal ou do canal), ou no nó antigo se ela não tiver "day"."""
+    day, channel_id = msg.get("day"), msg.get("channel")
+    if channel_id:
+        return f"{bucket_path(day, channel_root(channel_id))}/{msg_id}"
+    return f"{bucket_path(day)}/{msg_id}" if day else f"{LEGACY_MESSAGES_ROOT}/{msg_id}"
+
+class MessageHistory:
+    """Controla quais baldes diários o cliente acompanha: só a última página do dia atual,
+    mais páginas antigas sob demanda (balde a balde, do mais novo para o mais antigo).
+    Os canais usam a mesma classe com outro nó de baldes e sem arquivo nem nó antigo."""
+    def __init__(self, firebase_api, chat_window, hot_root=MESSAGES_BY_DAY_ROOT,
+                 archive_root=MESSAGES_ARCHIVE_ROOT, legacy_root=LEGACY_MESSAGES_ROOT):
+        self.firebase = firebase_api
+        self.cw = chat_window
+        self.hot_root = hot_root
+        self.archive_root = archive_root
+        self.legacy_root = legacy_root
+        self.reset()
+
+    def reset(self):
+        self.current_day = None
+        self.sources = None
+        self.seek_timestamp = None
+        # (nó, dia) -> menor timestamp já carregado daquela fonte, ou EXHAUSTED quando não há mais nada.
+        self.cursors = {}
+        # (nó, dia) -> maior timestamp já visto; o polling pede só o que veio depois dele.
+        self.newest = {}
+        # (nó, dia) -> ids já carregados com o timestamp do cursor (a próxima página os recebe de novo).
+        self.boundaries = {}
+
+    def _source_path(self, source):
+        root, day = source
+        return f"{root}/{day}" if day else root
+
+    def _fetch_new(self, source):
+        return fetch_new_page(self.firebase, self.cw.id_token, self._source_path(source), source,
+                              self.cursors, self.newest, self.boundaries)
+
+    def _list_days(self, root=None):
+        # shallow=true devolve apenas as chaves dos baldes, sem o conteúdo.
+        days = self.firebase.get_data(root or self.hot_root, self.cw.id_token, "shallow=true") or {}
+        return sorted(days.keys())
+
+    def _sources(self):
+        """Fontes de histórico da mais nova para a mais antiga: baldes quentes e arquivados, e por último o nó antigo."""
+        if self.sources is None:
+            by_day = {day: self.archive_root for day in self._list_days(self.archive_root)} if self.archive_root else {}
+            by_day.update({day: self.hot_root for day in self._list_days()})
+            by_day.setdefault(self.current_day or day_key(), self.hot_root)
+            self.sources = [(by_day[day], day) for day in sorted(by_day, reverse=True)]
+            if self.legacy_root:
+                self.sources.append((self.legacy_root, None))
+            self._apply_seek()
+        return self.sources
+
+    def _apply_seek(self):
+        # O que é mais novo que seek_timestamp já veio do cache local: a rolagem continua a partir dele.
+        if self.seek_timestamp is None:
+            return
+        seek_day = day_key(self.seek_timestamp)
+        for root, day in self.sources:
+            if day and day > seek_day:
+                self.cursors[(root, day)] = EXHAUSTED
+            elif day == seek_day or not day:
+                cursor = self.cursors.get((root, day))
+                if cursor is None or (cursor is not EXHAUSTED and cursor > self.seek_timestamp):
+                    # As mensagens do próprio seek_timestamp voltam na próxima página e a interface as descarta pelo id.
+                    self.cursors[(root, day)] = self.seek_timestamp
+                    self.boundaries.pop((root, day), None)
+
+    def fetch_current(self):
+        """Novidades do balde atual (e do nó antigo, enquanto ele não for migrado pela compactação)."""
+        today = day_key()
+        messages = self._fetch_new((self.legacy_root, None)) if self.legacy_root else {}
+        if self.current_day and self.current_day != today:
+            # Virada do dia: uma última leitura do balde anterior para não perder mensagens tardias.
+            messages.update(self._fetch_new((self.hot_root, self.current_day)))
+            if self.sources is not None:
+                self.sources.insert(0, (self.hot_root, today))
+        messages.update(self._fetch_new((self.hot_root, today)))
+        self.current_day = today
+        return messages
+
+    def fetch_delta(self, since):
+        """Reconexão a partir do cache local: só as mensagens posteriores a `since`, balde a balde.
+        Retorna None se o cache for antigo demais (mais velho que os baldes quentes)."""
+        self.reset()
+        today = day_key()
+        day = day_key(since)
+        if day < shift_day_key(today, -HOT_DAYS):
+            return None
+        messages = {}
+        sources = [(self.legacy_root, None)] if self.legacy_root else []
+        while day <= today:
+            sources.append((self.hot_root, day))
+            day = shift_day_key(day, 1)
+        for source in sources:
+            self.newest[source] = since
+            page = self._fetch_new(source)
+            while len(page) >= HISTORY_PAGE_SIZE:
+                # Mais novidades do que cabem numa página: continua a partir da última recebida.
+                messages.update(page)
+                page = self._fetch_new(source)
+                if set(page) <= set(messages):
+                    break
+            messages.update(page)
+        self.current_day = today
+        return messages
+
+    def seek(self, timestamp):
+        """Posiciona a rolagem para trás logo antes de `timestamp` (a mensagem mais antiga já exibida)."""
+        self.seek_timestamp = timestamp
+        if self.sources is not None:
+            self._apply_seek()
+
+    def fetch_tombstones(self, cursor):
+        """Lápides criadas desde `cursor` (inclusive). Sem cursor, só a mais recente, para iniciar a contagem."""
+        if cursor is None:
+            params = self.firebase.build_query("timestamp", limitToLast=1)
+        else:
+            params = self.firebase.build_query("timestamp", startAt=cursor)
+        return self.firebase.get_data(TOMBSTONES_ROOT, self.cw.id_token, params) or {}
+
+    def fetch_initial(self):
+        """Carga inicial: só a última página, independente do tamanho do histórico."""
+        self.reset()
+        messages = self.fetch_current()
+        while len(messages) < HISTORY_PAGE_SIZE:
+            older = self.fetch_older()
+            if older is None:
+                break
+            messages.update(older)
+        return messages
+
+    def fetch_older(self):
+        """Próxima página anterior à mais antiga já carregada. None quando o histórico acabou."""
+        for source in self._sources():
+            if self.cursors.get(source) is EXHAUSTED:
+                continue
+            page = fetch_page_before(self.firebase, self.cw.id_token, self._source_path(source), source,
+                                     self.cursors, self.boundaries)
+            if page:
+                return page
+        return None
+
+def compact_message_buckets(firebase_api, id_token):
+    """Rotina de administração: migra o nó antigo para baldes, arquiva baldes expirados e aplica a retenção.
+    Roda no máximo uma vez por dia, a partir do cliente do administrador."""
+    try:
+        today = day_key()
+        last_run = firebase_api.get_data("league_status/last_message_compaction", id_token)
+        if last_run == today:
+            return
+
+        hot_limit = shift_day_key(today, -HOT_DAYS)
+        retention_limit = shift_day_key(today, -ARCHIVE_RETENTION_DAYS)
+        updates = {}
+
+        def index(msg_id, msg, path):
+            # Mantém o índice por autor apontando para o caminho atual (ou o remove, se a mensagem expirou).
+            nick = decode_message(msg).get("nick")
+            if nick:
+                updates[author_index_path(nick, msg_id)] = author_index_entry(path, msg) if path else None
+
+        if firebase_api.get_data("league_status/author_index_version", id_token) != AUTHOR_INDEX_VERSION:
+            # Primeira execução: indexa as mensagens gravadas antes do índice por autor existir.
+            for root in (MESSAGES_BY_DAY_ROOT, MESSAGES_ARCHIVE_ROOT):
+                for day, bucket in (firebase_api.get_data(root, id_token) or {}).items():
+                    for msg_id, msg in bucket.items():
+                        index(msg_id, msg, f"{root}/{day}/{msg_id}")
+            for channel_id, channel_days in (firebase_api.get_data(CHANNEL_MESSAGES_ROOT, id_token) or {}).items():
+                for day, bucket in channel_days.items():
+                    for msg_id, msg in bucket.items():
+                        index(msg_id, msg, f"{bucket_path(day, channel_root(channel_id))}/{msg_id}")
+            updates["league_status/author_index_version"] = AUTHOR_INDEX_VERSION
+
+        legacy_messages = firebase_api.get_data(LEGACY_MESSAGES_ROOT, id_token) or {}
+        for msg_id, msg in legacy_messages.items():
+            if decode_message(msg).get("target"):
+                # PVT ainda não migrado: fica no nó antigo para a migração de cada usuário (migrate_legacy_private_messages),
+                # em vez de ir para os baldes públicos que todos os clientes baixam.
+                continue
+            timestamp = msg.get("timestamp")
+            day = day_key(timestamp) if isinstance(timestamp, (int, float)) else today
+            root = MESSAGES_BY_DAY_ROOT if day >= hot_limit else MESSAGES_ARCHIVE_ROOT
+            if root == MESSAGES_BY_DAY_ROOT or day >= retention_limit:
+                updates[f"{root}/{day}/{msg_id}"] = dict(msg, day=day)
+                index(msg_id, msg, f"{root}/{day}/{msg_id}")
+            else:
+                index(msg_id, msg, None)
+            updates[f"{LEGACY_MESSAGES_ROOT}/{msg_id}"] = None
+
+        hot_days = firebase_api.get_data(MESSAGES_BY_DAY_ROOT, id_token, "shallow=true") or {}
+        archived_count = 0
+        for day in sorted(hot_days):
+            if day >= hot_limit:
+                break
+            bucket = firebase_api.get_data(bucket_path(day), id_token) or {}
+            for msg_id, msg in bucket.items():
+                if day >= retention_limit:
+                    updates[f"{MESSAGES_ARCHIVE_ROOT}/{day}/{msg_id}"] = msg
+                    index(msg_id, msg, f"{MESSAGES_ARCHIVE_ROOT}/{day}/{msg_id}")
+                else:
+                    index(msg_id, msg, None)
+            updates[bucket_path(day)] = None
+            archived_count += 1
+
+        archive_days = firebase_api.get_data(MESSAGES_ARCHIVE_ROOT, id_token, "shallow=true") or {}
+        expired_count = 0
+        for day in archive_days:
+            if day < retention_limit:
+                for msg_id, msg in (firebase_api.get_data(bucket_path(day, MESSAGES_ARCHIVE_ROOT), id_token) or {}).items():
+                    index(msg_id, msg, None)
+                updates[f"{MESSAGES_ARCHIVE_ROOT}/{day}"] = None
+                expired_count += 1
+
+        # Canais não têm arquivo: os baldes só ficam até o fim da retenção.
+        channels = firebase_api.get_data(CHANNEL_MESSAGES_ROOT, id_token, "shallow=true") or {}
+        for channel_id in channels:
+            channel_days = firebase_api.get_data(channel_root(channel_id), id_token, "shallow=true") or {}
+            for day in channel_days:
+                if day < retention_limit:
+                    for msg_id, msg in (firebase_api.get_data(bucket_path(day, channel_root(channel_id)), id_token) or {}).items():
+                        index(msg_id, msg, None)
+                    updates[bucket_path(day, channel_root(channel_id))] = None
+                    expired_count += 1
+
+        tombstone_limit = int((time.time() - TOMBSTONE_RETENTION_DAYS * 86400) * 1000)
+        expired_tombstones = firebase_api.get_data(
+            TOMBSTONES_ROOT, id_token, firebase_api.build_query("timestamp", endAt=tombstone_limit)) or {}
+        for msg_id in expired_tombstones:
+            updates[f"{TOMBSTONES_ROOT}/{msg_id}"] = None
+
+        updates["league_status/last_message_compaction"] = today
+        firebase_api.patch_data("", updates, id_token)
+        print(f"AnkiChat: Compactação de mensagens concluída. {len(legacy_messages)} migradas do nó antigo, "
+              f"{archived_count} baldes arquivados, {expired_count} baldes expirados.")
+    except Exception as e:
+        print(f"AnkiChat [ERRO] em compact_message_buckets: {e}")
@@ -0,0 +1,106 @@
+# -- coding: utf-8 --
+# latencia.py - Módulo para medir a latência de entrega das mensagens do AnkiChat
+
+import time
+import threading
+from collections import deque
+
+LATENCY_PATHS = ("main", "pvt", "quiz", "channel")
+PATH_LABELS = {"main": "Chat principal", "pvt": "Privadas", "quiz": "Quiz", "channel": "Canais"}
+# upload: envio -> gravação no servidor (timestamp .sv); delivery: gravação -> exibição; total: ponta a ponta.
+STAGES = ("upload", "delivery", "total")
+STAGE_LABELS = {"upload": "Envio", "delivery": "Entrega", "total": "Ponta a ponta"}
+# Quantas amostras recentes entram nos percentis de cada caminho.
+LATENCY_WINDOW = 500
+# Mensagens exibidas mais tarde que isso vieram de uma reconexão ou do histórico, não do fluxo ao vivo.
+LIVE_WINDOW_MS = 120000
+
+# Sincronização do relógio: cada cliente grava {".sv": "timestamp"} em clock_probe/{uid} algumas vezes
+# e usa a amostra de menor ida e volta (como no NTP) para estimar a diferença entre o relógio local e o do servidor.
+CLOCK_PROBE_ROOT = "clock_probe"
+CLOCK_PROBE_SAMPLES = 5
+# Intervalo do loop de polling do cliente (ChatWindow.poll_for_updates).
+POLL_INTERVAL_SECONDS = 2.0
+
+def percentile(sorted_values, fraction):
+    """Percentil pelo posto mais próximo; `sorted_values` já ordenado."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def estimate_clock_offset(firebase_api, id_token, path, samples=CLOCK_PROBE_SAMPLES):
+    """Diferença (ms) entre o relógio do servidor e o local, ou None se o servidor não respondeu."""
+    best = None
+    for _ in range(samples):
+        sent = time.time() * 1000
+        server_time = firebase_api.server_time(path, id_token)
+        received = time.time() * 1000
+        if server_time is None:
+            continue
+        round_trip = received - sent
+        if best is None or round_trip < best[0]:
+            best = (round_trip, server_time - (sent + received) / 2)
+    return None if best is None else best[1]
+
+class LatencyTracker:
+    """Percentis móveis (p50/p95/p99) da latência de cada caminho de mensagens.
+    Os tempos ficam no relógio do servidor: quem envia carimba "sent_at" já corrigido pelo seu
+    clock_offset, e quem exibe compara com o timestamp gravado pelo servidor."""
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.clock_offset = 0
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = {(path, stage): deque(maxlen=self.window) for path in LATENCY_PATHS for stage in STAGES}
+
+    def server_now(self):
+        return int(time.time() * 1000 + self.clock_offset)
+
+    def stamp(self, message_data):
+        """Carimba o horário de envio numa mensagem prestes a ser gravada."""
+        message_data["sent_at"] = self.server_now()
+        return message_data
+
+    def record(self, path, msg, rendered_at=None):
+        """Registra uma mensagem recém-exibida. Retorna False se ela não tem os carimbos ou não é do fluxo ao vivo."""
+        sent_at, committed_at = msg.get("sent_at"), msg.get("timestamp")
+        if not isinstance(sent_at, (int, float)) or not isinstance(committed_at, (int, float)) or path not in LATENCY_PATHS:
+            return False
+        rendered_at = self.server_now() if rendered_at is None else rendered_at
+        if rendered_at - committed_at > LIVE_WINDOW_MS:
+            return False
+        with self.lock:
+            self.samples[(path, "upload")].append(committed_at - sent_at)
+            self.samples[(path, "delivery")].append(rendered_at - committed_at)
+            self.samples[(path, "total")].append(rendered_at - sent_at)
+        return True
+
+    def summary(self):
+        """{caminho: {"count": n, etapa: (p50, p95, p99)}} só dos caminhos com amostras."""
+        with self.lock:
+            snapshot = {key: sorted(values) for key, values in self.samples.items()}
+        result = {}
+        for path in LATENCY_PATHS:
+            count = len(snapshot[(path, "total")])
+            if not count:
+                continue
+            result[path] = {"count": count}
+            for stage in STAGES:
+                values = snapshot[(path, stage)]
+                result[path][stage] = tuple(percentile(values, fraction) for fraction in (0.50, 0.95, 0.99))
+        return result
+
+def format_report(tracker):
+    """Relatório em texto (modo headless e console)."""
+    summary = tracker.summary()
+    if not summary:
+        return "Nenhuma amostra de latência registrada."
+    lines = [f"{'Caminho':<16}{'N':>6}  " + "  ".join(f"{STAGE_LABELS[stage] + ' p50/p95/p99 (ms)':>34}" for stage in STAGES)]
+    for path, data in summary.items():
+        columns = "  ".join(f"{'/'.join(str(int(value)) for value in data[stage]):>34}" for stage in STAGES)
+        lines.append(f"{PATH_LABELS[path]:<16}{data['count']:>6}  {columns}")
+    return "\n".join(lines)
@@ -0,0 +1,397 @@
+# -- coding: utf-8 --
+# liga.py - Módulo para os dados da liga (metas por série e classificação) do AnkiChat
+
+import time
+import threading
+
+from .ranking import DIVISIONS, rank_divisions
+
+# Os registros de metas ficam divididos por série: goals_by_division/{A..D}/{uid}, e goal_division/{uid}
+# diz em qual série cada usuário está. Clientes antigos ainda gravam em goals/{uid}; o cliente do admin
+# move esses registros para as séries continuamente (move_legacy_goals).
+GOALS_ROOT = "goals"
+GOALS_BY_DIVISION_ROOT = "goals_by_division"
+GOAL_DIVISION_ROOT = "goal_division"
+# goal_flags/{uid} = arquivo da bandeira: a lista de usuários e o chat mostram a bandeira de todos,
+# não só de quem está nas séries baixadas.
+GOAL_FLAGS_ROOT = "goal_flags"
+GOAL_FLAGS_REFRESH_SECONDS = 300
+GOALS_STORAGE_VERSION = 3
+# Toda gravação de metas leva o timestamp do servidor neste campo (as regras do banco precisam
+# de ".indexOn": ["updated_at"] em cada goals_by_division/{série} para a consulta incremental).
+UPDATED_AT_KEY = "updated_at"
+# A cada tantos segundos a tabela é baixada inteira, para pegar remoções e registros de clientes antigos sem updated_at.
+GOALS_FULL_RESYNC_SECONDS = 300
+# A consulta incremental volta um pouco antes do cursor: gravações com timestamps próximos podem
+# ser confirmadas fora de ordem, e reler alguns registros é mais barato do que perder um.
+GOALS_CURSOR_OVERLAP_MS = 5000
+# users/{uid} = {"nickname", "updated_at"}: o diretório de nicks, sincronizado pelo mesmo cursor de updated_at
+# que as séries (precisa de ".indexOn": ["updated_at"] em users).
+USERS_ROOT = "users"
+
+# Classificação já pronta, montada por um cliente só (o do admin): leaderboard/version (inteiro crescente),
+# leaderboard/built_at, leaderboard/counts/{série} e leaderboard/divisions/{série} = [linha, ...] na ordem do ranking.
+LEADERBOARD_ROOT = "leaderboard"
+# Intervalo mínimo entre duas reconstruções, e idade máxima de uma classificação mesmo sem mudança detectada.
+LEADERBOARD_REBUILD_SECONDS = 30
+LEADERBOARD_MAX_AGE_SECONDS = 600
+# Com o admin online, built_at nunca passa muito de LEADERBOARD_MAX_AGE_SECONDS; mais velha do que isso (com margem
+# para relógios e ciclos de polling), a classificação parou de ser montada e quem lê volta a classificar localmente.
+LEADERBOARD_STALE_SECONDS = LEADERBOARD_MAX_AGE_SECONDS + 300
+# Campos de goals copiados para cada linha (além de uid e nick), tudo o que a aba de metas mostra.
+LEADERBOARD_FIELDS = ("division", "flag", "materia", "retention_points", "meta_points", "reviews_today", "goal_daily",
+                      "reviews_week", "study_time_today", "study_time_week", "new_cards_week")
+
+def stamp_goal(goal_data):
+    """Marca um registro de goals com o timestamp do servidor antes de gravá-lo."""
+    goal_data[UPDATED_AT_KEY] = {".sv": "timestamp"}
+    return goal_data
+
+def goal_division(goal_data):
+    division = goal_data.get("division", "D") if isinstance(goal_data, dict) else "D"
+    return division if division in DIVISIONS else "D"
+
+def division_path(division):
+    return f"{GOALS_BY_DIVISION_ROOT}/{division}"
+
+def goal_updates(uid, goal_data):
+    """Escritas (multi-path) que gravam o registro na série dele e o tiram das outras."""
+    division = goal_division(goal_data)
+    updates = {f"{division_path(name)}/{uid}": None for name in DIVISIONS if name != division}
+    updates[f"{division_path(division)}/{uid}"] = stamp_goal(dict(goal_data, division=division))
+    updates[f"{GOAL_DIVISION_ROOT}/{uid}"] = division
+    updates[f"{GOAL_FLAGS_ROOT}/{uid}"] = goal_data.get("flag") or None
+    return updates
+
+def put_goal(firebase_api, uid, goal_data, id_token):
+    return firebase_api.patch_data("", goal_updates(uid, goal_data), id_token)
+
+def put_user(firebase_api, uid, nickname, id_token):
+    return firebase_api.put_data(f"{USERS_ROOT}/{uid}", {"nickname": nickname, UPDATED_AT_KEY: {".sv": "timestamp"}}, id_token)
+
+def get_goal(firebase_api, uid, id_token):
+    """Registro de metas de um usuário, ou None. Sem registro nas séries cai para o nó antigo goals/{uid};
+    a próxima gravação (put_goal) já o coloca na série certa."""
+    division = firebase_api.get_data(f"{GOAL_DIVISION_ROOT}/{uid}", id_token)
+    if division in DIVISIONS:
+        goal_data = firebase_api.get_data(f"{division_path(division)}/{uid}", id_token)
+        if isinstance(goal_data, dict):
+            return goal_data
+    goal_data = firebase_api.get_data(f"{GOALS_ROOT}/{uid}", id_token)
+    return goal_data if isinstance(goal_data, dict) else None
+
+def read_all_goals(firebase_api, id_token):
+    """{uid: registro} de todas as séries numa leitura só (fim de temporada, migração)."""
+    shards = firebase_api.get_data(GOALS_BY_DIVISION_ROOT, id_token) or {}
+    return {uid: goal_data for division in DIVISIONS for uid, goal_data in (shards.get(division) or {}).items()
+            if isinstance(goal_data, dict)}
+
+def goal_field_updates(uid, goal_data, fields):
+    """Escritas (multi-path) campo a campo num registro já gravado: quem grava outros campos ao mesmo tempo
+    não perde nada. Se `fields` muda a série, o registro inteiro vai para a série nova (goal_updates)."""
+    division = goal_division(goal_data)
+    if goal_division(dict(goal_data, **fields)) != division:
+        return goal_updates(uid, dict(goal_data, **fields))
+    record_path = f"{division_path(division)}/{uid}"
+    updates = {f"{record_path}/{field}": value for field, value in fields.items()}
+    updates[f"{record_path}/{UPDATED_AT_KEY}"] = {".sv": "timestamp"}
+    return updates
+
+def move_legacy_goals(firebase_api, id_token):
+    """Move para as séries o que estiver em goals/{uid} e apaga o nó antigo. Com goals/ vazio é uma leitura só,
+    então roda a cada reconstrução da classificação: clientes antigos continuam gravando lá.
+    Para quem já está nas séries, o registro antigo é o mais novo (quem o gravou não vê as séries), mas a série
+    continua a das séries: só o fim de temporada muda a série. Retorna quantos registros foram movidos."""
+    legacy_goals = firebase_api.get_data(GOALS_ROOT, id_token)
+    if not isinstance(legacy_goals, dict) or not legacy_goals:
+        return 0
+    updates = {}
+    moved = 0
+    for uid, goal_data in legacy_goals.items():
+        if isinstance(goal_data, dict):
+            division = firebase_api.get_data(f"{GOAL_DIVISION_ROOT}/{uid}", id_token)
+            if division in DIVISIONS:
+                sharded = firebase_api.get_data(f"{division_path(division)}/{uid}", id_token)
+                goal_data = dict(sharded if isinstance(sharded, dict) else {}, **goal_data)
+                goal_data["division"] = division
+            updates.update(goal_updates(uid, goal_data))
+            moved += 1
+        updates[f"{GOALS_ROOT}/{uid}"] = None
+    return moved if firebase_api.patch_data("", updates, id_token) else 0
+
+def migrate_goals_to_shards(firebase_api, id_token):
+    """Rotina de administração: move goals/{uid} para as séries (move_legacy_goals) e, uma vez só
+    (league_status/goals_storage_version), preenche goal_flags/ a partir das séries."""
+    try:
+        moved = move_legacy_goals(firebase_api, id_token)
+        if moved:
+            print(f"AnkiChat: {moved} registros de metas movidos do nó antigo para as séries.")
+        if firebase_api.get_data("league_status/goals_storage_version", id_token) == GOALS_STORAGE_VERSION:
+            return
+        all_goals = read_all_goals(firebase_api, id_token)
+        if not all_goals:
+            return  # Séries vazias ou erro de leitura: tenta de novo no próximo login.
+        updates = {f"{GOAL_FLAGS_ROOT}/{uid}": goal_data.get("flag") or None for uid, goal_data in all_goals.items()}
+        updates["league_status/goals_storage_version"] = GOALS_STORAGE_VERSION
+        if firebase_api.patch_data("", updates, id_token):
+            print(f"AnkiChat: Bandeiras de {len(updates) - 1} usuários copiadas para {GOAL_FLAGS_ROOT}.")
+    except Exception as e:
+        print(f"AnkiChat [ERRO] em migrate_goals_to_shards: {e}")
+
+class GoalsSync:
+    """Cópia local de uma série (goals_by_division/{série}) mantida por consultas incrementais: a cada chamada
+    só descem os registros com updated_at a partir do último cursor, e a cópia inteira é refeita de tempos em tempos.
+    Usado pela thread de polling e pela atualização depois do quiz, por isso o lock."""
+    def __init__(self, firebase_api, path, full_resync_seconds=GOALS_FULL_RESYNC_SECONDS):
+        self.firebase = firebase_api
+        self.path = path
+        self.full_resync_seconds = full_resync_seconds
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.goals = {}
+        self.cursor = None
+        self.last_full_sync = None
+
+    def _full_sync_due(self):
+        return self.last_full_sync is None or time.monotonic() - self.last_full_sync >= self.full_resync_seconds
+
+    def _advance_cursor(self, records):
+        for goal_data in records.values():
+            updated_at = goal_data.get(UPDATED_AT_KEY) if isinstance(goal_data, dict) else None
+            if isinstance(updated_at, (int, float)) and (self.cursor is None or updated_at > self.cursor):
+                self.cursor = updated_at
+
+    def fetch(self, id_token, force_full=False):
+        """Atualiza a cópia local e devolve um retrato dela ({uid: registro}).
+        Os registros nunca são alterados no lugar, então o retrato pode ir para a GUI."""
+        with self.lock:
+            if not force_full and not self._full_sync_due() and self.cursor is not None:
+                params = self.firebase.build_query(UPDATED_AT_KEY, startAt=self.cursor - GOALS_CURSOR_OVERLAP_MS)
+                changed, error = self.firebase.query_data(self.path, id_token, params)
+                if error is None:
+                    # Nada gravado desde o cursor chega como null: a cópia continua valendo.
+                    changed = {uid: goal_data for uid, goal_data in (changed or {}).items() if isinstance(goal_data, dict)}
+                    self.goals.update(changed)
+                    self._advance_cursor(changed)
+                    return dict(self.goals)
+                # Sem ".indexOn" a consulta é recusada: segue para a leitura completa.
+            goals_data = self.firebase.get_data(self.path, id_token)
+            # Série vazia e erro chegam os dois como None: a cópia fica vazia até a próxima leitura completa.
+            self.goals = {uid: goal_data for uid, goal_data in (goals_data or {}).items() if isinstance(goal_data, dict)}
+            self.cursor = None
+            self._advance_cursor(self.goals)
+            self.last_full_sync = time.monotonic()
+            return dict(self.goals)
+
+class UsersSync(GoalsSync):
+    """Cópia local de users/ ({uid: {"nickname", ...}}) para a lista de usuários, as metas e os rankings:
+    a cada ciclo só descem os usuários gravados desde o cursor, em vez do nó inteiro."""
+    def __init__(self, firebase_api, full_resync_seconds=GOALS_FULL_RESYNC_SECONDS):
+        super().__init__(firebase_api, USERS_ROOT, full_resync_seconds)
+
+class DivisionGoalsSync:
+    """Um GoalsSync por série; só as séries pedidas (a do usuário e as que ele abriu na aba de metas) são lidas."""
+    def __init__(self, firebase_api):
+        self.shards = {division: GoalsSync(firebase_api, division_path(division)) for division in DIVISIONS}
+        self.reset()
+
+    def reset(self):
+        self.wanted = set()
+        for shard in self.shards.values():
+            shard.reset()
+
+    def want(self, division):
+        """Passa a sincronizar a série. Retorna True se ela ainda não estava na lista."""
+        if division not in self.shards or division in self.wanted:
+            return False
+        self.wanted = self.wanted | {division}
+        return True
+
+    @property
+    def cursor(self):
+        return tuple(self.shards[division].cursor for division in DIVISIONS)
+
+    def fetch(self, id_token, all_divisions=False):
+        """{uid: registro} das séries sincronizadas (ou de todas, para quem monta a classificação)."""
+        goals = {}
+        for division in (DIVISIONS if all_divisions else sorted(self.wanted)):
+            goals.update(self.shards[division].fetch(id_token))
+        return goals
+
+class GoalFlagsSync:
+    """{uid: bandeira} de todos os usuários (goal_flags/), relido no máximo a cada GOAL_FLAGS_REFRESH_SECONDS:
+    bandeiras mudam pouco, e as das séries baixadas já chegam atualizadas pelos próprios registros."""
+    def __init__(self, firebase_api):
+        self.firebase = firebase_api
+        self.reset()
+
+    def reset(self):
+        self.flags = {}
+        self.last_fetch = None
+
+    def fetch(self, id_token):
+        now = time.monotonic()
+        if self.last_fetch is None or now - self.last_fetch >= GOAL_FLAGS_REFRESH_SECONDS:
+            flags = self.firebase.get_data(GOAL_FLAGS_ROOT, id_token)
+            if isinstance(flags, dict):
+                self.flags = {uid: flag for uid, flag in flags.items() if isinstance(flag, str)}
+                self.last_fetch = now
+        return dict(self.flags)
+
+def build_leaderboard(users_data, goals_data):
+    """{série: [linha, ...]} com as linhas já juntadas a "users" (nick) e na ordem de rank_divisions.
+    Usuários sem nick ficam de fora, como na aba de metas."""
+    nicks = {uid: (users_data.get(uid) or {}).get("nickname") for uid in goals_data}
+    ranked = rank_divisions({uid: goal_data for uid, goal_data in goals_data.items() if nicks.get(uid)})
+    divisions = {}
+    for div_name, div_uids in ranked.items():
+        rows = []
+        for uid in div_uids:
+            goal_data = goals_data[uid]
+            row = {"uid": uid, "nick": nicks[uid]}
+            row.update({field: goal_data[field] for field in LEADERBOARD_FIELDS if goal_data.get(field) is not None})
+            rows.append(row)
+        divisions[div_name] = rows
+    return divisions
+
+def leaderboard_goals(leaderboard):
+    """As linhas da classificação no formato de "goals" ({uid: registro}), para quem só precisa de bandeira e série."""
+    return {row["uid"]: row for rows in (leaderboard.get("divisions") or {}).values() for row in (rows or []) if isinstance(row, dict)}
+
+class LeaderboardBuilder:
+    """Reconstrói leaderboard/ a partir de todas as séries (via DivisionGoalsSync) no máximo a cada LEADERBOARD_REBUILD_SECONDS,
+    e só quando goals ou users mudaram (ou a classificação passou de LEADERBOARD_MAX_AGE_SECONDS).
+    Roda no cliente do admin; qualquer processo com o mesmo acesso pode fazer o mesmo papel."""
+    def __init__(self, firebase_api, goals_sync):
+        self.firebase = firebase_api
+        self.goals_sync = goals_sync
+        self.reset()
+
+    def reset(self):
+        self.last_build = None
+        self.last_key = None
+
+    def rebuild_if_due(self, id_token, users_data):
+        now = time.monotonic()
+        if self.last_build is not None and now - self.last_build < LEADERBOARD_REBUILD_SECONDS:
+            return False
+        # Registros que clientes antigos gravaram em goals/ entram nas séries antes de a classificação ser montada.
+        move_legacy_goals(self.firebase, id_token)
+        goals_data = self.goals_sync.fetch(id_token, all_divisions=True)
+        # Cursor de updated_at + tamanhos: muda sempre que algum registro é gravado, criado ou apagado.
+        key = (self.goals_sync.cursor, len(goals_data), len(users_data))
+        if key == self.last_key and now - self.last_build < LEADERBOARD_MAX_AGE_SECONDS:
+            return False
+        divisions = build_leaderboard(users_data, goals_data)
+        if not self.firebase.patch_data(LEADERBOARD_ROOT, {
+            "divisions": divisions,
+            "counts": {division: len(rows) for division, rows in divisions.items()},
+            "built_at": {".sv": "timestamp"},
+            "version": {".sv": {"increment": 1}},
+        }, id_token):
+            return False
+        self.last_build, self.last_key = now, key
+        return True
+
+class LeaderboardSync:
+    """Lado de quem lê: a cada ciclo só leaderboard/version e leaderboard/built_at descem. Quando a versão muda
+    descem as contagens e as séries pedidas; as outras só quando forem abertas. fetch() devolve
+    {"version", "counts", "divisions": {série: linhas}}, ou None se ainda não há classificação publicada
+    ou se ela tem mais de LEADERBOARD_STALE_SECONDS (o admin está offline e ninguém a reconstrói)."""
+    def __init__(self, firebase_api):
+        self.firebase = firebase_api
+        self.reset()
+
+    def reset(self):
+        self.version = None
+        self.built_at = None
+        self.counts = {}
+        self.divisions = {}
+
+    def fetch(self, id_token, wanted, server_now):
+        """`server_now`: agora no relógio do servidor, em ms (LatencyTracker.server_now())."""
+        version = self.firebase.get_data(f"{LEADERBOARD_ROOT}/version", id_token)
+        built_at = self.firebase.get_data(f"{LEADERBOARD_ROOT}/built_at", id_token)
+        if isinstance(built_at, (int, float)):
+            self.built_at = built_at
+        if isinstance(version, int) and version != self.version:
+            self.version = version
+            self.counts = self.firebase.get_data(f"{LEADERBOARD_ROOT}/counts", id_token) or {}
+            self.divisions = {}
+        if self.version is None or self.built_at is None:
+            return None
+        if server_now - self.built_at > LEADERBOARD_STALE_SECONDS * 1000:
+            return None
+        for division in sorted(wanted):
+            if division not in self.divisions:
+                rows = self.firebase.get_data(f"{LEADERBOARD_ROOT}/divisions/{division}", id_token)
+                # O Firebase devolve listas com buracos como objeto {"0": ..., "2": ...}.
+                self.divisions[division] = rows if isinstance(rows, list) else [rows[key] for key in sorted(rows or {}, key=int)]
+        return {"version": self.version, "counts": dict(self.counts), "divisions": dict(self.divisions)}
+
+# Hall da fama: hall_of_fame/medals/{nick} = {"gold", "silver", "bronze"}, recontado de achievements/{nick}
+# no fim de cada temporada, e hall_of_fame/version, que sobe a cada recontagem.
+HALL_OF_FAME_ROOT = "hall_of_fame"
+ACHIEVEMENTS_ROOT = "achievements"
+MEDALS = ("gold", "silver", "bronze")
+
+def count_medals(achievements):
+    counts = dict.fromkeys(MEDALS, 0)
+    for ach_data in (achievements or {}).values():
+        medal = ach_data.get("medal") if isinstance(ach_data, dict) else None
+        if medal in counts:
+            counts[medal] += 1
+    return counts
+
+def medal_count_updates(firebase_api, season_achievements, season_key, id_token):
+    """Escritas (multi-path) dos contadores do hall da fama com as medalhas da temporada `season_key`
+    ({nick: registro}) já incluídas, e uma nova versão. A contagem parte de achievements/{nick} com essa
+    temporada substituída: nada é somado às cegas, e processar a mesma temporada de novo dá os mesmos contadores."""
+    updates = {}
+    for nick, entry in season_achievements.items():
+        achievements = firebase_api.get_data(f"{ACHIEVEMENTS_ROOT}/{nick}", id_token) or {}
+        achievements[season_key] = entry
+        updates[f"{HALL_OF_FAME_ROOT}/medals/{nick}"] = count_medals(achievements)
+    updates[f"{HALL_OF_FAME_ROOT}/version"] = {".sv": {"increment": 1}}
+    return updates
+
+def migrate_medal_counts(firebase_api, id_token):
+    """Rotina de administração: monta hall_of_fame/ a partir de achievements/ inteiro, uma vez só
+    (bancos de antes dos contadores, sem hall_of_fame/version)."""
+    try:
+        if firebase_api.get_data(f"{HALL_OF_FAME_ROOT}/version", id_token) is not None:
+            return
+        achievements = firebase_api.get_data(ACHIEVEMENTS_ROOT, id_token) or {}
+        medals = {nick: count_medals(user_achievements) for nick, user_achievements in achievements.items()
+                  if isinstance(user_achievements, dict)}
+        if firebase_api.patch_data(HALL_OF_FAME_ROOT, {"medals": medals, "version": 1}, id_token):
+            print(f"AnkiChat: Contadores do hall da fama montados para {len(medals)} usuários.")
+    except Exception as e:
+        print(f"AnkiChat [ERRO] em migrate_medal_counts: {e}")
+
+class HallOfFameSync:
+    """A cada ciclo só hall_of_fame/version desce; os contadores só quando ela muda.
+    Enquanto o banco não tem contadores (migrate_medal_counts ainda não rodou), achievements/ é lido
+    uma vez só e contado aqui. fetch() devolve {"version", "medals": {nick: {"gold", "silver", "bronze"}}}."""
+    def __init__(self, firebase_api):
+        self.firebase = firebase_api
+        self.reset()
+
+    def reset(self):
+        self.version = None
+        self.medals = {}
+        self.counted_locally = False
+
+    def fetch(self, id_token):
+        version = self.firebase.get_data(f"{HALL_OF_FAME_ROOT}/version", id_token)
+        if isinstance(version, int) and version != self.version:
+            self.version = version
+            self.medals = self.firebase.get_data(f"{HALL_OF_FAME_ROOT}/medals", id_token) or {}
+        elif self.version is None and not self.counted_locally:
+            achievements = self.firebase.get_data(ACHIEVEMENTS_ROOT, id_token) or {}
+            self.medals = {nick: count_medals(user_achievements) for nick, user_achievements in achievements.items()
+                           if isinstance(user_achievements, dict)}
+            self.counted_locally = True
+        return {"version": self.version, "medals": self.medals}
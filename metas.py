@@ -1,29 +1,271 @@
 # -- coding: utf-8 --
 # metas.py - Módulo para gerenciar Metas, Ranking e Legado do AnkiChat (v3.4 - Retorno para Temporada Semanal)
 
-import random
 from datetime import datetime, timedelta
-import os
-import re
+import json
+import hashlib
+import threading
 
 from aqt.qt import (
-    QDialog, QFormLayout, QLineEdit, QDialogButtonBox
+    QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QAbstractItemModel, QSortFilterProxyModel,
+    QModelIndex, QColor, QFont, Qt
 )
 from aqt.utils import tooltip
 from aqt import mw
 
+from .ranking import DIVISIONS
+from .liga import build_leaderboard, get_goal, put_goal
+from .temporada import SeasonEnd
+
+# Linhas de cada série materializadas por vez, conforme a série é aberta e rolada.
+GOALS_PAGE_SIZE = 200
+# Colunas da tabela de metas; os títulos vêm do i18n (LanguageManager) pelas mesmas chaves.
+GOALS_COLUMNS = ("goals_position", "goals_user", "goals_subject", "goals_score", "goals_efficiency", "today", "week")
+# Cor de fundo de cada destaque: (modo claro, modo noturno).
+ROW_COLORS = {"self": ("#ffffbb", "#4a4a2a"), "promote": ("#aaffaa", "#2E4E2E"), "relegate": ("#ffaaaa", "#5A2A2A")}
+
+def _format_seconds(seconds):
+    minutes, sec = divmod(seconds, 60)
+    return f"{int(minutes)}m {int(sec)}s"
+
+def goals_rows(data, me=None):
+    """{série: [linha, ...]} já na ordem do ranking. Cada linha é (textos, valores de ordenação, bandeira, destaque).
+    Só entram as séries já carregadas (data['divisions']); as outras vêm quando o usuário abre cada uma.
+    Não toca em widgets: roda fora da thread da GUI."""
+    leaderboard = data.get('leaderboard')
+    if leaderboard:
+        # Classificação publicada em leaderboard/: já vem ordenada e com os nicks.
+        ranked = leaderboard.get("divisions") or {}
+    else:
+        ranked = build_leaderboard(data.get('users', {}), data.get('goals', {}))
+    loaded_divisions = data.get('divisions')
+    if loaded_divisions is not None:
+        ranked = {div_name: rows for div_name, rows in ranked.items() if div_name in loaded_divisions}
+    divisions = {div_name: [(row["nick"], row) for row in (rows or []) if isinstance(row, dict)] for div_name, rows in ranked.items()}
+
+    result = {}
+    for div_name, div_users in divisions.items():
+
+        num_users_in_div = len(div_users)
+        num_to_promote = 2 if div_name != "A" else 0
+
+        if num_users_in_div <= 2: num_to_relegate = 0
+        elif num_users_in_div == 3: num_to_relegate = 1
+        else: num_to_relegate = 2
+        if div_name == "D": num_to_relegate = 0
+
+        rows = []
+        for i, (user, data) in enumerate(div_users):
+            pos = i + 1; points = data.get("retention_points", 0); materia = data.get("materia", "N/A")
+            reviews_today = data.get("reviews_today", 0); goal_daily = data.get("goal_daily", 100)
+            reviews_week = data.get("reviews_week", 0)
+            study_time_today = data.get("study_time_today", 0); study_time_week = data.get("study_time_week", 0)
+
+            max_possible_pts = reviews_week * 5
+            aproveitamento = (points / max_possible_pts * 100) if max_possible_pts > 0 else 0
+
+            highlight = None
+            if me and user == me: highlight = "self"
+            elif pos <= num_to_promote: highlight = "promote"
+            elif pos > num_users_in_div - num_to_relegate: highlight = "relegate"
+
+            texts = (str(pos), user, materia, f"{points} PR", f"{aproveitamento:.0f}%",
+                     f"{reviews_today}/{goal_daily} ({_format_seconds(study_time_today)})",
+                     f"{reviews_week} ({_format_seconds(study_time_week)})")
+            sort_values = (pos, user.lower(), str(materia).lower(), points, aproveitamento, reviews_today, reviews_week)
+            rows.append((texts, sort_values, data.get("flag"), highlight))
+        result[div_name] = rows
+    return result
+
+class GoalsTableModel(QAbstractItemModel):
+    """Ranking em dois níveis: uma linha por série (A-D) e, dentro dela, os usuários na ordem do ranking.
+    As linhas de uma série só entram no modelo quando ela é aberta, em blocos de GOALS_PAGE_SIZE
+    (canFetchMore/fetchMore), e as atualizações do polling trocam os dados no lugar, sem reset,
+    para a rolagem e as séries abertas ficarem como estão. Séries que ainda não foram baixadas
+    (fora de `available`) mostram só o total do leaderboard, quando conhecido."""
+    def __init__(self, chat_window, parent=None):
+        super().__init__(parent)
+        self.cw = chat_window
+        self.rows = {name: [] for name in DIVISIONS}
+        self.loaded = {name: 0 for name in DIVISIONS}
+        self.available = set()
+        self.counts = {}
+        self.headers = list(GOALS_COLUMNS)
+        self.night_mode = False
+
+    # --- Estrutura: internalId 0 = linha de série; n > 0 = usuário da série DIVISIONS[n - 1] ---
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        return self.createIndex(row, column, parent.row() + 1)
+
+    def parent(self, index):
+        if not index.isValid() or index.internalId() == 0:
+            return QModelIndex()
+        return self.createIndex(index.internalId() - 1, 0, 0)
+
+    def _division(self, index):
+        """Série de uma linha de série (o próprio índice) ou de usuário (o pai)."""
+        return DIVISIONS[index.row()] if index.internalId() == 0 else DIVISIONS[index.internalId() - 1]
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(DIVISIONS)
+        if parent.internalId() == 0 and parent.column() == 0:
+            return self.loaded[DIVISIONS[parent.row()]]
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(GOALS_COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return True
+        if parent.internalId() != 0 or parent.column() != 0:
+            return False
+        # A seta de abrir aparece antes de qualquer linha ser materializada e, numa série ainda não
+        # baixada, é o que dispara o download dela (GoalsManager.on_division_expanded).
+        name = DIVISIONS[parent.row()]
+        if name not in self.available:
+            return self.counts.get(name) != 0
+        return bool(self.rows[name])
+
+    def canFetchMore(self, parent):
+        if not parent.isValid() or parent.internalId() != 0:
+            return False
+        name = DIVISIONS[parent.row()]
+        return self.loaded[name] < len(self.rows[name])
+
+    def fetchMore(self, parent, count=GOALS_PAGE_SIZE):
+        if not self.canFetchMore(parent):
+            return
+        name = DIVISIONS[parent.row()]
+        count = min(count, len(self.rows[name]) - self.loaded[name])
+        self.beginInsertRows(parent.sibling(parent.row(), 0), self.loaded[name], self.loaded[name] + count - 1)
+        self.loaded[name] += count
+        self.endInsertRows()
+
+    def fetch_all(self):
+        for row in range(len(DIVISIONS)):
+            division_index = self.index(row, 0)
+            self.fetchMore(division_index, len(self.rows[DIVISIONS[row]]))
+
+    # --- Dados ---
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self._division(index)
+        if index.internalId() == 0:
+            if role == Qt.ItemDataRole.DisplayRole and index.column() == 0:
+                count = len(self.rows[name]) if name in self.available else self.counts.get(name)
+                if count is None:
+                    return f"--- SÉRIE {name} ---"
+                return f"--- SÉRIE {name} --- ({count})" if count else f"--- SÉRIE {name} --- {self.cw._('no_user_in_division')}"
+            if role == Qt.ItemDataRole.FontRole:
+                font = QFont(); font.setBold(True)
+                return font
+            if role == Qt.ItemDataRole.UserRole:
+                return DIVISIONS.index(name)
+            return None
+        texts, sort_values, flag_filename, highlight = self.rows[name][index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            return texts[column]
+        if role == Qt.ItemDataRole.UserRole:
+            return sort_values[column]
+        if role == Qt.ItemDataRole.DecorationRole and column == 1:
+            return self.cw.flag_assets.icon(flag_filename)
+        if role == Qt.ItemDataRole.BackgroundRole and highlight:
+            return QColor(ROW_COLORS[highlight][1 if self.night_mode else 0])
+        return None
+
+    # --- Atualização ---
+
+    def set_headers(self, headers):
+        self.headers = list(headers)
+        self.headerDataChanged.emit(Qt.Orientation.Horizontal, 0, len(self.headers) - 1)
+
+    def set_night_mode(self, night_mode):
+        if night_mode != self.night_mode:
+            self.night_mode = night_mode
+            self._all_data_changed()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = {name: [] for name in DIVISIONS}
+        self.loaded = {name: 0 for name in DIVISIONS}
+        self.available = set()
+        self.counts = {}
+        self.endResetModel()
+
+    def set_rows(self, rows, counts=None):
+        """Aplica um novo ranking mantendo as linhas já materializadas (só encolhe se a série encolheu).
+        `rows` traz só as séries baixadas; `counts` é o total de cada série, para o título das outras."""
+        self.available = set(rows)
+        self.counts = dict(counts or {})
+        for position, name in enumerate(DIVISIONS):
+            new_rows = rows.get(name, [])
+            division_index = self.index(position, 0)
+            if self.loaded[name] > len(new_rows):
+                self.beginRemoveRows(division_index, len(new_rows), self.loaded[name] - 1)
+                self.rows[name] = self.rows[name][:len(new_rows)]
+                self.loaded[name] = len(new_rows)
+                self.endRemoveRows()
+            self.rows[name] = new_rows
+        self._all_data_changed()
+
+    def _all_data_changed(self):
+        last_column = len(GOALS_COLUMNS) - 1
+        self.dataChanged.emit(self.index(0, 0), self.index(len(DIVISIONS) - 1, last_column))
+        for position, name in enumerate(DIVISIONS):
+            if self.loaded[name]:
+                division_index = self.index(position, 0)
+                self.dataChanged.emit(self.index(0, 0, division_index), self.index(self.loaded[name] - 1, last_column, division_index))
+
+class GoalsFilterProxyModel(QSortFilterProxyModel):
+    """Busca por início do nick e ordenação por coluna dentro de cada série; as linhas de série nunca são filtradas."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.prefix = ""
+        self.setSortRole(Qt.ItemDataRole.UserRole)
+
+    def set_prefix(self, prefix):
+        self.prefix = prefix.lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if not source_parent.isValid() or not self.prefix:
+            return True
+        nick = self.sourceModel().index(source_row, 1, source_parent).data(Qt.ItemDataRole.DisplayRole) or ""
+        return nick.lower().startswith(self.prefix)
+
+    def lessThan(self, left, right):
+        # Séries continuam sempre de A a D, qualquer que seja a coluna ou o sentido.
+        if not left.parent().isValid():
+            ascending = self.sortOrder() == Qt.SortOrder.AscendingOrder
+            return (left.row() < right.row()) == ascending
+        return super().lessThan(left, right)
+
 class GoalsManager:
     def __init__(self, chat_window):
         self.chat_window = chat_window
         self.firebase = chat_window.firebase
         self.addon_path = chat_window.addon_path
+        self.render_generation = 0
+        self.rendered_fingerprint = None
 
-    def _format_seconds(self, seconds):
-        minutes, sec = divmod(seconds, 60)
-        return f"{int(minutes)}m {int(sec)}s"
-
-    def render_goals_list(self, data, search_term=""):
-        users_data = data.get('users', {})
+    def render_goals_list(self, data):
+        """Atualiza a aba de metas. O ranking é calculado numa thread e aplicado ao modelo (apply_goals_rows);
+        se os dados não mudaram desde o último, nada é refeito. A busca não passa por aqui (filter_goals)."""
         goals_data = data.get('goals', {})
         cw = self.chat_window
 
@@ -32,8 +274,6 @@ class GoalsManager:
             my_flag = my_goal_data.get("flag", "")
             cw.update_my_flag_display(my_flag)
 
-        cw.goals_area.clear()
-
         now = datetime.now()
         # --- MUDANÇA: Retorna a contagem regressiva para o fim da semana ---
         end_of_week = (now - timedelta(days=now.weekday()) + timedelta(days=6)).replace(hour=23, minute=59, second=59, microsecond=0)
@@ -43,79 +283,95 @@ class GoalsManager:
         minutes, _ = divmod(rem, 60)
         countdown_str = f"{days}d, {hours}h e {minutes}m"
         # --- FIM DA MUDANÇA ---
-        
-        league_status = self.firebase.get_data("league_status", cw.id_token) or {}
+
+        # O cabeçalho vem do league_status lido no polling, nunca de uma requisição aqui.
+        league_status = data.get('league_status') or {}
         season_number = league_status.get("season_counter", 1)
-        season_header = f"<b>{season_number}ª Temporada - {cw._('season_ends_in')} {countdown_str}</b><br>"
-        cw.goals_area.append(season_header)
-
-        is_night_mode = mw.pm.night_mode
-
-        divisions = {"A": [], "B": [], "C": [], "D": []}
-        for uid, goal_data in goals_data.items():
-            nick = users_data.get(uid, {}).get("nickname")
-            if not nick: continue
-            if search_term and not nick.lower().startswith(search_term.lower()):
-                continue
-            divisions.setdefault(goal_data.get("division", "D"), []).append((nick, goal_data))
-        
-        for div_name in sorted(divisions.keys()):
-            div_users = divisions[div_name]
-            header = f"--- SÉRIE {div_name} ---"
-            cw.goals_area.append(f"<b>{header}</b>")
-            if not div_users:
-                cw.goals_area.append(f"<i>{cw._('no_user_in_division')}</i><br>")
-                continue
-
-            def sort_key(item):
-                user, data = item
-                return (data.get("retention_points", 0), data.get("meta_points", 0), data.get("study_time_week", 0), data.get("new_cards_week", 0), random.random())
-            
-            div_users.sort(key=sort_key, reverse=True)
-            
-            num_users_in_div = len(div_users)
-            num_to_promote = 2 if div_name != "A" else 0
-            
-            if num_users_in_div <= 2: num_to_relegate = 0
-            elif num_users_in_div == 3: num_to_relegate = 1
-            else: num_to_relegate = 2
-            if div_name == "D": num_to_relegate = 0
-
-            for i, (user, data) in enumerate(div_users):
-                flag_html = ""
-                flag_filename = data.get("flag")
-                if flag_filename:
-                    flag_path = os.path.join(self.addon_path, 'bandeiras', flag_filename)
-                    if os.path.exists(flag_path):
-                        flag_html = f'<img src="{flag_path}" width="16" height="11"> '
-
-                pos = i + 1; points = data.get("retention_points", 0); materia = data.get("materia", "N/A")
-                reviews_today = data.get("reviews_today", 0); goal_daily = data.get("goal_daily", 100)
-                reviews_week = data.get("reviews_week", 0)
-                time_today_str = self._format_seconds(data.get("study_time_today", 0))
-                time_week_str = self._format_seconds(data.get("study_time_week", 0))
-                
-                total_reviews = data.get("reviews_week", 0); total_retention_pts = data.get("retention_points", 0)
-                max_possible_pts = total_reviews * 5
-                aproveitamento = (total_retention_pts / max_possible_pts * 100) if max_possible_pts > 0 else 0
-                
-                line = (f"{pos}. {flag_html}{user} ({materia}) - {points} PR ({aproveitamento:.0f}%) | "
-                        f"{cw._('today')}: {reviews_today}/{goal_daily} ({time_today_str}) | "
-                        f"{cw._('week')}: {reviews_week} ({time_week_str})")
-                
-                bg_color = None
-                if cw.is_connected and user == cw.nickname:
-                    bg_color = "#4a4a2a" if is_night_mode else "#ffffbb"
-                elif pos <= num_to_promote:
-                    bg_color = "#2E4E2E" if is_night_mode else "#aaffaa"
-                elif pos > num_users_in_div - num_to_relegate:
-                    bg_color = "#5A2A2A" if is_night_mode else "#ffaaaa"
-                
-                if bg_color:
-                    cw.goals_area.append(f'<p style="background-color:{bg_color}; margin:0; padding: 2px;">{line}</p>')
-                else:
-                    cw.goals_area.append(line)
-            cw.goals_area.append("")
+        cw.goals_header_label.setText(f"<b>{season_number}ª Temporada - {cw._('season_ends_in')} {countdown_str}</b>")
+        cw.goals_model.set_night_mode(bool(mw.pm.night_mode))
+        cw.goals_model.set_headers([cw._(key) for key in GOALS_COLUMNS])
+
+        me = cw.nickname if cw.is_connected else None
+        self.render_generation += 1
+        generation = self.render_generation
+        threading.Thread(target=self._build_goals_rows, args=(generation, data, me), daemon=True).start()
+
+    def _build_goals_rows(self, generation, data, me):
+        try:
+            leaderboard = data.get('leaderboard')
+            divisions = sorted(data['divisions']) if data.get('divisions') is not None else None
+            if leaderboard:
+                # A versão da classificação publicada já identifica o conteúdo, junto com as séries baixadas.
+                fingerprint = f"leaderboard:{leaderboard.get('version')}:{divisions}:{me}"
+                counts = leaderboard.get('counts')
+            else:
+                fingerprint = hashlib.sha1(json.dumps([me, divisions, data.get('users'), data.get('goals')], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+                counts = None
+            if fingerprint == self.rendered_fingerprint:
+                return
+            self.chat_window.goals_rows_ready.emit(generation, fingerprint, (goals_rows(data, me), counts))
+        except Exception as e:
+            print(f"AnkiChat [ERRO] ao montar a lista de metas: {e}")
+
+    def apply_goals_rows(self, generation, fingerprint, payload):
+        """Slot do goals_rows_ready (thread da GUI). `payload` é (linhas por série, total por série)."""
+        if generation != self.render_generation:
+            return  # Já há um pedido mais novo a caminho.
+        cw = self.chat_window
+        rows, counts = payload
+        first_render = self.rendered_fingerprint is None
+        cw.goals_model.set_rows(rows, counts)
+        for row in range(cw.goals_proxy.rowCount()):
+            division_index = cw.goals_proxy.index(row, 0)
+            name = DIVISIONS[cw.goals_proxy.mapToSource(division_index).row()]
+            if first_render and name in rows:
+                # Abre só as séries que já vieram (a do usuário primeiro); as outras esperam o clique.
+                cw.goals_view.expand(division_index)
+            elif cw.goals_view.isExpanded(division_index) and cw.goals_proxy.canFetchMore(division_index):
+                # Série aberta antes de os dados chegarem: mostra o primeiro bloco agora.
+                cw.goals_proxy.fetchMore(division_index)
+        if cw.goals_proxy.prefix:
+            # Durante a busca todas as linhas ficam no modelo, para o filtro alcançar as séries inteiras.
+            cw.goals_model.fetch_all()
+        self.rendered_fingerprint = fingerprint
+
+    def on_division_expanded(self, proxy_index):
+        """Abrir uma série que ainda não foi baixada pede ela ao polling (goals_by_division/<série>)."""
+        cw = self.chat_window
+        if proxy_index.parent().isValid():
+            return
+        name = DIVISIONS[cw.goals_proxy.mapToSource(proxy_index).row()]
+        if name not in cw.goals_model.available:
+            cw.open_goals_division(name)
+
+    def filter_goals(self, search_term):
+        """Busca por nick: só filtra o que já está no modelo, sem recalcular o ranking.
+        As séries ainda não baixadas são pedidas agora e entram no filtro quando chegarem."""
+        cw = self.chat_window
+        if search_term:
+            for name in DIVISIONS:
+                cw.open_goals_division(name)
+            cw.goals_model.fetch_all()
+            cw.goals_proxy.set_prefix(search_term)
+            cw.goals_view.expandAll()
+        else:
+            cw.goals_proxy.set_prefix("")
+
+    def on_goals_scrolled(self, value):
+        """Perto do fim da rolagem, materializa o próximo bloco das séries abertas que ainda têm linhas de fora."""
+        cw = self.chat_window
+        scroll_bar = cw.goals_view.verticalScrollBar()
+        if value < scroll_bar.maximum() - scroll_bar.pageStep():
+            return
+        for row in range(cw.goals_proxy.rowCount()):
+            division_index = cw.goals_proxy.index(row, 0)
+            if cw.goals_view.isExpanded(division_index) and cw.goals_proxy.canFetchMore(division_index):
+                cw.goals_proxy.fetchMore(division_index)
+                break
+
+    def reset_render_cache(self):
+        self.rendered_fingerprint = None
+        self.chat_window.goals_model.clear()
 
     def edit_my_goal(self):
         cw = self.chat_window
@@ -125,7 +381,7 @@ class GoalsManager:
         dialog = QDialog(cw)
         dialog.setWindowTitle("Definir Metas e Matéria")
         layout = QFormLayout(dialog)
-        current_goals = self.firebase.get_data(f"goals/{cw.uid}", cw.id_token) or {}
+        current_goals = get_goal(self.firebase, cw.uid, cw.id_token) or {}
         materia_entry = QLineEdit()
         materia_entry.setText(current_goals.get("materia", ""))
         daily_goal_entry = QLineEdit()
@@ -152,117 +408,15 @@ class GoalsManager:
                 "goal_daily": goal_daily,
                 "goal_weekly": goal_weekly
             }
-            self.firebase.patch_data(f"goals/{cw.uid}", updates, cw.id_token)
+            # Relê o registro: revisões feitas com o diálogo aberto não podem ser perdidas.
+            put_goal(self.firebase, cw.uid, dict(get_goal(self.firebase, cw.uid, cw.id_token) or current_goals, **updates), cw.id_token)
             tooltip("Metas atualizadas!")
 
     def check_and_process_season_end(self):
+        """Roda no login do admin: vira a temporada se a semana mudou (ver temporada.SeasonEnd)."""
         cw = self.chat_window
-        
         try:
-            league_status = self.firebase.get_data("league_status", cw.id_token) or {}
-            
-            # --- MUDANÇA: Retorna a lógica de verificação para a semana do calendário ---
-            last_processed_str = str(league_status.get("last_processed_week", "0_0"))
-
-            now = datetime.now()
-            current_week = now.isocalendar()[1]
-            current_year = now.year
-            current_week_str = f"{current_week}_{current_year}"
-
-            if last_processed_str == current_week_str:
-                return
-            # --- FIM DA MUDANÇA ---
-
-            print(f"AnkiChat: Detectado fim de temporada. Processando Semana {last_processed_str} -> {current_week_str}...")
-            
-            all_goals = self.firebase.get_data("goals", cw.id_token) or {}
-            all_users = self.firebase.get_data("users", cw.id_token) or {}
-            if not all_goals or not all_users:
-                return
-
-            season_number = league_status.get("season_counter", 1)
-            season_key = f"{season_number}_{current_year}"
-
-            def sort_key(item):
-                _uid, data = item
-                return (data.get("retention_points", 0), data.get("meta_points", 0), data.get("study_time_week", 0), data.get("new_cards_week", 0), random.random())
-
-            divisions_data = {"A": [], "B": [], "C": [], "D": []}
-            for user_uid, data in all_goals.items():
-                divisions_data.setdefault(data.get("division", "D"), []).append((user_uid, data))
-
-            for div_users in divisions_data.values():
-                div_users.sort(key=sort_key, reverse=True)
-
-            for div_name, div_users in divisions_data.items():
-                for i, (user_uid, data) in enumerate(div_users):
-                    position = i + 1
-                    nick = all_users.get(user_uid, {}).get("nickname")
-                    if not nick or re.search(r'[.#$\[\]]', nick): continue
-
-                    legacy_entry = {
-                        "season_key": season_key, "division": div_name, "position": position,
-                        "retention_points": data.get("retention_points", 0),
-                        "meta_points": data.get("meta_points", 0), "medal": None
-                    }
-                    if position == 1: legacy_entry["medal"] = "gold"
-                    elif position == 2: legacy_entry["medal"] = "silver"
-                    elif position == 3: legacy_entry["medal"] = "bronze"
-                    
-                    self.firebase.put_data(f"legacy/{user_uid}/{season_key}", legacy_entry, cw.id_token)
-                    if legacy_entry["medal"]:
-                        self.firebase.put_data(f"achievements/{nick}/{season_key}", legacy_entry, cw.id_token)
-
-            new_assignments = {}
-            PROMOTION_COUNT = 2
-            for uid, _ in divisions_data.get("D", [])[:PROMOTION_COUNT]: new_assignments[uid] = "C"
-            for uid, _ in divisions_data.get("C", [])[:PROMOTION_COUNT]: new_assignments[uid] = "B"
-            for uid, _ in divisions_data.get("B", [])[:PROMOTION_COUNT]: new_assignments[uid] = "A"
-
-            def get_relegation_count(division_size):
-                if division_size <= 2: return 0
-                if division_size == 3: return 1
-                return 2
-
-            rele_count_A = get_relegation_count(len(divisions_data.get("A", [])))
-            if rele_count_A > 0:
-                for uid, _ in divisions_data["A"][-rele_count_A:]: new_assignments[uid] = "B"
-            rele_count_B = get_relegation_count(len(divisions_data.get("B", [])))
-            if rele_count_B > 0:
-                for uid, _ in divisions_data["B"][-rele_count_B:]: new_assignments[uid] = "C"
-            rele_count_C = get_relegation_count(len(divisions_data.get("C", [])))
-            if rele_count_C > 0:
-                for uid, _ in divisions_data["C"][-rele_count_C:]: new_assignments[uid] = "D"
-            
-            final_goals_payload = {}
-            for user_uid, data in all_goals.items():
-                new_data = data.copy()
-                new_data.update({
-                    "retention_points": 0, "meta_points": 0, "reviews_week": 0,
-                    "reviews_today": 0, "study_time_week": 0, "study_time_today": 0,
-                    "new_cards_week": 0, "last_update_day": 0
-                })
-                if user_uid in new_assignments:
-                    new_data["division"] = new_assignments[user_uid]
-                else:
-                    new_data["division"] = data.get("division", "D")
-                if data.get("reviews_week", 0) == 0:
-                    new_data["division"] = "D"
-                final_goals_payload[user_uid] = new_data
-
-            self.firebase.put_data("goals", final_goals_payload, cw.id_token)
-            
-            # --- MUDANÇA: Atualiza o status da liga com a semana processada ---
-            # Remove o timestamp antigo para manter o banco de dados limpo.
-            self.firebase.put_data("league_status", {
-                "season_counter": season_number + 1,
-                "last_processed_week": current_week_str,
-                "season_start_timestamp": None 
-            }, cw.id_token)
-            # --- FIM DA MUDANÇA ---
-            
-            cw.force_refresh_signal.emit()
-            print(f"AnkiChat: Processamento da Temporada {season_number} concluído.")
-
+            if SeasonEnd(self.firebase, cw.uid, cw.id_token).run():
+                cw.force_refresh_signal.emit()
         except Exception as e:
             print(f"AnkiChat [ERRO CRÍTICO] em check_and_process_season_end: {e}")
\ No newline at end of file
@@ -4,13 +4,81 @@
 import threading
 
 from aqt.qt import (
-    QDialog, QWidget, QHBoxLayout, QVBoxLayout, QListWidget,
-    QPushButton, QLabel, pyqtSignal
+    QDialog, QWidget, QHBoxLayout, QVBoxLayout, QListWidget, QListView, QLineEdit, QTimer,
+    QPushButton, QLabel, pyqtSignal, QAbstractItemView, QProgressBar, QTextBrowser,
+    QAbstractListModel, QModelIndex, Qt
 )
 from aqt.utils import tooltip
 
+# Ações de moderação em lote: cada execução vira um único PATCH multi-caminho, qualquer que seja o número de usuários.
+BULK_ACTIONS = {
+    "kick": "Kickar",
+    "ban": "Banir",
+    "unban": "Desbanir",
+    "delete_last": "Apagar Última Msg",
+    "purge": "Apagar Todas Msgs",
+}
+
+# Usuários por página no painel de moderação (consulta orderBy "nickname", que usa o índice do servidor).
+USER_PAGE_SIZE = 50
+# Espera depois da última tecla antes de buscar nicks pelo prefixo (ms).
+USER_SEARCH_DEBOUNCE_MS = 300
+
+def run_bulk_moderation(chat_window, action, nicks, report_progress=None):
+    """Aplica `action` a vários usuários: resolve os uids de uma vez, junta todas as escritas
+    e envia tudo num único PATCH. Roda em segundo plano. Retorna {nick: resultado}."""
+    cw = chat_window
+    results, updates, deleted_ids = {}, {}, []
+    protected = {cw.nickname, cw.admin_nick}
+    targets = [nick for nick in nicks if nick not in protected]
+    for nick in nicks:
+        if nick in protected:
+            results[nick] = "ignorado (não é possível moderar a si mesmo nem o administrador)"
+    total_steps = len(targets) + 1
+    uids = cw.chat_manager.resolve_uids(targets) if action in ("kick", "ban") else {}
+    applied = []
+    for done, nick in enumerate(targets, 1):
+        if report_progress: report_progress(done - 1, total_steps, f"Preparando: {nick}")
+        if action in ("kick", "ban"):
+            uid = uids.get(nick)
+            if not uid and action == "kick":
+                results[nick] = "usuário não encontrado"
+                continue
+            if uid: updates[f"online/{uid}"] = None
+            if action == "ban": updates[f"banned_users/{nick}"] = True
+            results[nick] = "banido" if action == "ban" else "kickado"
+        elif action == "unban":
+            updates[f"banned_users/{nick}"] = None
+            results[nick] = "desbanido"
+        else:
+            user_updates, user_ids = cw.chat_manager.author_deletion_updates(nick, action == "purge")
+            if not user_ids:
+                results[nick] = "nenhuma mensagem encontrada"
+                continue
+            updates.update(user_updates)
+            deleted_ids.extend(user_ids)
+            results[nick] = f"{len(user_ids)} mensagem(ns) apagada(s)"
+        applied.append(nick)
+    if updates:
+        if report_progress: report_progress(len(targets), total_steps, f"Aplicando {len(updates)} escritas...")
+        if not cw.firebase.patch_data("", updates, cw.id_token):
+            for nick in applied:
+                results[nick] = "falhou (o servidor recusou a escrita)"
+            deleted_ids = []
+    if deleted_ids:
+        if cw.message_cache: cw.message_cache.delete_messages(deleted_ids)
+        cw.messages_deleted.emit(deleted_ids)
+    if report_progress: report_progress(total_steps, total_steps, "Concluído.")
+    return results
+
+def format_bulk_results(action, results):
+    lines = [f"<b>{BULK_ACTIONS[action]}</b>: {len(results)} usuário(s)"]
+    lines.extend(f"{nick}: {result}" for nick, result in sorted(results.items()))
+    return "<br>".join(lines)
+
 class BannedUsersDialog(QDialog):
     banned_users_loaded = pyqtSignal(list)
+    unban_finished = pyqtSignal(dict)
     def __init__(self, firebase_api, parent=None):
         super().__init__(parent)
         self.firebase = firebase_api
@@ -19,14 +87,16 @@ class BannedUsersDialog(QDialog):
         self.setMinimumSize(300, 400)
         self.setup_ui()
         self.banned_users_loaded.connect(self.populate_list)
+        self.unban_finished.connect(self.on_unban_finished)
         self.load_banned_users()
 
     def setup_ui(self):
         layout = QVBoxLayout(self)
         self.list_widget = QListWidget()
+        self.list_widget.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.list_widget.itemSelectionChanged.connect(self.on_selection_changed)
         layout.addWidget(self.list_widget)
-        self.unban_button = QPushButton("Desbanir Usuário")
+        self.unban_button = QPushButton("Desbanir Selecionados")
         self.unban_button.setEnabled(False)
         self.unban_button.clicked.connect(self.unban_user)
         layout.addWidget(self.unban_button)
@@ -53,35 +123,130 @@ class BannedUsersDialog(QDialog):
         self.unban_button.setEnabled(bool(self.list_widget.selectedItems()))
 
     def unban_user(self):
-        selected_item = self.list_widget.currentItem()
-        if not selected_item:
+        nicks = [item.text() for item in self.list_widget.selectedItems()]
+        if not nicks:
+            return
+        self.unban_button.setEnabled(False)
+        threading.Thread(target=self._async_unban, args=(nicks,), daemon=True).start()
+
+    def _async_unban(self, nicks):
+        self.unban_finished.emit(run_bulk_moderation(self.parent_window, "unban", nicks))
+
+    def on_unban_finished(self, results):
+        for row in range(self.list_widget.count() - 1, -1, -1):
+            if results.get(self.list_widget.item(row).text()) == "desbanido":
+                self.list_widget.takeItem(row)
+        unbanned = sum(1 for result in results.values() if result == "desbanido")
+        tooltip(f"{unbanned} de {len(results)} usuário(s) desbanido(s).")
+
+class UserPageModel(QAbstractListModel):
+    """Lista de nicks carregada do servidor uma página por vez, conforme a rolagem da view pede mais
+    (canFetchMore/fetchMore). Com um prefixo, a consulta fica restrita a startAt=prefixo, endAt=prefixo+\\uf8ff."""
+    page_loaded = pyqtSignal(int, list, bool, bool)
+    def __init__(self, firebase_api, chat_window, parent=None):
+        super().__init__(parent)
+        self.firebase = firebase_api
+        self.cw = chat_window
+        self.nicks = []
+        self.prefix = ""
+        self.loading = False
+        self.exhausted = False
+        # Incrementada a cada nova busca, para descartar páginas de buscas antigas que cheguem atrasadas.
+        self.generation = 0
+        self.page_loaded.connect(self._on_page_loaded)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.nicks)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            return self.nicks[index.row()]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.loading and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        last_nick = self.nicks[-1] if self.nicks else None
+        threading.Thread(target=self._fetch_page, args=(self.generation, self.prefix, last_nick), daemon=True).start()
+
+    def set_prefix(self, prefix):
+        """Recomeça a lista a partir da primeira página dos nicks que começam com `prefix`."""
+        self.generation += 1
+        self.beginResetModel()
+        self.nicks = []
+        self.prefix = prefix
+        self.loading = False
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def _fetch_page(self, generation, prefix, last_nick):
+        # startAt é inclusivo: a partir da segunda página pede um a mais e descarta o último nick já listado.
+        limit = USER_PAGE_SIZE if last_nick is None else USER_PAGE_SIZE + 1
+        params = self.firebase.build_query(
+            "nickname",
+            startAt=last_nick if last_nick is not None else (prefix or None),
+            endAt=prefix + "\uf8ff" if prefix else None,
+            limitToFirst=limit)
+        users = self.firebase.get_data("users", self.cw.id_token, params)
+        if users is None:
+            self.page_loaded.emit(generation, [], True, True)
             return
-        nick_to_unban = selected_item.text()
-        threading.Thread(target=self._async_unban, args=(nick_to_unban,), daemon=True).start()
-        self.list_widget.takeItem(self.list_widget.row(selected_item))
-        tooltip(f"Usuário '{nick_to_unban}' foi desbanido.")
+        nicks = sorted(ud["nickname"] for ud in users.values() if isinstance(ud, dict) and ud.get("nickname"))
+        if last_nick is not None and nicks and nicks[0] == last_nick:
+            nicks = nicks[1:]
+        self.page_loaded.emit(generation, nicks, len(users) < limit, False)
 
-    def _async_unban(self, nickname):
-        # Esta linha também funciona agora
-        self.firebase.delete_data(f"banned_users/{nickname}", self.parent_window.id_token)
+    def _on_page_loaded(self, generation, nicks, exhausted, failed):
+        if generation != self.generation:
+            return
+        self.loading = False
+        # Em caso de erro não tenta de novo sozinho (a view chamaria fetchMore em laço); uma nova busca reabre.
+        self.exhausted = exhausted
+        if nicks:
+            self.beginInsertRows(QModelIndex(), len(self.nicks), len(self.nicks) + len(nicks) - 1)
+            self.nicks.extend(nicks)
+            self.endInsertRows()
+        if failed:
+            print("AnkiChat [ERRO] Falha ao carregar a página de usuários do painel de moderação.")
 
 class ModerationDialog(QDialog):
-    users_loaded = pyqtSignal(list)
+    progress_changed = pyqtSignal(int, int, str)
+    bulk_finished = pyqtSignal(str, dict)
     def __init__(self, firebase_api, parent_window):
         super().__init__(parent_window)
         self.firebase = firebase_api
         self.parent_window = parent_window # Este é o ChatWindow
         self.setWindowTitle("Painel de Moderação")
         self.setMinimumSize(500, 500)
+        self.user_model = UserPageModel(firebase_api, parent_window, self)
+        self.user_model.page_loaded.connect(self._on_user_page_loaded)
         self.setup_ui()
-        self.users_loaded.connect(self._update_user_list_gui)
+        self.progress_changed.connect(self._on_progress_changed)
+        self.bulk_finished.connect(self._on_bulk_finished)
         self.load_users()
 
     def setup_ui(self):
         main_layout = QVBoxLayout(self)
-        main_layout.addWidget(QLabel("Selecione um usuário para moderar:"))
-        self.user_list = QListWidget()
-        self.user_list.itemSelectionChanged.connect(self.on_user_selected)
+        main_layout.addWidget(QLabel("Selecione um ou mais usuários para moderar (Ctrl/Shift para vários):"))
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Buscar nick (começa com)...")
+        main_layout.addWidget(self.search_input)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(USER_SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.load_users)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        # QListView com modelo próprio: só as linhas visíveis são desenhadas e novas páginas chegam ao rolar.
+        self.user_list = QListView()
+        self.user_list.setUniformItemSizes(True)
+        self.user_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.user_list.setModel(self.user_model)
+        self.user_list.selectionModel().selectionChanged.connect(self.on_user_selected)
         main_layout.addWidget(self.user_list)
         
         buttons_layout = QHBoxLayout()
@@ -95,13 +260,20 @@ class ModerationDialog(QDialog):
         buttons_layout.addWidget(self.delete_all_button)
         main_layout.addLayout(buttons_layout)
         
-        self.kick_button.clicked.connect(self.do_kick)
-        self.ban_button.clicked.connect(self.do_ban)
-        self.delete_last_button.clicked.connect(self.do_delete_last)
-        self.delete_all_button.clicked.connect(self.do_delete_all)
+        self.kick_button.clicked.connect(lambda: self.run_bulk_action("kick"))
+        self.ban_button.clicked.connect(lambda: self.run_bulk_action("ban"))
+        self.delete_last_button.clicked.connect(lambda: self.run_bulk_action("delete_last"))
+        self.delete_all_button.clicked.connect(lambda: self.run_bulk_action("purge"))
         
         self.status_label = QLabel("Selecione um usuário da lista.")
         main_layout.addWidget(self.status_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.hide()
+        main_layout.addWidget(self.progress_bar)
+        self.results_area = QTextBrowser()
+        self.results_area.setMaximumHeight(120)
+        self.results_area.hide()
+        main_layout.addWidget(self.results_area)
         
         bottom_layout = QHBoxLayout()
         self.view_banned_button = QPushButton("Ver Banidos")
@@ -127,61 +299,60 @@ class ModerationDialog(QDialog):
         self.delete_all_button.setEnabled(enabled)
 
     def on_user_selected(self):
-        selected_items = self.user_list.selectedItems()
-        if selected_items:
-            nick = selected_items[0].text()
-            is_self = (nick == self.parent_window.nickname)
-            self.toggle_buttons(not is_self)
-            if is_self:
-                self.status_label.setText("Você não pode moderar a si mesmo.")
-            else:
-                self.status_label.setText(f"Usuário selecionado: {nick}")
-        else:
+        nicks = self.get_selected_nicks()
+        if not nicks:
             self.toggle_buttons(False)
             self.status_label.setText("Selecione um usuário da lista.")
+            return
+        if nicks == [self.parent_window.nickname]:
+            self.toggle_buttons(False)
+            self.status_label.setText("Você não pode moderar a si mesmo.")
+            return
+        self.toggle_buttons(True)
+        if len(nicks) == 1:
+            self.status_label.setText(f"Usuário selecionado: {nicks[0]}")
+        else:
+            self.status_label.setText(f"{len(nicks)} usuários selecionados.")
 
-    def get_selected_nick(self):
-        selected_items = self.user_list.selectedItems()
-        return selected_items[0].text() if selected_items else None
-
-    def do_kick(self):
-        nick = self.get_selected_nick()
-        if nick:
-            self.parent_window.kick_user(nick)
-            self.status_label.setText(f"Comando 'Kickar' enviado para {nick}.")
-
-    def do_ban(self):
-        nick = self.get_selected_nick()
-        if nick:
-            self.parent_window.ban_user(nick)
-            self.status_label.setText(f"Comando 'Banir' enviado para {nick}.")
-
-    def do_delete_last(self):
-        nick = self.get_selected_nick()
-        if nick:
-            self.parent_window.delete_last_message(nick)
-            self.status_label.setText(f"Comando 'Apagar Última Msg' enviado para {nick}.")
-
-    def do_delete_all(self):
-        nick = self.get_selected_nick()
-        if nick:
-            self.parent_window.delete_all_messages(nick)
-            self.status_label.setText(f"Comando 'Apagar Todas Msgs' enviado para {nick}.")
+    def get_selected_nicks(self):
+        return [index.data() for index in self.user_list.selectionModel().selectedRows()]
 
-    def load_users(self):
-        self.user_list.clear()
-        self.user_list.addItem("Carregando usuários...")
-        threading.Thread(target=self._fetch_and_populate_users, daemon=True).start()
+    def run_bulk_action(self, action):
+        nicks = self.get_selected_nicks()
+        if not nicks:
+            return
+        self.toggle_buttons(False)
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.status_label.setText(f"'{BULK_ACTIONS[action]}' em {len(nicks)} usuário(s)...")
+        threading.Thread(target=self._async_bulk_action, args=(action, nicks), daemon=True).start()
 
-    def _fetch_and_populate_users(self):
-        all_users_data = self.firebase.get_data("users", self.parent_window.id_token) or {}
-        nicks = sorted([ud.get("nickname", "Desconhecido") for ud in all_users_data.values()])
-        self.users_loaded.emit(nicks)
+    def _async_bulk_action(self, action, nicks):
+        results = run_bulk_moderation(self.parent_window, action, nicks, self.progress_changed.emit)
+        self.bulk_finished.emit(action, results)
 
-    def _update_user_list_gui(self, nicks):
-        self.user_list.clear()
-        if nicks:
-            self.user_list.addItems(nicks)
-        else:
-            self.user_list.addItem("Nenhum usuário registrado encontrado.")
-        self.status_label.setText("Selecione um usuário da lista.")
\ No newline at end of file
+    def _on_progress_changed(self, done, total, text):
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        self.status_label.setText(text)
+
+    def _on_bulk_finished(self, action, results):
+        self.progress_bar.hide()
+        self.results_area.setHtml(format_bulk_results(action, results))
+        self.results_area.show()
+        self.status_label.setText(f"Comando '{BULK_ACTIONS[action]}' concluído.")
+        self.on_user_selected()
+
+    def load_users(self):
+        self.status_label.setText("Carregando usuários...")
+        self.user_model.set_prefix(self.search_input.text().strip())
+
+    def _on_user_page_loaded(self, generation, nicks, exhausted, failed):
+        if generation != self.user_model.generation:
+            return
+        if failed:
+            self.status_label.setText("Erro ao carregar os usuários.")
+        elif not self.user_model.rowCount():
+            self.status_label.setText("Nenhum usuário encontrado.")
+        elif not self.get_selected_nicks():
+            self.status_label.setText("Selecione um usuário da lista.")
\ No newline at end of file
@@ -37,10 +37,17 @@ class LanguageManager:
             "season_ends_in": {"pt": "A temporada termina em:", "en": "Season ends in:"},
             "no_user_in_division": {"pt": "Nenhum usuário nesta divisão.", "en": "No users in this division."},
             "today": {"pt": "Hoje", "en": "Today"},
+            "goals_position": {"pt": "#", "en": "#"},
+            "goals_user": {"pt": "Usuário", "en": "User"},
+            "goals_subject": {"pt": "Matéria", "en": "Subject"},
+            "goals_score": {"pt": "Pontos", "en": "Points"},
+            "goals_efficiency": {"pt": "Aproveitamento", "en": "Efficiency"},
             "week": {"pt": "Semana", "en": "Week"},
             "search_user": {"pt": "Pesquisar usuário:", "en": "Search user:"},
             "start_quiz": {"pt": "Iniciar Quiz", "en": "Start Quiz"},
             "stop_quiz": {"pt": "Parar Quiz", "en": "Stop Quiz"},
+            "channels": {"pt": "Canais", "en": "Channels"},
+            "filter_users": {"pt": "Filtrar usuários...", "en": "Filter users..."},
         }
 
     def _(self, key):
@@ -74,7 +81,9 @@ class LanguageManager:
         cw.logout_button.setText(self._("logout"))
         cw.moderation_button.setText(self._("moderate_users"))
         cw.quiz_button.setText(self._("start_quiz") if not cw.quiz_manager.is_active else self._("stop_quiz"))
-        cw.users_label.setText(self._("online_users"))
+        cw.channels_button.setText(self._("channels"))
+        cw.users_label.setText(f"{self._('online_users')} ({cw.user_list_model.online_count()})")
+        cw.user_search_input.setPlaceholderText(self._("filter_users"))
         cw.tabs.setTabText(0, self._("goals_ranking"))
         cw.tabs.setTabText(1, self._("chat_main"))
         cw.tabs.setTabText(2, self._("live_quiz"))
@@ -86,6 +95,6 @@ class LanguageManager:
         cw.delete_msg_button.setText(self._("delete_selected"))
         cw.translate_button.setText(self._("translate_selected")) # <<< NOVA LINHA
         cw.search_label.setText(self._("search_user"))
-        cw.populate_flag_combobox() # Precisa ser chamado para atualizar o texto do placeholder
+        cw.populate_flag_combobox() # Atualiza o texto do placeholder
         if cw.is_connected and cw.cached_goals_data:
             cw.update_goals_list(cw.cached_goals_data)
\ No newline at end of file
@@ -0,0 +1,57 @@
+# -- coding: utf-8 --
+# presenca.py - Módulo para a presença (quem está online) do AnkiChat
+
+import time
+
+PRESENCE_ROOT = "online"
+# Intervalo padrão entre batimentos (s); configurável pela chave "presence_heartbeat_seconds" do config.
+HEARTBEAT_INTERVAL_SECONDS = 30
+# Um usuário passa a ser considerado offline depois de perder este número de batimentos seguidos.
+MISSED_HEARTBEATS_ALLOWED = 2
+
+class PresenceManager:
+    """Presença por batimentos: cada cliente grava online/{uid}/lastSeen com o timestamp do servidor
+    a cada `interval` segundos, e quem lê considera online só quem bateu recentemente.
+    Um cliente que fecha sem passar por clean_up_on_exit some sozinho depois de alguns batimentos perdidos.
+    A leitura é uma consulta orderBy "lastSeen" com startAt (as regras do banco precisam de
+    ".indexOn": ["lastSeen"] em "online"), então só os usuários ativos são baixados."""
+    def __init__(self, firebase_api, chat_window):
+        self.firebase = firebase_api
+        self.cw = chat_window
+        self.interval = max(5, int(chat_window.config.get("presence_heartbeat_seconds", HEARTBEAT_INTERVAL_SECONDS)))
+        self.last_heartbeat = None
+
+    @property
+    def stale_after_ms(self):
+        return (MISSED_HEARTBEATS_ALLOWED + 1) * self.interval * 1000
+
+    def reset(self):
+        self.last_heartbeat = None
+
+    def heartbeat_if_due(self):
+        """Grava o batimento se já passou `interval` desde o último. Roda na thread de polling."""
+        now = time.monotonic()
+        if self.last_heartbeat is not None and now - self.last_heartbeat < self.interval:
+            return False
+        # "state" continua sendo gravado para os clientes antigos, que ainda filtram por ele.
+        self.firebase.put_data(f"{PRESENCE_ROOT}/{self.cw.uid}", {
+            "nickname": self.cw.nickname, "state": "online", "lastSeen": {".sv": "timestamp"}
+        }, self.cw.id_token)
+        self.last_heartbeat = now
+        return True
+
+    def fetch_online(self):
+        """Usuários que bateram dentro da janela de validade: {uid: {"nickname", "lastSeen", ...}}."""
+        since = self.cw.latency_tracker.server_now() - self.stale_after_ms
+        params = self.firebase.build_query("lastSeen", startAt=since)
+        presence_data = self.firebase.get_data(PRESENCE_ROOT, self.cw.id_token, params)
+        if presence_data is None:
+            # Sem ".indexOn" nas regras a consulta é recusada: lê o nó inteiro e filtra aqui.
+            presence_data = self.firebase.get_data(PRESENCE_ROOT, self.cw.id_token) or {}
+        return {uid: entry for uid, entry in presence_data.items()
+                if isinstance(entry, dict) and isinstance(entry.get("lastSeen"), (int, float)) and entry["lastSeen"] >= since}
+
+    def go_offline(self):
+        """Saída limpa: remove a entrada na hora, sem esperar ela ficar velha."""
+        self.firebase.delete_data(f"{PRESENCE_ROOT}/{self.cw.uid}", self.cw.id_token)
+        self.reset()
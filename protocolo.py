@@ -0,0 +1,129 @@
+# -- coding: utf-8 --
+# protocolo.py - Módulo para o formato compacto (v2) das mensagens do AnkiChat no banco
+
+import html
+
+# Versão do formato gravado no banco. Mensagens sem "v" são do formato antigo (chaves longas, quiz em HTML)
+# e continuam sendo lidas como estão.
+WIRE_VERSION = 2
+VERSION_KEY = "v"
+
+# Chave longa (usada em todo o cliente e no cache local) -> chave curta no banco.
+# "uid" e "timestamp" não mudam: as regras do banco validam o uid e as consultas ordenam pelo timestamp.
+SHORT_KEYS = {
+    "nick": "n",
+    "text": "t",
+    "color": "c",
+    "local_id": "l",
+    "day": "d",
+    "target": "to",
+    "target_uid": "tu",
+    "channel": "ch",
+    "quiz_chat": "qc",
+    "quiz": "q",
+    "sent_at": "sa",
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+QUIZ_BOT_NICK = "QuizBot"
+
+# Tipos dos eventos do quiz: cada cliente monta o texto no próprio idioma a partir dos campos do registro.
+QUIZ_START = "start"          # {"cat": categoria, "by": quem iniciou}
+QUIZ_QUESTION = "question"    # {"qid": id da pergunta, "q": enunciado, "a": alternativas já embaralhadas}
+QUIZ_RESULT = "result"        # {"who": nick, "ok": acertou?}
+QUIZ_TIMEOUT = "timeout"      # {"n": número da alternativa certa, "ans": texto dela}
+QUIZ_SEPARATOR = "separator"
+QUIZ_RESTART = "restart"
+QUIZ_ERROR = "error"          # {"code": QUIZ_ERROR_TEXTS, "cat": categoria, "detail": texto livre}
+
+QUIZ_EVENT_TEXTS = {
+    QUIZ_START: {"pt": "--- O Quiz de {cat} começou, iniciado por {by}! ---", "en": "--- The {cat} quiz has started, started by {by}! ---"},
+    QUIZ_RESTART: {"pt": "Fim de jogo! Todas as perguntas foram feitas. Reiniciando...", "en": "Game over! All questions have been asked. Restarting..."},
+    "correct": {"pt": "{who} acertou!", "en": "{who} got it right!"},
+    "wrong": {"pt": "{who} errou.", "en": "{who} got it wrong."},
+    QUIZ_TIMEOUT: {"pt": "⏰ Tempo esgotado! A resposta era", "en": "⏰ Time's up! The answer was"},
+    "unknown": {"pt": "(evento do quiz não suportado por esta versão)", "en": "(quiz event not supported by this version)"},
+}
+QUIZ_ERROR_TEXTS = {
+    "no_questions": {"pt": "ERRO: Nenhuma pergunta encontrada para a categoria '{cat}' no Firebase.", "en": "ERROR: No questions found for the '{cat}' category in Firebase."},
+    "bad_format": {"pt": "ERRO: Formato de perguntas inválido para a categoria '{cat}' no Firebase.", "en": "ERROR: Invalid question format for the '{cat}' category in Firebase."},
+    "load_failed": {"pt": "ERRO ao carregar o quiz do Firebase: {detail}", "en": "ERROR loading the quiz from Firebase: {detail}"},
+}
+
+def encode_message(msg):
+    """Mensagem do cliente (chaves longas) -> registro v2 para gravar no banco.
+    O marcador quiz_event some: no v2, um evento do quiz é simplesmente um registro com "q"."""
+    record = {VERSION_KEY: WIRE_VERSION}
+    for key, value in msg.items():
+        if key == "quiz_event" or value is None:
+            continue
+        record[SHORT_KEYS.get(key, key)] = 1 if value is True else value
+    return record
+
+def decode_message(record):
+    """Registro do banco (v2 ou antigo) -> mensagem com as chaves longas usadas pelo cliente."""
+    if not isinstance(record, dict) or VERSION_KEY not in record:
+        return record
+    msg = {}
+    for key, value in record.items():
+        if key != VERSION_KEY:
+            msg[LONG_KEYS.get(key, key)] = value
+    if "quiz" in msg:
+        msg["quiz_event"] = True
+    if msg.get("quiz_chat"):
+        msg["quiz_chat"] = True
+    return msg
+
+def decode_messages(page):
+    """Decodifica uma página {msg_id: registro} vinda do banco."""
+    return {msg_id: decode_message(record) for msg_id, record in page.items()}
+
+def quiz_event(record):
+    """Mensagem local (chaves longas) de um evento do QuizBot; o texto é montado por quem exibe."""
+    return {"nick": QUIZ_BOT_NICK, "quiz_event": True, "quiz": record}
+
+def is_correct_answer_event(msg):
+    """Se a mensagem anuncia que alguém acertou (no v2 pelo registro, no formato antigo pelo HTML)."""
+    record = msg.get("quiz")
+    if isinstance(record, dict):
+        return record.get("k") == QUIZ_RESULT and bool(record.get("ok"))
+    return bool(msg.get("quiz_event")) and "acertou!" in (msg.get("text") or "")
+
+def _text(table, key, lang):
+    texts = table.get(key, {})
+    return texts.get(lang) or texts.get("pt", "")
+
+def render_quiz_event(record, lang="pt"):
+    """HTML de um evento do quiz no idioma `lang` (o mesmo HTML que o QuizBot gravava no formato antigo)."""
+    kind = record.get("k")
+    # Nicks e categorias são escapados; enunciado e alternativas vêm do banco de perguntas e são exibidos como foram escritos.
+    fields = {key: html.escape(str(value)) for key, value in record.items() if isinstance(value, (str, int, float))}
+    fields.update({key: str(record[key]) for key in ("q", "ans") if key in record})
+    if kind == QUIZ_START:
+        return f"<b>{_text(QUIZ_EVENT_TEXTS, QUIZ_START, lang).format(cat=fields.get('cat', ''), by=fields.get('by', ''))}</b>"
+    if kind == QUIZ_RESTART:
+        return f"<b>{_text(QUIZ_EVENT_TEXTS, QUIZ_RESTART, lang)}</b>"
+    if kind == QUIZ_SEPARATOR:
+        return '<div style="border-bottom: 1px solid black; margin: 8px 0;"></div>'
+    if kind == QUIZ_QUESTION:
+        answers = record.get("a") or []
+        options_html = "<br>" + "<br>".join([f"  <b>{i+1})</b> {ans}" for i, ans in enumerate(answers)])
+        return f"<b>❓ {fields.get('q', '')}</b>{options_html}"
+    if kind == QUIZ_RESULT:
+        if record.get("ok"):
+            return f"<font color='green'>🏆 <b>{_text(QUIZ_EVENT_TEXTS, 'correct', lang).format(who=fields.get('who', ''))}</b></font>"
+        return f"<font color='red'>❌ {_text(QUIZ_EVENT_TEXTS, 'wrong', lang).format(who=fields.get('who', ''))}</font>"
+    if kind == QUIZ_TIMEOUT:
+        return (f"<font color='orange'>{_text(QUIZ_EVENT_TEXTS, QUIZ_TIMEOUT, lang)} "
+                f"<b>{fields.get('n', '')}) {fields.get('ans', '')}</b></font>")
+    if kind == QUIZ_ERROR:
+        text = _text(QUIZ_ERROR_TEXTS, record.get("code"), lang) or "{detail}"
+        return f"<b>{text.format(cat=fields.get('cat', ''), detail=fields.get('detail', ''))}</b>"
+    return f"<i>{_text(QUIZ_EVENT_TEXTS, 'unknown', lang)}</i>"
+
+def message_html_text(msg, lang="pt"):
+    """Texto (HTML) de uma mensagem: o renderizado, para eventos do quiz v2, ou o "text" gravado."""
+    record = msg.get("quiz")
+    if isinstance(record, dict):
+        return render_quiz_event(record, lang)
+    return msg.get("text") or ""
@@ -5,6 +5,12 @@ import threading
 import time
 from aqt import mw
 
+from .historico import day_key, post_public_message
+from .liga import get_goal, put_goal
+from .protocolo import (
+    QUIZ_ERROR, QUIZ_QUESTION, QUIZ_RESTART, QUIZ_RESULT, QUIZ_SEPARATOR, QUIZ_START, QUIZ_TIMEOUT, quiz_event
+)
+
 class QuizManager:
     def __init__(self, firebase_api, chat_window, addon_path):
         self.firebase = firebase_api
@@ -29,36 +35,37 @@ class QuizManager:
         try:
             questions_data = self.firebase.get_data(f"quiz_questions/{category_name}", self.chat_window.id_token)
             if not questions_data:
-                self._post_system_message(f"<b>ERRO: Nenhuma pergunta encontrada para a categoria '{category_name}' no Firebase.</b>")
+                self._post_system_message({"k": QUIZ_ERROR, "code": "no_questions", "cat": category_name})
                 return False
 
             for key, value in questions_data.items():
                 if 'question' in value and 'answers' in value and isinstance(value['answers'], list):
-                    self.questions.append(value)
+                    self.questions.append(dict(value, id=key))
 
             if self.questions:
                 print(f"AnkiChat [INFO QUIZ]: Sucesso! {len(self.questions)} perguntas carregadas do Firebase para a categoria '{category_name}'.")
                 return True
             else:
-                self._post_system_message(f"<b>ERRO: Formato de perguntas inválido para a categoria '{category_name}' no Firebase.</b>")
+                self._post_system_message({"k": QUIZ_ERROR, "code": "bad_format", "cat": category_name})
                 return False
         except Exception as e:
-            self._post_system_message(f"<b>ERRO ao carregar o quiz do Firebase: {e}</b>")
+            self._post_system_message({"k": QUIZ_ERROR, "code": "load_failed", "cat": category_name, "detail": str(e)})
             return False
 
-    def _post_system_message(self, text):
+    def _post_system_message(self, record):
+        """Publica um evento do quiz como registro tipado (ver protocolo.py); cada cliente monta o texto no seu idioma."""
         if not self.chat_window.is_connected: return
         # --- INÍCIO DA CORREÇÃO ---
         # Adiciona o UID do anfitrião à mensagem para satisfazer a regra de validação do Firebase.
-        message_data = { 
+        message_data = quiz_event(record)
+        message_data.update({
             "uid": self.chat_window.uid,
-            "nick": "QuizBot", 
-            "text": text, 
-            "timestamp": {".sv": "timestamp"}, 
-            "quiz_event": True 
-        }
+            "timestamp": {".sv": "timestamp"},
+            "day": day_key()
+        })
+        self.chat_window.latency_tracker.stamp(message_data)
         # --- FIM DA CORREÇÃO ---
-        threading.Thread(target=self.firebase.post_data, args=("messages", message_data, self.chat_window.id_token), daemon=True).start()
+        threading.Thread(target=post_public_message, args=(self.firebase, self.chat_window.id_token, message_data), daemon=True).start()
         local_display_msg = message_data.copy()
         local_display_msg["timestamp"] = int(time.time() * 1000)
         self.chat_window.chat_manager.display_message(None, local_display_msg)
@@ -74,7 +81,7 @@ class QuizManager:
         self.current_category_name = category_name
         self.unasked_questions = self.questions.copy()
         random.shuffle(self.unasked_questions)
-        self._post_system_message(f"<b>--- O Quiz de {category_name} começou, iniciado por {starter_nick}! ---</b>")
+        self._post_system_message({"k": QUIZ_START, "cat": category_name, "by": starter_nick})
         threading.Thread(target=self.game_loop, daemon=True).start()
 
     def stop_quiz(self):
@@ -88,7 +95,7 @@ class QuizManager:
     def game_loop(self):
         while self.is_active:
             if not self.unasked_questions:
-                self._post_system_message("<b>Fim de jogo! Todas as perguntas foram feitas. Reiniciando...</b>")
+                self._post_system_message({"k": QUIZ_RESTART})
                 time.sleep(3)
                 self.unasked_questions = self.questions.copy()
                 random.shuffle(self.unasked_questions)
@@ -96,7 +103,7 @@ class QuizManager:
             self.question_resolved.wait()
             if not self.is_active: break
             time.sleep(1.5) 
-            if self.unasked_questions: self._post_system_message('<div style="border-bottom: 1px solid black; margin: 8px 0;"></div>')
+            if self.unasked_questions: self._post_system_message({"k": QUIZ_SEPARATOR})
             time.sleep(3.5)
 
     def ask_next_question(self):
@@ -106,9 +113,11 @@ class QuizManager:
         shuffled_answers = self.current_question_data["answers"].copy()
         random.shuffle(shuffled_answers)
         self.correct_answer_index = shuffled_answers.index(correct_answer) + 1
-        question_html = f"<b>❓ {self.current_question_data['question']}</b>"
-        options_html = "<br>" + "<br>".join([f"  <b>{i+1})</b> {ans}" for i, ans in enumerate(shuffled_answers)])
-        self._post_system_message(f"{question_html}{options_html}")
+        # As alternativas já vão embaralhadas: enviar a permutação junto com a ordem original entregaria a resposta (answers[0]).
+        self._post_system_message({
+            "k": QUIZ_QUESTION, "qid": self.current_question_data.get("id"),
+            "q": self.current_question_data["question"], "a": shuffled_answers
+        })
         self.start_countdown_timer(60)
 
     def start_countdown_timer(self, duration):
@@ -128,8 +137,7 @@ class QuizManager:
     def _on_timeout(self):
         if self.question_resolved.is_set(): return
         correct_text = self.current_question_data['answers'][0]
-        msg = f"<font color='orange'>⏰ Tempo esgotado! A resposta era <b>{self.correct_answer_index}) {correct_text}</b></font>"
-        self._post_system_message(msg)
+        self._post_system_message({"k": QUIZ_TIMEOUT, "n": self.correct_answer_index, "ans": correct_text})
         self.chat_window.timer_updated.emit("Tempo restante: 0s")
         self.firebase.delete_data("quiz_timer", self.chat_window.id_token)
         self.question_resolved.set()
@@ -144,8 +152,7 @@ class QuizManager:
         except ValueError: return
         if answer_num == self.correct_answer_index:
             if self.question_timer: self.question_timer.cancel()
-            msg = f"<font color='green'>🏆 <b>{nickname} acertou!</b></font>"
-            self._post_system_message(msg)
+            self._post_system_message({"k": QUIZ_RESULT, "who": nickname, "ok": True})
             self.chat_window.timer_updated.emit(f"Acertou: {nickname}!")
             self.firebase.delete_data("quiz_timer", self.chat_window.id_token)
             self._update_user_quiz_score(uid, nickname)
@@ -155,8 +162,7 @@ class QuizManager:
             self.chat_window.main_ranking_update_signal.emit()
             self.question_resolved.set()
         else:
-            msg = f"<font color='red'>❌ {nickname} errou.</font>"
-            self._post_system_message(msg)
+            self._post_system_message({"k": QUIZ_RESULT, "who": nickname, "ok": False})
 
 
 
@@ -176,6 +182,6 @@ class QuizManager:
 
     def _task_update_pr_points(self, uid, cw):
         if not cw.is_connected: return
-        goal_data = self.firebase.get_data(f"goals/{uid}", cw.id_token) or {}
+        goal_data = get_goal(self.firebase, uid, cw.id_token) or {}
         goal_data["retention_points"] = goal_data.get("retention_points", 0) + 1
-        self.firebase.put_data(f"goals/{uid}", goal_data, cw.id_token)
\ No newline at end of file
+        put_goal(self.firebase, uid, goal_data, cw.id_token)
\ No newline at end of file
@@ -0,0 +1,67 @@
+# -- coding: utf-8 --
+# ranking.py - Módulo com a classificação das séries da liga do AnkiChat
+
+try:
+    import numpy
+except ImportError:
+    # O Anki nem sempre traz o NumPy: a classificação cai para o sort do Python, com o mesmo resultado.
+    numpy = None
+
+DIVISIONS = ("A", "B", "C", "D")
+# Critérios na ordem em que desempatam, todos do maior para o menor. O último desempate é o uid,
+# em ordem crescente: dois usuários com os mesmos números ficam sempre na mesma ordem, na tela e no fim da temporada.
+RANKING_FIELDS = ("retention_points", "meta_points", "study_time_week", "new_cards_week")
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    # NaN não tem ordem; conta como zero, igual a um campo vazio.
+    return 0.0 if number != number else number
+
+def rank_divisions(goals_data, use_numpy=None):
+    """{série: [uid, ...]} do primeiro ao último colocado de cada série.
+    Usuários sem "division" ficam na D; séries fora de DIVISIONS aparecem depois das quatro."""
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    uids = sorted(uid for uid, goal_data in goals_data.items() if isinstance(goal_data, dict))
+    division_names = list(DIVISIONS)
+    for uid in uids:
+        name = goals_data[uid].get("division", "D")
+        if name not in division_names:
+            division_names.append(name)
+    if use_numpy and uids:
+        return _rank_columnar(goals_data, uids, division_names)
+    return _rank_sorted(goals_data, uids, division_names)
+
+def _rank_sorted(goals_data, uids, division_names):
+    ranked = {name: [] for name in division_names}
+    for uid in uids:
+        ranked[goals_data[uid].get("division", "D")].append(uid)
+    for name, division_uids in ranked.items():
+        # `uids` já está em ordem crescente e o sort é estável: empates completos ficam pelo uid.
+        division_uids.sort(key=lambda uid: tuple(-_number(goals_data[uid].get(field, 0)) for field in RANKING_FIELDS))
+    return ranked
+
+def _rank_columnar(goals_data, uids, division_names):
+    """Uma coluna por critério e um único lexsort para todas as séries juntas."""
+    division_codes = {name: code for code, name in enumerate(division_names)}
+    rows = [goals_data[uid] for uid in uids]
+    division_column = numpy.array([division_codes[row.get("division", "D")] for row in rows], dtype=numpy.int64)
+    columns = []
+    for field in RANKING_FIELDS:
+        values = [row.get(field, 0) for row in rows]
+        try:
+            column = numpy.array(values, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            # Algum valor estranho (texto): converte um a um, como no caminho sem NumPy.
+            column = numpy.array([_number(value) for value in values], dtype=numpy.float64)
+        # None vira NaN na conversão direta; _number conta como zero, e as duas classificações têm que bater.
+        column[numpy.isnan(column)] = 0.0
+        columns.append(-column)
+    # lexsort usa a última chave como principal; a posição em `uids` (já ordenado) é o desempate final.
+    order = numpy.lexsort([numpy.arange(len(uids))] + columns[::-1] + [division_column])
+    boundaries = numpy.searchsorted(division_column[order], numpy.arange(len(division_names) + 1)).tolist()
+    order = order.tolist()
+    return {name: [uids[i] for i in order[boundaries[code]:boundaries[code + 1]]] for code, name in enumerate(division_names)}
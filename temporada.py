@@ -0,0 +1,163 @@
+# -- coding: utf-8 --
+# temporada.py - Módulo para o processamento do fim de temporada da liga do AnkiChat
+
+import re
+from datetime import datetime
+
+from .ranking import rank_divisions
+from .liga import goal_field_updates, medal_count_updates, read_all_goals
+from .latencia import CLOCK_PROBE_ROOT
+
+LEAGUE_STATUS_PATH = "league_status"
+# Trava do processamento, dentro de league_status: {"week", "owner", "token", "started_at"}. Ela é gravada
+# com PUT condicional (ETag) e some na mesma escrita que aplica a temporada.
+SEASON_END_LOCK_KEY = "season_end"
+# Uma trava mais velha do que isto (relógio do servidor) é de um cliente que caiu no meio: outro pode retomar.
+SEASON_END_LOCK_SECONDS = 600
+# Tentativas de pegar a trava quando league_status muda entre a leitura e a escrita (quiz, outro admin).
+SEASON_END_LOCK_ATTEMPTS = 3
+PROMOTION_COUNT = 2
+# Campos zerados no início de cada temporada; os demais (matéria, metas, bandeira) ficam como estão.
+SEASON_RESET_FIELDS = {
+    "retention_points": 0, "meta_points": 0, "reviews_week": 0,
+    "reviews_today": 0, "study_time_week": 0, "study_time_today": 0,
+    "new_cards_week": 0, "last_update_day": 0
+}
+MEDAL_BY_POSITION = {1: "gold", 2: "silver", 3: "bronze"}
+
+def season_week_key(now=None):
+    """Chave de idempotência da temporada: a semana do calendário em que ela é processada ("semana_ano")."""
+    now = now or datetime.now()
+    return f"{now.isocalendar()[1]}_{now.year}"
+
+def relegation_count(division_size):
+    if division_size <= 2: return 0
+    if division_size == 3: return 1
+    return 2
+
+def new_divisions(ranked):
+    """{uid: série nova} de quem sobe ou desce, a partir de {série: [uid, ...]} já classificado."""
+    assignments = {}
+    for lower, upper in (("D", "C"), ("C", "B"), ("B", "A")):
+        for uid in ranked.get(lower, [])[:PROMOTION_COUNT]: assignments[uid] = upper
+    for upper, lower in (("A", "B"), ("B", "C"), ("C", "D")):
+        count = relegation_count(len(ranked.get(upper, [])))
+        if count > 0:
+            for uid in ranked[upper][-count:]: assignments[uid] = lower
+    return assignments
+
+def season_end_updates(firebase_api, all_goals, all_users, season_key, id_token):
+    """Todas as escritas da virada de temporada, para um PATCH multi-path só: legado de cada usuário,
+    conquistas e contadores dos medalhistas, e as metas zeradas campo a campo (com a série nova).
+    Todos os valores são absolutos: aplicar de novo a mesma temporada dá o mesmo resultado."""
+    ranked = rank_divisions(all_goals)
+    updates = {}
+    season_achievements = {}
+    for div_name, div_uids in ranked.items():
+        for i, user_uid in enumerate(div_uids):
+            position = i + 1
+            data = all_goals[user_uid]
+            nick = all_users.get(user_uid, {}).get("nickname")
+            if not nick or re.search(r'[.#$\[\]]', nick): continue
+
+            legacy_entry = {
+                "season_key": season_key, "division": div_name, "position": position,
+                "retention_points": data.get("retention_points", 0),
+                "meta_points": data.get("meta_points", 0), "medal": MEDAL_BY_POSITION.get(position)
+            }
+            updates[f"legacy/{user_uid}/{season_key}"] = legacy_entry
+            if legacy_entry["medal"]:
+                updates[f"achievements/{nick}/{season_key}"] = legacy_entry
+                season_achievements[nick] = legacy_entry
+    updates.update(medal_count_updates(firebase_api, season_achievements, season_key, id_token))
+
+    assignments = new_divisions(ranked)
+    for user_uid, data in all_goals.items():
+        fields = dict(SEASON_RESET_FIELDS)
+        if data.get("reviews_week", 0) == 0:
+            fields["division"] = "D"
+        elif user_uid in assignments:
+            fields["division"] = assignments[user_uid]
+        updates.update(goal_field_updates(user_uid, data, fields))
+    return updates
+
+class SeasonEnd:
+    """Virada de temporada em etapas, segura com mais de um cliente de admin aberto:
+    1. trava em league_status/season_end, gravada com PUT condicional ao ETag lido (quem perde a corrida desiste);
+    2. leitura da liga e montagem de todas as escritas (season_end_updates);
+    3. um único PATCH multi-path com legado, conquistas, metas e o novo league_status, que também solta a trava.
+    Se o cliente cair antes do passo 3 nada foi aplicado, e a mesma semana é processada de novo depois
+    (pelo mesmo admin na hora, ou por outro quando a trava passar de SEASON_END_LOCK_SECONDS)."""
+    def __init__(self, firebase_api, uid, id_token):
+        self.firebase = firebase_api
+        self.uid = uid
+        self.id_token = id_token
+        self.token = None
+
+    def run(self, now=None):
+        """Processa a temporada se a semana virou. Retorna True se a virada foi aplicada agora."""
+        week_key = season_week_key(now)
+        league_status = self._acquire_lock(week_key)
+        if league_status is None:
+            return False
+        season_number = league_status.get("season_counter", 1)
+        print(f"AnkiChat: Detectado fim de temporada. Processando Semana {league_status.get('last_processed_week', '0_0')} -> {week_key}...")
+
+        all_goals = read_all_goals(self.firebase, self.id_token)
+        all_users = self.firebase.get_data("users", self.id_token) or {}
+        if not all_goals or not all_users:
+            self._release_lock()
+            return False
+
+        season_key = f"{season_number}_{(now or datetime.now()).year}"
+        updates = season_end_updates(self.firebase, all_goals, all_users, season_key, self.id_token)
+        updates.update({
+            f"{LEAGUE_STATUS_PATH}/season_counter": season_number + 1,
+            f"{LEAGUE_STATUS_PATH}/last_processed_week": week_key,
+            # Remove o timestamp antigo para manter o banco de dados limpo.
+            f"{LEAGUE_STATUS_PATH}/season_start_timestamp": None,
+            f"{LEAGUE_STATUS_PATH}/{SEASON_END_LOCK_KEY}": None,
+        })
+        if not self._still_locked():
+            print("AnkiChat: Fim de temporada assumido por outro cliente; nada foi gravado por este.")
+            return False
+        if not self.firebase.patch_data("", updates, self.id_token):
+            return False
+        print(f"AnkiChat: Processamento da Temporada {season_number} concluído.")
+        return True
+
+    def _acquire_lock(self, week_key):
+        """league_status já com a trava deste cliente, ou None (semana já processada, trava de outro, ou falha)."""
+        for _ in range(SEASON_END_LOCK_ATTEMPTS):
+            league_status, etag = self.firebase.get_with_etag(LEAGUE_STATUS_PATH, self.id_token)
+            if etag is None:
+                return None
+            league_status = league_status if isinstance(league_status, dict) else {}
+            if str(league_status.get("last_processed_week", "0_0")) == week_key:
+                return None
+            lock = league_status.get(SEASON_END_LOCK_KEY)
+            if isinstance(lock, dict) and lock.get("owner") != self.uid and not self._lock_expired(lock):
+                print("AnkiChat: Fim de temporada já em processamento por outro cliente.")
+                return None
+            self.token = self.firebase.generate_push_id()
+            locked_status = dict(league_status)
+            locked_status[SEASON_END_LOCK_KEY] = {"week": week_key, "owner": self.uid, "token": self.token,
+                                                  "started_at": {".sv": "timestamp"}}
+            if self.firebase.put_if_match(LEAGUE_STATUS_PATH, locked_status, etag, self.id_token):
+                return league_status
+        return None
+
+    def _lock_expired(self, lock):
+        server_now = self.firebase.server_time(f"{CLOCK_PROBE_ROOT}/{self.uid}", self.id_token)
+        started_at = lock.get("started_at")
+        if server_now is None or not isinstance(started_at, (int, float)):
+            return False
+        return server_now - started_at > SEASON_END_LOCK_SECONDS * 1000
+
+    def _still_locked(self):
+        lock = self.firebase.get_data(f"{LEAGUE_STATUS_PATH}/{SEASON_END_LOCK_KEY}", self.id_token)
+        return isinstance(lock, dict) and lock.get("token") == self.token
+
+    def _release_lock(self):
+        if self._still_locked():
+            self.firebase.patch_data(LEAGUE_STATUS_PATH, {SEASON_END_LOCK_KEY: None}, self.id_token)
@@ -0,0 +1,203 @@
+# -- coding: utf-8 --
+# usuarios.py - Módulo para a lista de usuários (painel esquerdo) do AnkiChat
+
+import bisect
+
+from aqt.qt import QAbstractListModel, QSortFilterProxyModel, QModelIndex, QColor, QFont, QIcon, Qt
+
+# Chave da linha de título da seção offline (nicks nunca começam com "\0").
+OFFLINE_HEADER_KEY = "\0offline"
+# Usuários offline entram no modelo em blocos deste tamanho, conforme a lista é rolada.
+OFFLINE_PAGE_SIZE = 200
+
+class UserListModel(QAbstractListModel):
+    """Usuários online (ordenados por nick), uma linha de título "Offline (N)" e, se a seção estiver
+    aberta, os offline, carregados aos poucos (canFetchMore/fetchMore). As atualizações do polling
+    viram inserções e remoções de linhas, nunca uma reconstrução da lista."""
+    def __init__(self, chat_window, parent=None):
+        super().__init__(parent)
+        self.cw = chat_window
+        # Cada seção é uma lista ordenada de (chave de ordenação, nick); "loaded" é quantas estão no modelo.
+        self.sections = {"online": [], "offline": []}
+        self.loaded = {"online": 0, "offline": 0}
+        self.offline_expanded = False
+        self.has_header = False
+        self.user_flags = {}
+
+    # --- Estrutura das linhas ---
+
+    def _section_start(self, name):
+        return 0 if name == "online" else self.loaded["online"] + (1 if self.has_header else 0)
+
+    def _shows_all(self, name):
+        return name == "online" or self.offline_expanded
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.loaded["online"] + (1 if self.has_header else 0) + self.loaded["offline"]
+
+    def row_key(self, row):
+        online = self.loaded["online"]
+        if row < online:
+            return self.sections["online"][row][1]
+        if self.has_header and row == online:
+            return OFFLINE_HEADER_KEY
+        return self.sections["offline"][row - self._section_start("offline")][1]
+
+    def is_online_row(self, row):
+        return row < self.loaded["online"]
+
+    def online_count(self):
+        return len(self.sections["online"])
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        key = self.row_key(index.row())
+        if key == OFFLINE_HEADER_KEY:
+            if role == Qt.ItemDataRole.DisplayRole:
+                arrow = "▾" if self.offline_expanded else "▸"
+                return f"------ {arrow} Offline ({len(self.sections['offline'])}) ------"
+            if role == Qt.ItemDataRole.ForegroundRole: return QColor("grey")
+            if role == Qt.ItemDataRole.TextAlignmentRole: return Qt.AlignmentFlag.AlignCenter
+            if role == Qt.ItemDataRole.UserRole: return key
+            return None
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.UserRole):
+            return key
+        if role == Qt.ItemDataRole.ForegroundRole:
+            if not self.is_online_row(index.row()): return QColor("grey")
+            if key == self.cw.admin_nick: return QColor("blue")
+            if key == self.cw.nickname: return QColor("green")
+            return None
+        if role == Qt.ItemDataRole.FontRole and key in self.cw.chat_manager.unread_pms:
+            font = QFont()
+            font.setBold(True)
+            return font
+        if role == Qt.ItemDataRole.DecorationRole:
+            icon = self.cw.flag_assets.icon(self.user_flags.get(key))
+            return icon if icon else QIcon()
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        if self.row_key(index.row()) == OFFLINE_HEADER_KEY:
+            return Qt.ItemFlag.ItemIsEnabled
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+
+    # --- Carga preguiçosa da seção offline ---
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.offline_expanded and self.loaded["offline"] < len(self.sections["offline"])
+
+    def fetchMore(self, parent=QModelIndex(), count=OFFLINE_PAGE_SIZE):
+        if not self.canFetchMore(parent):
+            return
+        start = self._section_start("offline") + self.loaded["offline"]
+        count = min(count, len(self.sections["offline"]) - self.loaded["offline"])
+        self.beginInsertRows(QModelIndex(), start, start + count - 1)
+        self.loaded["offline"] += count
+        self.endInsertRows()
+
+    def fetch_all(self):
+        """Carrega todos os offline de uma vez (a busca rápida precisa filtrar a seção inteira)."""
+        self.fetchMore(count=len(self.sections["offline"]))
+
+    def set_offline_expanded(self, expanded):
+        if expanded == self.offline_expanded:
+            return
+        self.offline_expanded = expanded
+        if not expanded and self.loaded["offline"]:
+            start = self._section_start("offline")
+            self.beginRemoveRows(QModelIndex(), start, start + self.loaded["offline"] - 1)
+            self.loaded["offline"] = 0
+            self.endRemoveRows()
+        self._header_changed()
+        if expanded:
+            self.fetchMore()
+
+    def refresh_nick(self, nick):
+        """Redesenha a linha do nick, se ela estiver no modelo (negrito das privadas não lidas)."""
+        for name in ("online", "offline"):
+            position = bisect.bisect_left(self.sections[name], (nick.lower(), nick))
+            if position < self.loaded[name] and self.sections[name][position][1] == nick:
+                index = self.index(self._section_start(name) + position)
+                self.dataChanged.emit(index, index, [Qt.ItemDataRole.FontRole])
+                return
+
+    def _header_changed(self):
+        if self.has_header:
+            index = self.index(self.loaded["online"])
+            self.dataChanged.emit(index, index)
+
+    # --- Atualização a partir do polling ---
+
+    def clear(self):
+        self.beginResetModel()
+        self.sections = {"online": [], "offline": []}
+        self.loaded = {"online": 0, "offline": 0}
+        self.has_header = False
+        self.user_flags = {}
+        self.endResetModel()
+
+    def set_users(self, online_nicks, offline_nicks, user_flags):
+        """Aplica a lista atual de usuários com o mínimo de mudanças no modelo."""
+        changed_flags = {nick for nick in set(user_flags) | set(self.user_flags) if user_flags.get(nick) != self.user_flags.get(nick)}
+        self.user_flags = dict(user_flags)
+        offline_keys = sorted((nick.lower(), nick) for nick in offline_nicks)
+        self._sync_section("online", sorted((nick.lower(), nick) for nick in online_nicks))
+        if offline_keys and not self.has_header:
+            row = self.loaded["online"]
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.has_header = True
+            self.endInsertRows()
+        self._sync_section("offline", offline_keys)
+        if not offline_keys and self.has_header:
+            row = self.loaded["online"]
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self.has_header = False
+            self.endRemoveRows()
+        self._header_changed()
+        if changed_flags:
+            for row in range(self.rowCount()):
+                if self.row_key(row) in changed_flags:
+                    index = self.index(row)
+                    self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def _sync_section(self, name, new_keys):
+        keys = self.sections[name]
+        shows_all = self._shows_all(name) and self.loaded[name] == len(keys)
+        wanted = set(new_keys)
+        for position in range(len(keys) - 1, -1, -1):
+            if keys[position] in wanted:
+                continue
+            if position < self.loaded[name]:
+                row = self._section_start(name) + position
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del keys[position]
+                self.loaded[name] -= 1
+                self.endRemoveRows()
+            else:
+                del keys[position]
+        present = set(keys)
+        for key in new_keys:
+            if key in present:
+                continue
+            position = bisect.bisect_left(keys, key)
+            if shows_all or position < self.loaded[name]:
+                row = self._section_start(name) + position
+                self.beginInsertRows(QModelIndex(), row, row)
+                keys.insert(position, key)
+                self.loaded[name] += 1
+                self.endInsertRows()
+            else:
+                keys.insert(position, key)
+
+class UserFilterProxyModel(QSortFilterProxyModel):
+    """Busca rápida por nick; a linha de título da seção offline nunca é filtrada."""
+    def filterAcceptsRow(self, source_row, source_parent):
+        model = self.sourceModel()
+        if model.row_key(source_row) == OFFLINE_HEADER_KEY:
+            return True
+        return super().filterAcceptsRow(source_row, source_parent)
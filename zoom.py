@@ -41,7 +41,7 @@ class ZoomManager:
         
         # Aplica zoom aos widgets
         cw.user_list.setFont(QFont("Arial", self.base_font_sizes["user_list"] + self.ctrl_zoom_level))
-        cw.goals_area.setFont(QFont("Courier New", self.base_font_sizes["goals"] + self.ctrl_zoom_level))
+        cw.goals_view.setFont(QFont("Courier New", self.base_font_sizes["goals"] + self.ctrl_zoom_level))
         cw.hall_of_fame_widget.user_list.setFont(QFont("Arial", self.base_font_sizes["hall_of_fame_list"] + self.ctrl_zoom_level))
         cw.hall_of_fame_widget.achievements_area.setFont(QFont("Arial", self.base_font_sizes["hall_of_fame_ach"] + self.ctrl_zoom_level))
         cw.legacy_tab.legacy_area.setFont(QFont("Arial", self.base_font_sizes["legacy"] + self.ctrl_zoom_level))